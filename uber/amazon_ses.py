@@ -34,6 +34,7 @@ class AmazonSES:
         self._accessKeyID = accessKeyID
         self._secretAccessKey = secretAccessKey
         self._responseParser = AmazonResponseParser()
+        self._conn = None
 
     def _getSignature(self, dateValue):
         h = hmac.new(key=self._secretAccessKey.encode(), msg=dateValue.encode(), digestmod=hashlib.sha256)
@@ -48,17 +49,37 @@ class AmazonSES:
         headers['X-Amzn-Authorization'] = 'AWS3-HTTPS AWSAccessKeyId=%s, Algorithm=HMACSHA256, Signature=%s' % (self._accessKeyID, signature)
         return headers
     
+    def _getConnection(self):
+        if self._conn is None:
+            #https://email.us-east-1.amazonaws.com/
+            self._conn = http.client.HTTPSConnection('email.us-east-1.amazonaws.com')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(self, params):
+        conn = self._getConnection()
+        conn.request('POST', '/', params, self._getHeaders())
+        response = conn.getresponse()
+        return response, response.read()
+
     def _performAction(self, actionName, params=None):
         if not params:
             params = {}
-        params['Action'] = actionName        
-        #https://email.us-east-1.amazonaws.com/
-        conn = http.client.HTTPSConnection('email.us-east-1.amazonaws.com')
+        params['Action'] = actionName
         params = urllib.parse.urlencode(params)
-        conn.request('POST', '/', params, self._getHeaders())
-        response = conn.getresponse()
-        responseResult = response.read()
-        conn.close()
+        try:
+            response, responseResult = self._request(params)
+        except (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError):
+            # we keep our connection open between requests, so if the server has closed it then reconnect and retry
+            self.close()
+            response, responseResult = self._request(params)
+        except:
+            self.close()
+            raise
         return self._responseParser.parse(actionName, response.status, response.reason, responseResult)
         
     def verifyEmailAddress(self, emailAddress):
@@ -0,0 +1,160 @@
+from uber.common import *
+
+
+class AttendeeImport:
+    """
+    Imports attendees from a CSV file in the format written by the
+    summary.all_attendees export, i.e. one column per Attendee column with
+    labels for Choice and MultiChoice columns.  Rows with the id of an
+    existing attendee update that attendee and all other rows create new ones.
+
+    The file is parsed as it's read rather than loaded all at once, and each
+    column's converter is built once from the header row.  We look up which
+    ids already exist with a single query, and then load and save attendees
+    c.CSV_BATCH_SIZE rows at a time, flushing each batch in a savepoint.  If a
+    batch fails to flush we retry its rows one at a time, so that each bad row
+    is reported in self.errors as (row number, error message) and the rest of
+    the batch is still imported.  Nothing is committed; that's up to the caller.
+
+    With bulk=True, new attendees are inserted with multi-row INSERTs (one
+    for each set of non-empty columns in a batch), bypassing our presave
+    adjustments (so e.g. no badge numbers are assigned) and recording one
+    Tracking entry for the whole import rather than one per attendee.
+    Existing attendees are still updated normally.
+    """
+    def __init__(self, session, date_format='%Y-%m-%d', bulk=False):
+        self.session, self.date_format, self.bulk = session, date_format, bulk
+        self.columns = {col.name: col for col in Attendee.__table__.columns}
+        self.ids, self.errors = [], []
+        self.created = self.updated = 0
+        self.elapsed = 0
+
+    @property
+    def rows_per_second(self):
+        return (self.created + self.updated) / self.elapsed if self.elapsed else 0
+
+    def converter(self, col):
+        if isinstance(col.type, Choice):
+            # the export has labels, and we want to convert those back into their integer values
+            lookup = {label: val for val, label in dict(col.type.choices).items()}
+            return lambda val: lookup[val]
+        elif isinstance(col.type, MultiChoice):
+            # the export has labels separated by ' / ' and we want a comma-separated list of integers
+            lookup = {label: val for val, label in dict(col.type.choices).items()}
+            return lambda val: ','.join(str(lookup[label]) for label in val.split(' / '))
+        elif isinstance(col.type, UTCDateTime):
+            # we'll need to make sure we use whatever format string we used to export this date
+            def convert(val):
+                try:
+                    return UTC.localize(datetime.strptime(val, self.date_format + ' %H:%M:%S'))
+                except ValueError:
+                    return UTC.localize(datetime.strptime(val, self.date_format))
+            return convert
+        elif isinstance(col.type, Date):
+            return lambda val: datetime.strptime(val, self.date_format).date()
+        elif isinstance(col.type, Integer):
+            return int
+        else:
+            return lambda val: val
+
+    def run(self, f):
+        """
+        Imports every row of the given binary file object, e.g. the file of an
+        uploaded CherryPy Part.
+        """
+        before = monotonic()
+        reader = csv.DictReader(codecs.iterdecode(f, 'utf-8'))
+        unknown = [name for name in reader.fieldnames or [] if name not in self.columns]
+        if unknown:
+            raise ValueError('unknown columns: {}'.format(', '.join(unknown)))
+
+        converters = {name: self.converter(self.columns[name]) for name in reader.fieldnames if name != 'id'}
+        existing = {id for id, in self.session.query(Attendee.id)}
+        batch = []
+        for row_num, row in enumerate(reader, 2):  # the header is the first row of the file
+            batch.append((row_num, row))
+            if len(batch) >= c.CSV_BATCH_SIZE:
+                self.import_batch(batch, converters, existing)
+                batch = []
+        if batch:
+            self.import_batch(batch, converters, existing)
+
+        if self.bulk and self.created:
+            Tracking.track_bulk_import(self.session, Attendee, self.created)
+        self.elapsed = monotonic() - before
+
+    def convert(self, row, converters):
+        # empty cells are left alone rather than clearing or defaulting anything
+        return {name: converters[name](val) for name, val in row.items() if name != 'id' and val}
+
+    def import_batch(self, batch, converters, existing):
+        ids = [row.get('id') for row_num, row in batch if row.get('id') in existing]
+        attendees = {a.id: a for a in self.session.query(Attendee).filter(Attendee.id.in_(ids))} if ids else {}
+
+        converted = []
+        for row_num, row in batch:
+            try:
+                converted.append((row_num, row.get('id'), self.convert(row, converters)))
+            except Exception as e:
+                self.errors.append((row_num, 'unable to read {!r}: {}'.format(dict(row), e)))
+
+        try:
+            with self.session.begin_nested():
+                results = self.save(converted, attendees)
+        except Exception:
+            log.warning('unable to import a batch of attendees, retrying each row on its own', exc_info=True)
+            results = []
+            for row_num, id, values in converted:
+                try:
+                    with self.session.begin_nested():
+                        results.extend(self.save([(row_num, id, values)], attendees))
+                except Exception as e:
+                    self.errors.append((row_num, str(e)))
+
+        for id, created in results:
+            self.ids.append(id)
+            existing.add(id)
+            if created:
+                self.created += 1
+            else:
+                self.updated += 1
+
+    def save(self, rows, attendees):
+        """
+        Saves the given converted rows and flushes them within the caller's
+        savepoint, returning a list of (attendee id, whether it was created).
+        """
+        saved, inserts = [], []
+        for row_num, id, values in rows:
+            if id in attendees:
+                attendee = attendees[id]
+                for name, val in values.items():
+                    setattr(attendee, name, val)
+                saved.append((attendee, False))
+            elif self.bulk:
+                inserts.append(dict(values, id=id or str(uuid4())))
+            else:
+                attendee = Attendee(**values)
+                if id:
+                    attendee.id = id
+                self.session.add(attendee)
+                saved.append((attendee, True))
+
+        self.session.flush()
+        if inserts:
+            # an executemany INSERT needs every row to have the same columns, and rows
+            # with empty cells should still get our column defaults for those cells
+            by_columns = defaultdict(list)
+            for values in inserts:
+                by_columns[frozenset(values)].append(values)
+            for rows in by_columns.values():
+                self.session.execute(Attendee.__table__.insert(), rows)
+
+            # our before_flush listener never sees these rows, so we index their MultiChoice values ourselves
+            choices = [choice for values in inserts
+                              for name in ModelMetadata.get(Attendee).indexed_multichoice_columns if values.get(name)
+                              for choice in MultiChoiceValue.rows(Attendee.__tablename__, values['id'], name, values[name])]
+            if choices:
+                self.session.execute(MultiChoiceValue.__table__.insert(), choices)
+            note_changed_tables(self.session, Attendee.__tablename__, MultiChoiceValue.__tablename__)
+        return [(attendee.id, created) for attendee, created in saved] + [(values['id'], True) for values in inserts]
@@ -8,13 +8,31 @@ from uber.common import *
 class AutomatedEmail:
     instances = OrderedDict()
 
-    def __init__(self, model, subject, template, filter, *, sender=None, extra_data=None, cc=None, bcc=None, post_con=False, needs_approval=False):
-        self.model, self.template, self.needs_approval = model, template, needs_approval
+    # how many models we load at a time when checking who should get an email
+    batch_size = 500
+
+    # relationships which most emails for each model need; we eagerly load these for every email
+    default_query_options = {
+        Attendee: [joinedload(Attendee.group)],
+        Group: [joinedload(Group.leader), subqueryload(Group.attendees)]
+    }
+
+    def __init__(self, model, subject, template, filter, *, query=(), query_options=(), sender=None, extra_data=None, cc=None, bcc=None, post_con=False, needs_approval=False):
+        """
+        The query parameter is an optional list of SQL clauses which narrow
+        down which models we even bother checking with our filter function, so
+        it should always match at least every model our filter would accept.
+        The query_options parameter is an optional list of loader options like
+        joinedload() for whatever relationships the filter and template use.
+        """
+        self.model, self.template, self.needs_approval, self.post_con = model, template, needs_approval, post_con
         self.subject = subject.format(EVENT_NAME=c.EVENT_NAME)
         self.cc = cc or []
         self.bcc = bcc or []
         self.extra_data = extra_data or {}
         self.sender = sender or c.REGDESK_EMAIL
+        self.query = list(query)
+        self.query_options = self.default_query_options.get(model, []) + list(query_options)
         self.instances[self.subject] = self
         if post_con:
             self.filter = lambda x: c.POST_CON and filter(x)
@@ -25,11 +43,12 @@ class AutomatedEmail:
         return '<{}: {!r}>'.format(self.__class__.__name__, self.subject)
 
     def prev(self, x, all_sent=None):
-        if all_sent:
-            return all_sent.get((x.__class__.__name__, x.id, self.subject))
+        if all_sent is not None:
+            return (x.__class__.__name__, x.id, self.subject) in all_sent
         else:
             with Session() as session:
-                return session.query(Email).filter_by(model=x.__class__.__name__, fk_id=x.id, subject=self.subject).all()
+                return any(session.query(m).filter_by(model=x.__class__.__name__, fk_id=x.id, subject=self.subject).count()
+                           for m in [Email, OutgoingEmail])
 
     def should_send(self, x, all_sent=None):
         try:
@@ -50,30 +69,66 @@ class AutomatedEmail:
             if raise_errors:
                 raise
 
-    # TODO: joinedload on other tables such as shifts as well, for performance (this method is WAY slower than it could be)
+    def candidates(self, session):
+        """
+        Returns everything which might receive this email, narrowed down in
+        SQL by our query clauses; our filter function still gets the final say.
+        """
+        if self.model == 'SeasonPass':
+            return session.season_passes()
+        else:
+            return session.query(self.model).filter(*self.query).options(*self.query_options)
+
+    def batches(self, session, all_sent):
+        """
+        Yields lists of candidates for this email, skipping the ones we've
+        already sent it to before loading them.  Each batch is expunged from
+        the session once we're done with it so that we don't hold onto every
+        attendee in memory over the course of a run.
+        """
+        if self.model == 'SeasonPass':
+            yield self.candidates(session)
+        else:
+            ids = session.query(self.model.id).filter(*self.query)
+            if self.model is Attendee:
+                ids = ids.filter(Attendee.email != '')
+            ids = [id for id, in ids if (self.model.__name__, id, self.subject) not in all_sent]
+            for i in range(0, len(ids), self.batch_size):
+                yield self.candidates(session).filter(self.model.id.in_(ids[i:i + self.batch_size])).all()
+                session.expunge_all()
+
     @classmethod
     def send_all(cls, raise_errors=False):
         if not c.AT_THE_CON and (c.DEV_BOX or c.SEND_EMAILS):
             with Session() as session:
-                attendees, groups = session.everyone()
                 approved = {ae.subject for ae in session.query(ApprovedEmail).all()}
-                models = {Attendee: attendees, Group: groups, 'SeasonPass': session.season_passes()}
-                all_sent = {(e.model, e.fk_id, e.subject): e for e in session.query(Email).all()}
-                for rem in cls.instances.values():
-                    if not rem.needs_approval or rem.subject in approved:
-                        for x in models[rem.model]:
+                active = [rem for rem in cls.instances.values()
+                          if bool(rem.post_con) == bool(c.POST_CON) and (not rem.needs_approval or rem.subject in approved)]
+                if not active:
+                    return
+
+                subjects = [rem.subject for rem in active]
+                all_sent = set(session.query(Email.model, Email.fk_id, Email.subject).filter(Email.subject.in_(subjects)))
+                all_sent.update(session.query(OutgoingEmail.model, OutgoingEmail.fk_id, OutgoingEmail.subject)
+                                       .filter(OutgoingEmail.subject.in_(subjects)))
+                for rem in active:
+                    for batch in rem.batches(session, all_sent):
+                        for x in batch:
                             if rem.should_send(x, all_sent):
                                 rem.send(x, raise_errors=raise_errors)
+                                all_sent.add((x.__class__.__name__, x.id, rem.subject))
 
 
 class StopsEmail(AutomatedEmail):
-    def __init__(self, subject, template, filter, **kwargs):
-        AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.staffing and filter(a), sender=c.STAFF_EMAIL, **kwargs)
+    def __init__(self, subject, template, filter, *, query=(), **kwargs):
+        AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.staffing and filter(a), sender=c.STAFF_EMAIL,
+                                query=[Attendee.staffing == True] + list(query), **kwargs)
 
 
 class GuestEmail(AutomatedEmail):
-    def __init__(self, subject, template, filter=lambda a: True, needs_approval=True, **kwargs):
-        AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.badge_type == c.GUEST_BADGE and filter(a), needs_approval=needs_approval, sender=c.PANELS_EMAIL, **kwargs)
+    def __init__(self, subject, template, filter=lambda a: True, needs_approval=True, *, query=(), **kwargs):
+        AutomatedEmail.__init__(self, Attendee, subject, template, lambda a: a.badge_type == c.GUEST_BADGE and filter(a), needs_approval=needs_approval, sender=c.PANELS_EMAIL,
+                                query=[Attendee.badge_type == c.GUEST_BADGE] + list(query), **kwargs)
 
 
 class GroupEmail(AutomatedEmail):
@@ -82,8 +137,9 @@ class GroupEmail(AutomatedEmail):
 
 
 class MarketplaceEmail(AutomatedEmail):
-    def __init__(self, subject, template, filter, **kwargs):
-        AutomatedEmail.__init__(self, Group, subject, template, lambda g: g.is_dealer and filter(g), sender=c.MARKETPLACE_EMAIL, **kwargs)
+    def __init__(self, subject, template, filter, *, query=(), **kwargs):
+        AutomatedEmail.__init__(self, Group, subject, template, lambda g: g.is_dealer and filter(g), sender=c.MARKETPLACE_EMAIL,
+                                query=[Group.tables > 0] + list(query), **kwargs)
 
 
 class SeasonSupporterEmail(AutomatedEmail):
@@ -103,7 +159,9 @@ class DeptChecklistEmail(AutomatedEmail):
                                 template='shifts/dept_checklist.txt',
                                 filter=lambda a: a.is_single_dept_head and a.admin_account and days_before(7, conf.deadline) and not conf.completed(a),
                                 sender=c.STAFF_EMAIL,
-                                extra_data={'conf': conf})
+                                extra_data={'conf': conf},
+                                query=[Attendee.ribbon == c.DEPT_HEAD_RIBBON],
+                                query_options=[joinedload(Attendee.admin_account), subqueryload(Attendee.dept_checklist_items)])
 
 before = lambda dt: bool(dt) and localized_now() < dt
 after = lambda dt: bool(dt) and localized_now() > dt
@@ -120,16 +178,19 @@ def days_before(days, dt, until=None):
 # won't get sent if group registration is turned off.
 
 AutomatedEmail(Attendee, '{EVENT_NAME} payment received', 'reg_workflow/attendee_confirmation.html',
-         lambda a: a.paid == c.HAS_PAID)
+         lambda a: a.paid == c.HAS_PAID,
+         query=[Attendee.paid == c.HAS_PAID])
 
 AutomatedEmail(Group, '{EVENT_NAME} group payment received', 'reg_workflow/group_confirmation.html',
          lambda g: g.amount_paid == g.cost and g.cost != 0)
 
 AutomatedEmail(Attendee, '{EVENT_NAME} group registration confirmed', 'reg_workflow/attendee_confirmation.html',
-         lambda a: a.group and a != a.group.leader and not a.placeholder)
+         lambda a: a.group and a != a.group.leader and not a.placeholder,
+         query=[Attendee.group_id != None, Attendee.placeholder == False])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} extra payment received', 'reg_workflow/group_donation.txt',
-         lambda a: a.paid == c.PAID_BY_GROUP and a.amount_extra and a.amount_paid == a.amount_extra)
+         lambda a: a.paid == c.PAID_BY_GROUP and a.amount_extra and a.amount_paid == a.amount_extra,
+         query=[Attendee.paid == c.PAID_BY_GROUP, Attendee.amount_extra > 0])
 
 
 # Reminder emails for groups to allocated their unassigned badges.  These emails are safe to be turned on for
@@ -148,19 +209,24 @@ AutomatedEmail(Group, 'Last chance to pre-assign {EVENT_NAME} group badges', 're
 # dealer registration has been turned on.
 
 MarketplaceEmail('Your {EVENT_NAME} Dealer registration has been approved', 'dealers/approved.html',
-                 lambda g: g.status == c.APPROVED)
+                 lambda g: g.status == c.APPROVED,
+                 query=[Group.status == c.APPROVED])
 
 MarketplaceEmail('Reminder to pay for your {EVENT_NAME} Dealer registration', 'dealers/payment_reminder.txt',
-                 lambda g: g.status == c.APPROVED and days_after(30, g.approved) and g.is_unpaid)
+                 lambda g: g.status == c.APPROVED and days_after(30, g.approved) and g.is_unpaid,
+                 query=[Group.status == c.APPROVED, Group.amount_paid == 0])
 
 MarketplaceEmail('Your {EVENT_NAME} Dealer registration is due in one week', 'dealers/payment_reminder.txt',
-                 lambda g: g.status == c.APPROVED and days_before(7, c.DEALER_PAYMENT_DUE, 2) and g.is_unpaid)
+                 lambda g: g.status == c.APPROVED and days_before(7, c.DEALER_PAYMENT_DUE, 2) and g.is_unpaid,
+                 query=[Group.status == c.APPROVED, Group.amount_paid == 0])
 
 MarketplaceEmail('Last chance to pay for your {EVENT_NAME} Dealer registration', 'dealers/payment_reminder.txt',
-                 lambda g: g.status == c.APPROVED and days_before(2, c.DEALER_PAYMENT_DUE) and g.is_unpaid)
+                 lambda g: g.status == c.APPROVED and days_before(2, c.DEALER_PAYMENT_DUE) and g.is_unpaid,
+                 query=[Group.status == c.APPROVED, Group.amount_paid == 0])
 
 MarketplaceEmail('{EVENT_NAME} Dealer waitlist has been exhausted', 'dealers/waitlist_closing.txt',
-                 lambda g: c.AFTER_DEALER_WAITLIST_CLOSED and g.status == c.WAITLISTED)
+                 lambda g: c.AFTER_DEALER_WAITLIST_CLOSED and g.status == c.WAITLISTED,
+                 query=[Group.status == c.WAITLISTED])
 
 
 # Placeholder badge emails; when an admin creates a "placeholder" badge, we send one of three different emails depending
@@ -177,34 +243,42 @@ MarketplaceEmail('{EVENT_NAME} Dealer waitlist has been exhausted', 'dealers/wai
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Panelist Badge Confirmation', 'placeholders/panelist.txt',
                lambda a: a.placeholder and a.first_name and a.last_name and a.ribbon == c.PANELIST_RIBBON,
-               sender=c.PANELS_EMAIL)
+               sender=c.PANELS_EMAIL,
+               query=[Attendee.placeholder == True, Attendee.ribbon == c.PANELIST_RIBBON])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Guest Badge Confirmation', 'placeholders/guest.txt',
                lambda a: a.placeholder and a.first_name and a.last_name and a.badge_type == c.GUEST_BADGE,
-               sender=c.PANELS_EMAIL)
+               sender=c.PANELS_EMAIL,
+               query=[Attendee.placeholder == True, Attendee.badge_type == c.GUEST_BADGE])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Dealer Information Required', 'placeholders/dealer.txt',
                lambda a: a.placeholder and a.is_dealer and a.group.status == c.APPROVED,
-               sender=c.MARKETPLACE_EMAIL)
+               sender=c.MARKETPLACE_EMAIL,
+               query=[Attendee.placeholder == True])
 
 StopsEmail('Want to staff {EVENT_NAME} again?', 'placeholders/imported_volunteer.txt',
-           lambda a: a.placeholder and a.staffing and a.registered_local <= c.PREREG_OPEN)
+           lambda a: a.placeholder and a.staffing and a.registered_local <= c.PREREG_OPEN,
+           query=[Attendee.placeholder == True])
 
 StopsEmail('{EVENT_NAME} Volunteer Badge Confirmation', 'placeholders/volunteer.txt',
            lambda a: a.placeholder and a.first_name and a.last_name
-                                      and a.registered_local > c.PREREG_OPEN)
+                                      and a.registered_local > c.PREREG_OPEN,
+           query=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Badge Confirmation', 'placeholders/regular.txt',
                lambda a: a.placeholder and a.first_name and a.last_name
                                        and a.badge_type not in [c.GUEST_BADGE, c.STAFF_BADGE]
-                                       and a.ribbon not in [c.DEALER_RIBBON, c.PANELIST_RIBBON, c.VOLUNTEER_RIBBON])
+                                       and a.ribbon not in [c.DEALER_RIBBON, c.PANELIST_RIBBON, c.VOLUNTEER_RIBBON],
+               query=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, '{EVENT_NAME} Badge Confirmation Reminder', 'placeholders/reminder.txt',
-               lambda a: days_after(7, a.registered) and a.placeholder and a.first_name and a.last_name and not a.is_dealer)
+               lambda a: days_after(7, a.registered) and a.placeholder and a.first_name and a.last_name and not a.is_dealer,
+               query=[Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, 'Last Chance to Accept Your {EVENT_NAME} Badge', 'placeholders/reminder.txt',
                lambda a: days_before(7, c.PLACEHOLDER_DEADLINE) and a.placeholder and a.first_name and a.last_name
-                                                                and not a.is_dealer)
+                                                                and not a.is_dealer,
+               query=[Attendee.placeholder == True])
 
 
 # Volunteer emails; none of these will be sent unless SHIFTS_CREATED is set.
@@ -214,43 +288,53 @@ StopsEmail('{EVENT_NAME} shifts available', 'shifts/created.txt',
 
 StopsEmail('Reminder to sign up for {EVENT_NAME} shifts', 'shifts/reminder.txt',
            lambda a: c.AFTER_SHIFTS_CREATED and days_after(30, max(a.registered_local, c.SHIFTS_CREATED))
-                 and c.BEFORE_PREREG_TAKEDOWN and a.takes_shifts and not a.hours)
+                 and c.BEFORE_PREREG_TAKEDOWN and a.takes_shifts and not a.hours,
+           query_options=[subqueryload(Attendee.shifts).joinedload(Shift.job)])
 
 StopsEmail('Last chance to sign up for {EVENT_NAME} shifts', 'shifts/reminder.txt',
               lambda a: days_before(10, c.EPOCH) and c.AFTER_SHIFTS_CREATED and c.BEFORE_PREREG_TAKEDOWN
-                                                 and a.takes_shifts and not a.hours)
+                                                 and a.takes_shifts and not a.hours,
+              query_options=[subqueryload(Attendee.shifts).joinedload(Shift.job)])
 
 StopsEmail('Still want to volunteer at {EVENT_NAME}?', 'shifts/volunteer_check.txt',
               lambda a: c.SHIFTS_CREATED and days_before(5, c.UBER_TAKEDOWN)
-                                         and a.ribbon == c.VOLUNTEER_RIBBON and a.takes_shifts and a.weighted_hours == 0)
+                                         and a.ribbon == c.VOLUNTEER_RIBBON and a.takes_shifts and a.weighted_hours == 0,
+              query=[Attendee.ribbon == c.VOLUNTEER_RIBBON], query_options=[subqueryload(Attendee.shifts).joinedload(Shift.job)])
 
 
 # MAGFest provides staff rooms for returning volunteers; leave ROOM_DEADLINE blank to keep these emails turned off.
 
 StopsEmail('Want volunteer hotel room space at {EVENT_NAME}?', 'shifts/hotel_rooms.txt',
-           lambda a: days_before(45, c.ROOM_DEADLINE, 14) and c.AFTER_SHIFTS_CREATED and a.hotel_eligible)
+           lambda a: days_before(45, c.ROOM_DEADLINE, 14) and c.AFTER_SHIFTS_CREATED and a.hotel_eligible,
+           query=[Attendee.badge_type == c.STAFF_BADGE])
 
 StopsEmail('Reminder to sign up for {EVENT_NAME} hotel room space', 'shifts/hotel_reminder.txt',
-           lambda a: days_before(14, c.ROOM_DEADLINE, 2) and a.hotel_eligible and not a.hotel_requests)
+           lambda a: days_before(14, c.ROOM_DEADLINE, 2) and a.hotel_eligible and not a.hotel_requests,
+           query=[Attendee.badge_type == c.STAFF_BADGE], query_options=[joinedload(Attendee.hotel_requests)])
 
 StopsEmail('Last chance to sign up for {EVENT_NAME} hotel room space', 'shifts/hotel_reminder.txt',
-           lambda a: days_before(2, c.ROOM_DEADLINE) and a.hotel_eligible and not a.hotel_requests)
+           lambda a: days_before(2, c.ROOM_DEADLINE) and a.hotel_eligible and not a.hotel_requests,
+           query=[Attendee.badge_type == c.STAFF_BADGE], query_options=[joinedload(Attendee.hotel_requests)])
 
 StopsEmail('Reminder to meet your {EVENT_NAME} hotel room requirements', 'shifts/hotel_hours.txt',
-           lambda a: days_before(14, c.UBER_TAKEDOWN, 7) and a.hotel_shifts_required and a.weighted_hours < 30)
+           lambda a: days_before(14, c.UBER_TAKEDOWN, 7) and a.hotel_shifts_required and a.weighted_hours < c.HOTEL_REQUIRED_HOURS,
+           query_options=[joinedload(Attendee.hotel_requests), subqueryload(Attendee.shifts).joinedload(Shift.job)])
 
 StopsEmail('Final reminder to meet your {EVENT_NAME} hotel room requirements', 'shifts/hotel_hours.txt',
-           lambda a: days_before(7, c.UBER_TAKEDOWN) and a.hotel_shifts_required and a.weighted_hours < 30)
+           lambda a: days_before(7, c.UBER_TAKEDOWN) and a.hotel_shifts_required and a.weighted_hours < c.HOTEL_REQUIRED_HOURS,
+           query_options=[joinedload(Attendee.hotel_requests), subqueryload(Attendee.shifts).joinedload(Shift.job)])
 
 
 # For events with customized badges, these emails remind people to let us know what we want on their badges.  We have
 # one email for our volunteers who haven't bothered to confirm they're coming yet (bleh) and one for everyone else.
 
 StopsEmail('Last chance to personalize your {EVENT_NAME} badge', 'personalized_badges/volunteers.txt',
-           lambda a: days_before(7, c.PRINTED_BADGE_DEADLINE) and a.staffing and a.badge_type in c.PREASSIGNED_BADGE_TYPES and a.placeholder)
+           lambda a: days_before(7, c.PRINTED_BADGE_DEADLINE) and a.staffing and a.badge_type in c.PREASSIGNED_BADGE_TYPES and a.placeholder,
+           query=[Attendee.badge_type.in_(c.PREASSIGNED_BADGE_TYPES), Attendee.placeholder == True])
 
 AutomatedEmail(Attendee, 'Personalized {EVENT_NAME} badges will be ordered next week', 'personalized_badges/reminder.txt',
-               lambda a: days_before(7, c.PRINTED_BADGE_DEADLINE) and a.badge_type in c.PREASSIGNED_BADGE_TYPES and not a.placeholder)
+               lambda a: days_before(7, c.PRINTED_BADGE_DEADLINE) and a.badge_type in c.PREASSIGNED_BADGE_TYPES and not a.placeholder,
+               query=[Attendee.badge_type.in_(c.PREASSIGNED_BADGE_TYPES), Attendee.placeholder == False])
 
 
 # MAGFest requires signed and notarized parental consent forms for anyone under 18.  This automated email reminder to
@@ -3,11 +3,15 @@ import re
 import csv
 import sys
 import json
+import heapq
 import math
 import string
 import socket
 import random
+import smtplib
 import inspect
+import codecs
+import base64
 import binascii
 import warnings
 import importlib
@@ -17,18 +21,20 @@ import traceback
 from glob import glob
 from uuid import uuid4
 from io import StringIO
+from queue import Queue
 from pprint import pprint
 from copy import deepcopy
 from pprint import pformat
 from hashlib import sha512
-from functools import wraps
+from functools import wraps, partial
 from xml.dom import minidom
+from email.mime.text import MIMEText
 from random import randrange
-from contextlib import closing
-from time import sleep, mktime
+from contextlib import closing, contextmanager
+from time import sleep, mktime, monotonic
 from urllib.parse import quote
 from urllib.parse import urlparse
-from urllib.parse import parse_qsl
+from urllib.parse import parse_qsl, urlencode
 from itertools import chain, count
 from collections import defaultdict, OrderedDict
 from datetime import date, time, datetime, timedelta
@@ -48,17 +54,17 @@ from django.utils.text import normalize_newlines
 from django.template import loader, Context, Variable, TemplateSyntaxError
 
 import sqlalchemy
-from sqlalchemy.sql import case
+from sqlalchemy.sql import case, union, false, literal_column, text as text_clause
 from sqlalchemy.event import listen
 from sqlalchemy.ext import declarative
-from sqlalchemy import func, or_, and_, not_
+from sqlalchemy import func, or_, and_, not_, select, tuple_
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.orm.attributes import get_history, instance_state
-from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
-from sqlalchemy.orm import Query, relationship, joinedload, backref
+from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.orm import Query, relationship, joinedload, subqueryload, backref
 from sqlalchemy.types import Boolean, Integer, Float, TypeDecorator, Date
 
 from sideboard.lib import log, parse_config, entry_point, listify, DaemonTask, serializer, cached_property, stopped, on_startup
@@ -68,11 +74,15 @@ import uber
 import uber as sa  # used to avoid circular dependency import issues for SQLAlchemy models
 from uber.amazon_ses import AmazonSES, EmailMessage  # TODO: replace this after boto adds Python 3 support
 from uber.config import c, Config
+from uber.email_transport import *
 from uber.utils import *
 from uber.decorators import *
 from uber.models import *
 from uber.automated_emails import *
 from uber.badge_funcs import *
+from uber.stats import *
+from uber.attendee_import import *
+from uber.shift_scheduler import *
 from uber import model_checks
 from uber import custom_tags
 from uber import server
@@ -36,12 +36,7 @@ class Config:
 
     @property
     def BADGES_SOLD(self):
-        with sa.Session() as session:
-            attendees = session.query(sa.Attendee)
-            individuals = attendees.filter(or_(sa.Attendee.paid == self.HAS_PAID, sa.Attendee.paid == self.REFUNDED)).count()
-            group_badges = attendees.join(sa.Attendee.group).filter(sa.Attendee.paid == self.PAID_BY_GROUP,
-                                                                    sa.Group.amount_paid > 0).count()
-            return individuals + group_badges
+        return sa.BadgeCounts.get('badges_sold')
 
     @property
     def ONEDAY_BADGE_PRICE(self):
@@ -127,14 +122,7 @@ class Config:
 
     @property
     def SUPPORTER_COUNT(self):
-        with sa.Session() as session:
-            attendees = session.query(sa.Attendee)
-            individual_supporters = attendees.filter(sa.Attendee.paid.in_([self.HAS_PAID, self.REFUNDED]),
-                                                     sa.Attendee.amount_extra >= self.SUPPORTER_LEVEL).count()
-            group_supporters = attendees.filter(sa.Attendee.paid == self.PAID_BY_GROUP,
-                                                sa.Attendee.amount_extra >= self.SUPPORTER_LEVEL,
-                                                sa.Attendee.amount_paid >= self.SUPPORTER_LEVEL).count()
-            return individual_supporters + group_supporters
+        return sa.BadgeCounts.get('supporter_count')
 
     @property
     def SQLALCHEMY_URL(self):
@@ -295,9 +283,8 @@ c.TRANSFERABLE_BADGE_TYPES = [getattr(c, badge_type.upper()) for badge_type in c
 c.SEASON_EVENTS = _config['season_events']
 c.DEPT_HEAD_CHECKLIST = _config['dept_head_checklist']
 
-c.BADGE_LOCK = RLock()
-
 c.CON_LENGTH = int((c.ESCHATON - c.EPOCH).total_seconds() // 3600)
+c.HOUR_MASK_ORIGIN = c.EPOCH - timedelta(days=7)  # see uber.utils.hour_mask(); setup shifts start at most 2 days before EPOCH
 c.START_TIME_OPTS = [(dt, dt.strftime('%I %p %a')) for dt in (c.EPOCH + timedelta(hours=i) for i in range(c.CON_LENGTH))]
 c.DURATION_OPTS = [(i, '%i hour%s' % (i, ('s' if i > 1 else ''))) for i in range(1, 9)]
 c.EVENT_START_TIME_OPTS = [(dt, dt.strftime('%I %p %a') if not dt.minute else dt.strftime('%I:%M %a'))
@@ -329,7 +316,8 @@ c.MAX_BADGE = max(xs[1] for xs in c.BADGE_RANGES.values())
 c.JOB_PAGE_OPTS = (
     ('index',    'Calendar View'),
     ('signups',  'Signups View'),
-    ('staffers', 'Staffer Summary')
+    ('staffers', 'Staffer Summary'),
+    ('auto_schedule', 'Automatic Scheduling')
 )
 c.WEIGHT_OPTS = (
     ('1.0', 'x1.0'),
@@ -324,6 +324,30 @@ class pages(template.Node):
         return 'Page: ' + ' '.join(map(str, pages))
 
 
+@tag
+class keyset_pages(template.Node):
+    def __init__(self, page):
+        self.page = Variable(page)
+
+    def render(self, context):
+        page = self.page.resolve(context)
+        path, _, qs = cherrypy.request.request_line.split()[1].split('/')[-1].partition('?')
+        params = parse_qsl(qs, keep_blank_values=True)
+        others = [(name, val) for name, val in params if name != 'cursor']
+
+        def link(label, cursor=None):
+            return '<a href="{}?{}">{}</a>'.format(path, urlencode(others + ([('cursor', cursor)] if cursor else [])), label)
+
+        links = []
+        if len(others) < len(params):
+            links.append(link('&laquo; First'))
+        if page.has_prev:
+            links.append(link('&lsaquo; Previous', page.prev_cursor))
+        if page.has_next:
+            links.append(link('Next &rsaquo;', page.next_cursor))
+        return ' | '.join(links)
+
+
 def extract_fields(what):
     if isinstance(what, Attendee):
         return 'a{}'.format(what.id), what.full_name, what.total_cost
@@ -4,13 +4,8 @@ from uber.common import *
 def log_pageview(func):
     @wraps(func)
     def with_check(*args, **kwargs):
-        with sa.Session() as session:
-            try:
-                attendee = session.admin_account(cherrypy.session['account_id'])
-            except:
-                pass  # we don't care about unrestricted pages for this version
-            else:
-                sa.Tracking.track_pageview(cherrypy.request.path_info, cherrypy.request.query_string)
+        if sa.AdminIdentity.current().attendee_id:  # we don't care about unrestricted pages for this version
+            sa.Tracking.track_pageview(cherrypy.request.path_info, cherrypy.request.query_string)
         return func(*args, **kwargs)
     return with_check
 
@@ -88,16 +83,55 @@ def ajax_gettable(func):
 
 
 def csv_file(func):
+    """
+    Makes a page handler return a CSV file named after the handler.  The
+    handler can either be passed a csv.writer, e.g.
+
+        @csv_file
+        def staff_badges(self, out, session):
+            out.writerow([...])
+
+    or be a generator which yields one row at a time, e.g.
+
+        @csv_file
+        def all_attendees(self, session):
+            yield [...]
+
+    in which case the file is streamed to the browser c.CSV_CHUNK_SIZE bytes at
+    a time as rows are generated, so that large exports start downloading
+    right away and never have the whole file in memory.  Since the session
+    passed to the page is closed as soon as the page handler returns, the
+    rows are generated with a separate session of their own.
+    """
+    streaming = inspect.isgeneratorfunction(func)
+
     @wraps(func)
     def csvout(self, session):
         cherrypy.response.headers['Content-Type'] = 'application/csv'
         cherrypy.response.headers['Content-Disposition'] = 'attachment; filename=' + func.__name__ + '.csv'
-        writer = StringIO()
-        func(self, csv.writer(writer), session)
-        return writer.getvalue().encode('utf-8')
+        if streaming:
+            cherrypy.response.stream = True
+            return _stream_csv(func, self)
+        else:
+            writer = StringIO()
+            func(self, csv.writer(writer), session)
+            return writer.getvalue().encode('utf-8')
     return csvout
 
 
+def _stream_csv(func, inst):
+    buf = StringIO()
+    out = csv.writer(buf)
+    with sa.QueryCounter('{}.{}'.format(func.__module__, func.__name__)), sa.Session() as session:
+        for row in func(inst, session):
+            out.writerow(row)
+            if buf.tell() >= c.CSV_CHUNK_SIZE:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
 def check_shutdown(func):
     @wraps(func)
     def with_check(self, *args, **kwargs):
@@ -125,27 +159,140 @@ def credit_card(func):
     return charge
 
 
-def cached(func):
-    func.cached = True
-    return func
+def cached(*models):
+    """
+    Marks a page handler as cacheable by @cached_page, e.g.
+
+        @cached(Event)
+        def index(self, session): ...
+
+    Cached copies of the page are thrown away whenever a transaction which
+    changes any of the given models is committed.  This can also be used
+    without any models as a bare @cached, in which case the page is only
+    regenerated once its cached copy is c.PAGE_CACHE_TTL seconds old.
+    """
+    if len(models) == 1 and inspect.isfunction(models[0]):
+        models[0].cached = frozenset()
+        return models[0]
+
+    def decorator(func):
+        func.cached = frozenset(model.__tablename__ for model in models)
+        return func
+    return decorator
+
+
+class PageCache:
+    """
+    In-memory LRU cache of rendered pages, holding at most c.PAGE_CACHE_SIZE
+    pages and c.PAGE_CACHE_MAX_BYTES bytes of output.  Each page is stored
+    under a key built from its handler, its arguments and the access levels
+    of whoever is looking at it, along with the set of tags (table names)
+    which invalidate it.
+
+    Pages which are older than c.PAGE_CACHE_TTL seconds or whose tags have
+    been invalidated are regenerated by one thread at a time per key, and
+    other requests for the same page keep getting the stale copy until the
+    new one is ready, so a popular page never has a pile of requests all
+    rendering it at once.
+    """
+    class Entry:
+        def __init__(self):
+            self.lock = RLock()
+            self.contents, self.size, self.created, self.stale = None, 0, None, True
+
+        def expired(self):
+            return self.stale or self.created is None or monotonic() - self.created > c.PAGE_CACHE_TTL
+
+    def __init__(self):
+        self.lock = RLock()
+        self.entries = OrderedDict()
+        self.tagged = defaultdict(set)
+        self.total_size = 0
+
+    def entry(self, key, tags):
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = self.Entry()
+                for tag in tags:
+                    self.tagged[tag].add(key)
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def get(self, key, tags, generate):
+        entry = self.entry(key, tags)
+        if entry.contents is not None and entry.expired():
+            if entry.lock.acquire(blocking=False):
+                try:
+                    if entry.expired():
+                        self.regenerate(key, entry, generate)
+                finally:
+                    entry.lock.release()
+        elif entry.contents is None:
+            with entry.lock:
+                if entry.contents is None:
+                    self.regenerate(key, entry, generate)
+        return entry.contents
+
+    def regenerate(self, key, entry, generate):
+        # we clear the stale flag before rendering rather than afterwards, so
+        # that an invalidation which happens during rendering isn't lost
+        entry.stale = False
+        try:
+            contents = generate()
+        except:
+            entry.stale = True
+            raise
+        else:
+            self.store(key, entry, contents)
+
+    def store(self, key, entry, contents):
+        with self.lock:
+            entry.created = monotonic()
+            entry.contents, size = contents, len(contents)
+            if key in self.entries:
+                self.total_size += size - entry.size
+            entry.size = size
+            while len(self.entries) > c.PAGE_CACHE_SIZE or self.total_size > c.PAGE_CACHE_MAX_BYTES and len(self.entries) > 1:
+                self.evict(next(iter(self.entries)))
+
+    def evict(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.total_size -= entry.size
+            for keys in self.tagged.values():
+                keys.discard(key)
+
+    def invalidate(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.tagged.get(tag, []):
+                    self.entries[key].stale = True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tagged.clear()
+            self.total_size = 0
+
+page_cache = PageCache()
+
+
+def _page_cache_key(func, args, kwargs):
+    params = tuple(sorted((name, str(val)) for name, val in kwargs.items() if name not in ['session', 'csrf_token']))
+    access = frozenset(sa.AdminIdentity.current().access)
+    return (func.__module__, func.__name__, tuple(str(arg) for arg in args[1:]), params,
+            access, bool(cherrypy.session.get('staffer_id')))
 
 
 def cached_page(func):
-    from sideboard.lib import config as sideboard_config
     innermost = get_innermost(func)
-    func.lock = RLock()
 
     @wraps(func)
     def with_caching(*args, **kwargs):
-        if hasattr(innermost, 'cached'):
-            fpath = os.path.join(sideboard_config['root'], 'data', func.__module__ + '.' + func.__name__)
-            with func.lock:
-                if not os.path.exists(fpath) or datetime.now().timestamp() - os.stat(fpath).st_mtime > 60 * 15:
-                    contents = func(*args, **kwargs)
-                    with open(fpath, 'wb') as f:
-                        f.write(contents)
-                with open(fpath, 'rb') as f:
-                    return f.read()
+        if hasattr(innermost, 'cached') and cherrypy.request.method == 'GET':
+            key = _page_cache_key(func, args, kwargs)
+            return page_cache.get(key, innermost.cached, lambda: func(*args, **kwargs))
         else:
             return func(*args, **kwargs)
     return with_caching
@@ -162,6 +309,14 @@ def timed(func):
     return with_timing
 
 
+def query_counted(func):
+    @wraps(func)
+    def with_query_counts(*args, **kwargs):
+        with sa.QueryCounter('{}.{}'.format(func.__module__, func.__name__)):
+            return func(*args, **kwargs)
+    return with_query_counts
+
+
 def sessionized(func):
     @wraps(func)
     def with_session(*args, **kwargs):
@@ -180,18 +335,85 @@ def sessionized(func):
     return with_session
 
 
+class TemplateCache:
+    """
+    Django's loader.select_template() searches every template directory and
+    re-parses the template each time it's called, so we keep the compiled
+    Template for each list of template names we've been asked to render.
+    Since plugins override our templates with template_overrides() while
+    they're being imported, we compile every template we can find once our
+    plugins have all been loaded, and throw everything away if another
+    override is added later.  On dev boxes we skip the cache entirely so that
+    template changes show up without a restart.
+
+    The context variables which every template gets (c and every model class)
+    are likewise only built once, and each render pushes its own data on top
+    of them rather than copying them into a new dictionary.
+
+    We don't stream rendered output: every large page extends base-admin.html,
+    whose content block renders as a single node, and the result still has to
+    pass through cached_page() and screw_you_nick() as one string anyway.
+    """
+    extensions = ['.html', '.txt', '.xml', '.js', '.csv']
+
+    def __init__(self):
+        self.lock = RLock()
+        self.templates = {}
+        self._static_context = None
+
+    def get(self, template_name_list):
+        names = tuple(listify(template_name_list))
+        template = self.templates.get(names)
+        if template is None:
+            template = loader.select_template(names)
+            if not c.DEV_BOX:
+                with self.lock:
+                    self.templates[names] = template
+        return template
+
+    def precompile(self):
+        for dirname in django.conf.settings.TEMPLATE_DIRS:
+            for dpath, dirs, files in os.walk(dirname):
+                for fname in files:
+                    if os.path.splitext(fname)[1] in self.extensions:
+                        name = os.path.relpath(os.path.join(dpath, fname), dirname)
+                        try:
+                            self.get(name)
+                        except:
+                            log.warning('unable to precompile template {}', name, exc_info=True)
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+    @property
+    def static_context(self):
+        if self._static_context is None:
+            context = {'c': c}
+            context.update({m.__name__: m for m in sa.Session.all_models()})
+            self._static_context = context
+        return self._static_context
+
+    def context(self, data=None):
+        context = Context(self.static_context)
+        context.update(data or {})
+        return context
+
+template_cache = TemplateCache()
+on_startup(template_cache.precompile)
+
+
 def renderable_data(data=None):
     data = data or {}
-    data['c'] = c
-    data.update({m.__name__: m for m in sa.Session.all_models()})
+    data.update(template_cache.static_context)
     return data
 
 
-# render using the first template that actually exists in template_name_list
+# render using the first template that actually exists in template_name_list;
+# pages are rendered whole rather than streamed (see TemplateCache)
 def render(template_name_list, data=None):
-    data = renderable_data(data)
-    template = loader.select_template(listify(template_name_list))
-    rendered = template.render(Context(data))
+    template = template_cache.get(template_name_list)
+    rendered = template.render(template_cache.context(data))
     rendered = screw_you_nick(rendered, template)  # lolz.
     return rendered.encode('utf-8')
 
@@ -200,7 +422,8 @@ def render(template_name_list, data=None):
 # Nick gets mad when people call Magfest a "convention".  He always says "It's not a convention, it's a festival"
 # So........ if Nick is logged in.... let's annoy him a bit :)
 def screw_you_nick(rendered, template):
-    if not c.AT_THE_CON and sa.AdminAccount.is_nick() and 'emails' not in template and 'history' not in template and 'form' not in rendered:
+    name = template.name or ''
+    if not c.AT_THE_CON and sa.AdminAccount.is_nick() and 'emails' not in name and 'history' not in name and 'form' not in rendered:
         return rendered.replace('festival', 'convention').replace('Fest', 'Con')  # lolz.
     else:
         return rendered
@@ -267,7 +490,7 @@ class all_renderable:
         for name, func in klass.__dict__.items():
             if hasattr(func, '__call__'):
                 func.restricted = getattr(func, 'restricted', self.needs_access)
-                new_func = timed(cached_page(sessionized(restricted(renderable(func)))))
+                new_func = timed(query_counted(cached_page(sessionized(restricted(renderable(func))))))
                 new_func.exposed = True
                 setattr(klass, name, new_func)
         return klass
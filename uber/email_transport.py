@@ -0,0 +1,188 @@
+from uber.common import *
+
+
+class TokenBucket:
+    """
+    Rate limiter which allows an average of `rate` operations per second with
+    bursts of up to `capacity` operations; take() blocks until we're allowed
+    to perform another operation.
+    """
+    def __init__(self, rate, capacity=None):
+        self.lock = RLock()
+        self.set_rate(rate, capacity)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+
+    def set_rate(self, rate, capacity=None):
+        with self.lock:
+            self.rate = max(float(rate), 0.1)
+            self.capacity = max(float(capacity or rate), 1.0)
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class SESBackend:
+    """
+    Delivers email with Amazon SES.  Each worker thread gets its own AmazonSES
+    object so that it can keep its HTTPS connection open between messages.
+    """
+    def __init__(self):
+        self.local = local()
+
+    @property
+    def ses(self):
+        if not hasattr(self.local, 'ses'):
+            self.local.ses = AmazonSES(c.AWS_ACCESS_KEY, c.AWS_SECRET_KEY)
+        return self.local.ses
+
+    def max_send_rate(self):
+        return self.ses.getSendQuota().maxSendRate
+
+    def send(self, source, to, cc, bcc, subject, body, format):
+        message = EmailMessage(subject=subject, **{'bodyText' if format == 'text' else 'bodyHtml': body})
+        self.ses.sendEmail(source=source, toAddresses=to, ccAddresses=cc, bccAddresses=bcc, message=message)
+
+
+class SMTPBackend:
+    """
+    Delivers email to an SMTP server, which is mostly useful for pointing at a
+    local debugging server, e.g. "python -m smtpd -n -c DebuggingServer".
+    """
+    def __init__(self):
+        self.local = local()
+
+    def max_send_rate(self):
+        return c.EMAIL_SEND_RATE
+
+    def connect(self):
+        if getattr(self.local, 'smtp', None) is None:
+            self.local.smtp = smtplib.SMTP(c.EMAIL_SMTP_HOST, c.EMAIL_SMTP_PORT)
+        return self.local.smtp
+
+    def send(self, source, to, cc, bcc, subject, body, format):
+        body = body.decode('utf-8') if isinstance(body, bytes) else body
+        message = MIMEText(body, 'plain' if format == 'text' else 'html', 'utf-8')
+        message['Subject'], message['From'], message['To'] = subject, source, ', '.join(to)
+        if cc:
+            message['Cc'] = ', '.join(cc)
+        try:
+            self.connect().send_message(message, source, to + cc + bcc)
+        except smtplib.SMTPServerDisconnected:
+            self.local.smtp = None
+            self.connect().send_message(message, source, to + cc + bcc)
+
+
+class FileBackend:
+    """
+    Writes each email to its own file instead of sending it anywhere, which
+    lets us test and benchmark email sending without a network connection.
+    """
+    def __init__(self):
+        from sideboard.lib import config as sideboard_config
+        self.dirname = c.EMAIL_FILE_DIR or os.path.join(sideboard_config['root'], 'data', 'emails')
+        os.makedirs(self.dirname, exist_ok=True)
+
+    def max_send_rate(self):
+        return c.EMAIL_SEND_RATE
+
+    def send(self, source, to, cc, bcc, subject, body, format):
+        body = body.decode('utf-8') if isinstance(body, bytes) else body
+        with open(os.path.join(self.dirname, '{}.json'.format(uuid4())), 'w') as f:
+            json.dump({
+                'source': source,
+                'to': to,
+                'cc': cc,
+                'bcc': bcc,
+                'subject': subject,
+                'body': body,
+                'format': format
+            }, f)
+
+
+class EmailTransport:
+    """
+    Sends email on a pool of worker threads which pull messages off of a
+    bounded queue, so that neither page handlers nor our automated email
+    task have to wait on the network for each message.  Workers share a
+    token bucket which keeps us under our backend's maximum send rate (for
+    SES this is the MaxSendRate from our send quota).
+
+    Callers can pass an on_sent callback which is run after a message is
+    delivered and an on_error callback which is passed the error message if
+    delivery fails.  Call flush() to wait until every queued message has been
+    handled.
+    """
+    backends = {
+        'ses': SESBackend,
+        'smtp': SMTPBackend,
+        'file': FileBackend
+    }
+
+    def __init__(self, backend=None, workers=None, rate=None):
+        self.backend, self.workers, self.rate = backend, workers, rate
+        self.bucket = TokenBucket(rate or c.EMAIL_SEND_RATE)
+        self.queue = Queue(maxsize=c.EMAIL_QUEUE_SIZE)
+        self.threads = []
+        self.lock = RLock()
+
+    def start(self):
+        with self.lock:
+            if not self.threads:
+                self.backend = self.backend or self.backends[c.EMAIL_BACKEND]()
+                self.refresh_quota()
+                for i in range(self.workers or c.EMAIL_WORKERS):
+                    thread = Thread(target=self._run, name='email_worker_{}'.format(i), daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+
+    def refresh_quota(self):
+        if self.backend and not self.rate:
+            try:
+                self.bucket.set_rate(self.backend.max_send_rate())
+            except:
+                log.warning('unable to check our email send rate, continuing to send {} per second', self.bucket.rate, exc_info=True)
+
+    def send(self, source, to, cc, bcc, subject, body, format, on_sent=None, on_error=None):
+        self.start()
+        message = (source, to, cc, bcc, subject, body, format, on_sent, on_error)
+        if stopped.is_set():
+            self.deliver(*message)
+        else:
+            self.queue.put(message)
+
+    def deliver(self, source, to, cc, bcc, subject, body, format, on_sent=None, on_error=None):
+        try:
+            self.bucket.take()
+            self.backend.send(source, to, cc, bcc, subject, body, format)
+        except:
+            log.error('unable to send {!r} email to {}', subject, to, exc_info=True)
+            if on_error:
+                on_error(traceback.format_exc())
+        else:
+            if on_sent:
+                on_sent()
+
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            try:
+                self.deliver(*message)
+            except:
+                log.error('unexpected error handling {!r} email to {}', message[4], message[1], exc_info=True)
+            finally:
+                self.queue.task_done()
+
+email_transport = EmailTransport()
@@ -121,17 +121,157 @@ class MultiChoice(TypeDecorator):
     is represented by an integer, so we store them as a comma-separated string.
     This can be marginally more convenient than a many-to-many table.  Like the
     Choice class, this takes an array of tuples of integers and strings.
+
+    Columns declared with indexed=True also get a MultiChoiceValue row for each
+    selected option, for when we need to look up every row with some option
+    selected; see MultiChoiceValue for details.
     """
     impl = UnicodeText
 
-    def __init__(self, choices, **kwargs):
-        self.choices = choices
+    def __init__(self, choices, indexed=False, **kwargs):
+        self.choices, self.indexed = choices, indexed
         TypeDecorator.__init__(self, **kwargs)
 
     def process_bind_param(self, value, dialect):
         return value if isinstance(value, str) else ','.join(value)
 
 
+def _label_property(name):
+    def label(self):
+        val = getattr(self, name)
+        return '' if val is None else ModelMetadata.get(self.__class__).labels[name][int(val)]
+    return property(label)
+
+
+def _ints_property(name):
+    def ints(self):
+        return list(_parse_multichoice(self, name)[0])
+    return property(ints)
+
+
+def _labels_property(name):
+    def labels(self):
+        return list(_parse_multichoice(self, name)[1])
+    return property(labels)
+
+
+def _local_property(name):
+    def local(self):
+        return getattr(self, name).astimezone(c.EVENT_TIMEZONE)
+    return property(local)
+
+
+def _flag_property(name, choice):
+    def flag(self):
+        return choice in _parse_multichoice(self, name)[0]
+    return property(flag)
+
+
+def _parse_multichoice(inst, name):
+    """
+    Returns a tuple of the (ints, labels) for the MultiChoice column with the
+    given name.  We remember these on the instance along with the raw string
+    we parsed them from, so we only re-parse them after the column changes.
+    """
+    val = getattr(inst, name)
+    cache = inst.__dict__.setdefault('_multichoice_cache', {})
+    if name not in cache or cache[name][0] != val:
+        labels = ModelMetadata.get(inst.__class__).labels[name]
+        ints = tuple(int(i) for i in str(val).split(',') if int(i) in labels) if val else ()
+        cache[name] = (val, (ints, tuple(sorted(labels[i] for i in ints))))
+    return cache[name][1]
+
+
+class ModelMetadata:
+    """
+    Things we need to know about a model class which we'd otherwise work out
+    by inspecting the class every time, e.g. which methods are presave
+    adjustments and which properties are cost properties.  Since plugins can
+    add to our models with @Session.model_mixin, we throw this information
+    away when Session.initialize_db() is called, which is only done after
+    all plugins have been loaded, and recompute it the next time it's needed.
+
+    We also add properties to the class for the suffixed attributes of its
+    columns, e.g. paid_label and interests_ints, which would otherwise each go
+    through MagModel.__getattr__ every time they were looked up.
+    """
+    registry = {}
+
+    def __init__(self, model):
+        self.model = model
+        attrs = {name: getattr(model, name) for name in dir(model)}
+        self.adjustments = {
+            label: [name for name, attr in sorted(((name, attr) for name, attr in attrs.items()
+                                                   if hasattr(attr, '__call__') and hasattr(attr, label)),
+                                                  key=lambda tup: getattr(tup[1], label))]
+            for label in ['presave_adjustment', 'predelete_adjustment']
+        }
+        self.cost_property_names = [name for name, attr in attrs.items() if isinstance(attr, cost_property)]
+        self.suffix_properties = {name for name, attr in attrs.items() if getattr(attr, '_is_suffix_property', False)}
+        self.choice_columns = OrderedDict((col.name, col) for col in model.__table__.columns if isinstance(col.type, Choice))
+        self.multichoice_columns = OrderedDict((col.name, col) for col in model.__table__.columns if isinstance(col.type, MultiChoice))
+        self.indexed_multichoice_columns = [name for name, col in self.multichoice_columns.items() if col.type.indexed]
+        self.labels = {name: dict(col.type.choices) for name, col in chain(self.choice_columns.items(), self.multichoice_columns.items())}
+        self.properties = {}
+        self.lock = RLock()
+
+        for name in self.choice_columns:
+            self._add_property(name + '_label', _label_property(name))
+        for name in self.multichoice_columns:
+            self._add_property(name + '_ints', _ints_property(name))
+            self._add_property(name + '_labels', _labels_property(name))
+        for col in model.__table__.columns:
+            if isinstance(col.type, UTCDateTime):
+                self._add_property(col.name + '_local', _local_property(col.name))
+
+    def _add_property(self, name, prop):
+        if not hasattr(self.model, name):
+            setattr(self.model, name, prop)
+            self.properties[name] = prop
+
+    def flag(self, name):
+        """
+        Models with exactly one MultiChoice column let you check whether one of
+        its options is selected with e.g. attendee.CONSOLE; this returns the
+        property for the given name if it's one of those options.  The first
+        time we see a name, we add that property to the class so we never have
+        to check again, and we remember names which aren't options as None.
+        We only ever store the finished answer, under a lock, so that another
+        thread looking up the same name never sees a half-done entry.
+        """
+        if name in self.properties:
+            return self.properties[name]
+
+        prop = None
+        if len(self.multichoice_columns) == 1:
+            [column] = self.multichoice_columns
+            try:
+                choice = getattr(c, name)
+                assert choice in self.labels[column]
+            except:
+                pass
+            else:
+                prop = _flag_property(column, choice)
+
+        with self.lock:
+            if name not in self.properties:
+                if prop is None:
+                    self.properties[name] = None
+                else:
+                    self._add_property(name, prop)
+            return self.properties.get(name)
+
+    @classmethod
+    def get(cls, model):
+        if model not in cls.registry:
+            cls.registry[model] = cls(model)
+        return cls.registry[model]
+
+    @classmethod
+    def clear(cls):
+        cls.registry.clear()
+
+
 @declarative_base
 class MagModel:
     id = Column(UUID, primary_key=True, default=lambda: str(uuid4()))
@@ -146,18 +286,9 @@ class MagModel:
             if col.default:
                 self.__dict__.setdefault(attr, col.default.execute())
 
-    @property
-    def _class_attrs(self):
-        return {name: getattr(self.__class__, name) for name in dir(self.__class__)}
-
     def _invoke_adjustment_callbacks(self, label):
-        callbacks = []
-        for name, attr in self._class_attrs.items():
-            if hasattr(attr, '__call__') and hasattr(attr, label):
-                callbacks.append(getattr(self, name))
-        callbacks.sort(key=lambda f: getattr(f, label))
-        for func in callbacks:
-            func()
+        for name in ModelMetadata.get(self.__class__).adjustments[label]:
+            getattr(self, name)()
 
     def presave_adjustments(self):
         self._invoke_adjustment_callbacks('presave_adjustment')
@@ -190,7 +321,7 @@ class MagModel:
     @property
     def cost_property_names(self):
         """Returns the names of all cost properties on this model."""
-        return [name for name, attr in self._class_attrs.items() if isinstance(attr, cost_property)]
+        return ModelMetadata.get(self.__class__).cost_property_names
 
     @property
     def default_cost(self):
@@ -213,7 +344,7 @@ class MagModel:
     @class_property
     def all_checkgroups(cls):
         """Returns the set of MultiChoice column names for this table."""
-        return {col.name for col in cls.__table__.columns if isinstance(col.type, MultiChoice)}
+        return set(ModelMetadata.get(cls).multichoice_columns)
 
     @class_property
     def regform_bools(cls):
@@ -296,12 +427,12 @@ class MagModel:
 
     @suffix_property
     def _ints(self, name, val):
-        choices = dict(self.get_field(name).type.choices)
+        choices = ModelMetadata.get(self.__class__).labels[name]
         return [int(i) for i in str(val).split(',') if int(i) in choices] if val else []
 
     @suffix_property
     def _label(self, name, val):
-        return '' if val is None else self.get_field(name).type.choices[int(val)]
+        return '' if val is None else ModelMetadata.get(self.__class__).labels[name][int(val)]
 
     @suffix_property
     def _local(self, name, val):
@@ -310,22 +441,29 @@ class MagModel:
     @suffix_property
     def _labels(self, name, val):
         ints = getattr(self, name + '_ints')
-        labels = dict(self.get_field(name).type.choices)
+        labels = ModelMetadata.get(self.__class__).labels[name]
         return sorted(labels[i] for i in ints)
 
     def __getattr__(self, name):
-        suffixed = suffix_property.check(self, name)
-        if suffixed is not None:
-            return suffixed
-
-        try:
-            [multi] = [col for col in self.__table__.columns if isinstance(col.type, MultiChoice)]
-            choice = getattr(c, name)
-            assert choice in [val for val, desc in multi.type.choices]
-        except:
-            pass
-        else:
-            return choice in getattr(self, multi.name + '_ints')
+        if name.startswith('_'):
+            raise AttributeError(self.__class__.__name__ + '.' + name)
+
+        # ModelMetadata adds properties for most of the attributes we handle here, so
+        # we only get here for those if a property raised an AttributeError or if this
+        # is the first lookup for this class since the properties were added
+        metadata = ModelMetadata.get(self.__class__)
+        prop = metadata.properties.get(name)
+        if prop is not None:
+            return prop.fget(self)
+
+        if '_' + name.rsplit('_', 1)[-1] in metadata.suffix_properties:
+            suffixed = suffix_property.check(self, name)
+            if suffixed is not None:
+                return suffixed
+
+        prop = metadata.flag(name)
+        if prop is not None:
+            return prop.fget(self)
 
         if name.startswith('is_'):
             return self.__class__.__name__.lower() == name[3:]
@@ -413,6 +551,71 @@ class NightsMixin(object):
     locals().update({mutate(name): _night(mutate(name)) for name in c.NIGHT_NAMES for mutate in [str.upper, str.lower]})
 
 
+class KeysetPage:
+    """
+    One page of results from Session.QuerySubclass.keyset(), which can be
+    iterated over like a list.  Rather than a page number, the next and
+    previous pages are identified by opaque cursor strings encoding the sort
+    key values of our last and first rows, which are None when there are no
+    more rows in that direction.
+    """
+    def __init__(self, attrs, rows, has_prev, has_next):
+        self.attrs = attrs
+        self.items = [row[0] for row in rows]
+        self.has_prev, self.has_next = bool(rows) and has_prev, bool(rows) and has_next
+        self.prev_cursor = self.encode('before', attrs, rows[0][1:]) if self.has_prev else None
+        self.next_cursor = self.encode('after', attrs, rows[-1][1:]) if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    @staticmethod
+    def encode_value(val):
+        if isinstance(val, datetime):
+            val = val if val.tzinfo is None else val.astimezone(UTC)
+            return {'datetime': val.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+        elif isinstance(val, date):
+            return {'date': val.strftime('%Y-%m-%d')}
+        else:
+            return val
+
+    @staticmethod
+    def decode_value(val):
+        if isinstance(val, dict) and 'datetime' in val:
+            return UTC.localize(datetime.strptime(val['datetime'], '%Y-%m-%dT%H:%M:%S.%f'))
+        elif isinstance(val, dict) and 'date' in val:
+            return datetime.strptime(val['date'], '%Y-%m-%d').date()
+        else:
+            return val
+
+    @classmethod
+    def encode(cls, direction, attrs, values):
+        data = json.dumps([direction, attrs, [cls.encode_value(val) for val in values]])
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode(cls, cursor, attrs, num_keys):
+        """
+        Returns a (direction, values) tuple for the given cursor, where values
+        is None for the first page.  Cursors from a page with a different sort
+        order (or which have been mangled somehow) also give us the first page.
+        """
+        if cursor:
+            try:
+                direction, cursor_attrs, values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+                if direction in ['before', 'after'] and cursor_attrs == attrs and len(values) == num_keys:
+                    return direction, [cls.decode_value(val) for val in values]
+            except Exception:
+                log.warning('ignoring invalid pagination cursor {!r}', cursor)
+        return 'after', None
+
+
 class Session(SessionManager):
     engine = sqlalchemy.create_engine(c.SQLALCHEMY_URL, pool_size=50, max_overflow=100)
 
@@ -439,7 +642,37 @@ class Session(SessionManager):
         drop -- USE WITH CAUTION: If True, then we will drop any tables in the database
         """
         if modify_tables:
+            ModelMetadata.clear()
             super(Session, cls).initialize_db(drop=drop)
+            cls.update_existing_tables()
+            Tracking.create_indexes()
+            with cls() as session:
+                if not session.query(MultiChoiceValue).first():
+                    MultiChoiceValue.rebuild(session)
+            AttendeeSearch.create_indexes()
+
+    @classmethod
+    def update_existing_tables(cls):
+        """
+        New columns and indexes are only created along with their tables, so
+        for existing databases we add the ones our largest tables need here.
+        """
+        with cls.engine.begin() as conn:
+            if 'changes' not in [col['name'] for col in sqlalchemy.inspect(conn).get_columns('tracking')]:
+                conn.execute('ALTER TABLE tracking ADD COLUMN changes TEXT')
+            if conn.dialect.name == 'postgresql':
+                conn.execute('ALTER TABLE tracking ALTER COLUMN fk_id DROP NOT NULL')
+            if 'filled_slots' not in [col['name'] for col in sqlalchemy.inspect(conn).get_columns('job')]:
+                conn.execute('ALTER TABLE job ADD COLUMN filled_slots INTEGER DEFAULT 0')
+                conn.execute(Job.filled_slots_update())
+            # versions saved twice by concurrent refreshes would keep us from adding their unique index
+            conn.execute('DELETE FROM stats_snapshot WHERE CAST(id AS TEXT) NOT IN '
+                         '(SELECT MIN(CAST(id AS TEXT)) FROM stats_snapshot GROUP BY report, version)')
+            for model in [Email, Tracking, TrackingLink, Job, Shift, StatsSnapshot]:
+                for index in model.__table__.indexes:
+                    conn.execute('CREATE {}INDEX IF NOT EXISTS {} ON "{}" ({})'.format(
+                        'UNIQUE ' if index.unique else '', index.name, model.__tablename__,
+                        ', '.join('"{}"'.format(col.name) for col in index.columns)))
 
     class QuerySubclass(Query):
         @property
@@ -470,6 +703,143 @@ class Session(SessionManager):
         def iexact(self, **filters):
             return self.filter(*[func.lower(getattr(self.model, attr)) == func.lower(val) for attr, val in filters.items()])
 
+        def load(self, *paths):
+            """
+            Eagerly loads the relationships a page is going to use, named as
+            dotted paths from the model being queried, e.g.
+
+                session.query(Attendee).load('hotel_requests', 'shifts.job')
+
+            Collections are each loaded with one extra query for all of the rows
+            (subqueryload) and single objects are joined into the query which
+            loads their parent (joinedload), so no matter how many rows we get
+            back, the page doesn't issue a query per row for each relationship.
+            """
+            options = []
+            for path in paths:
+                model, option = self.model, None
+                for name in path.split('.'):
+                    attr = getattr(model, name)
+                    loader = subqueryload if attr.property.uselist else joinedload
+                    option = loader(attr) if option is None else getattr(option, loader.__name__)(attr)
+                    model = attr.property.mapper.class_
+                options.append(option)
+            return self.options(*options)
+
+        def has_choice(self, **filters):
+            """
+            Filters by options selected in indexed MultiChoice columns, e.g.
+            session.query(Attendee).has_choice(assigned_depts=c.CONSOLE)
+            """
+            return self.filter(*[MultiChoiceValue.selected(getattr(self.model, name), val) for name, val in filters.items()])
+
+        def lacks_choice(self, **filters):
+            return self.filter(*[~MultiChoiceValue.selected(getattr(self.model, name), val) for name, val in filters.items()])
+
+        def keyset_keys(self, attrs):
+            """
+            Returns a list of (expression, descending) tuples which we sort by
+            when paging through this query by the given attributes, which are
+            specified the same way as for .order().  We always end with the id
+            so that every row has a distinct key, sorted in the same direction
+            as the first attribute so that an index like (when, id) can be
+            scanned backwards for descending orders.  We sort nullable columns
+            by whether they're null first so that NULLs come last on every
+            database and can be handled explicitly when comparing against a cursor.
+            """
+            keys, tiebreaker = [], '-id' if attrs and attrs[0].startswith('-') else 'id'
+            for attr in attrs + ([] if 'id' in [attr.lstrip('-') for attr in attrs] else [tiebreaker]):
+                col = getattr(self.model, attr.lstrip('-'))
+                try:
+                    nullable = col.property.columns[0].nullable
+                except AttributeError:  # e.g. hybrid properties like Attendee.last_first
+                    nullable = True
+                if nullable:
+                    keys.append((case([(col == None, 1)], else_=0), False))
+                keys.append((col, attr.startswith('-')))
+            return keys
+
+        def keyset_filter(self, keys, values, backwards=False):
+            """
+            Returns a filter for the rows which come after (or before, if we're
+            going backwards) the row with the given sort key values.
+            """
+            if Session.engine.dialect.name == 'postgresql' and len({desc for expr, desc in keys}) == 1 \
+                    and None not in values:
+                # Postgres can answer a row comparison with a single index range scan
+                row, cursor = tuple_(*[expr for expr, desc in keys]), tuple_(*values)
+                return row < cursor if keys[0][1] != backwards else row > cursor
+
+            conditions = []
+            for i, ((expr, desc), val) in enumerate(zip(keys, values)):
+                if val is not None:  # nothing sorts after NULL since NULLs always come last
+                    equal = [prev == prev_val for (prev, prev_desc), prev_val in zip(keys[:i], values[:i])]
+                    conditions.append(and_(*equal + [expr < val if desc != backwards else expr > val]))
+            return or_(*conditions)
+
+        def keyset(self, attrs, cursor='', per_page=100):
+            """
+            Returns a KeysetPage with up to per_page results of this query sorted
+            by the given attributes, starting after (or ending before) the row
+            identified by the given cursor string.  Unlike slicing the query, this
+            doesn't make the database read and discard every earlier row, so
+            pages deep into a large table are as fast as the first one as long
+            as there's an index on the columns we're sorting by.
+            """
+            attrs = listify(attrs)
+            keys = self.keyset_keys(attrs)
+            direction, values = KeysetPage.decode(cursor, attrs, len(keys))
+            backwards = direction == 'before'
+
+            query = self.order_by(None).add_columns(*[expr for expr, desc in keys])
+            if values is not None:
+                query = query.filter(self.keyset_filter(keys, values, backwards))
+            query = query.order_by(*[expr.desc() if desc != backwards else expr for expr, desc in keys])
+
+            rows = query.limit(per_page + 1).all()
+            more = len(rows) > per_page
+            rows = rows[:per_page]
+            if backwards:
+                return KeysetPage(attrs, list(reversed(rows)), has_prev=more, has_next=True)
+            else:
+                return KeysetPage(attrs, rows, has_prev=values is not None, has_next=more)
+
+        def estimated_count(self):
+            """
+            Counting every row of a large table like Tracking means reading all
+            of them, so on Postgres we ask the query planner how many rows it
+            expects this query to return and use that, unless it's a small
+            enough number that an exact count is cheap.
+            """
+            if Session.engine.dialect.name == 'postgresql':
+                compiled = self.order_by(None).statement.compile(dialect=Session.engine.dialect)
+                plan = self.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+                estimate = int((json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']['Plan Rows'])
+                if estimate >= c.EXACT_COUNT_THRESHOLD:
+                    return estimate
+            return self.count()
+
+        _distinct_values, _distinct_lock = {}, RLock()
+
+        def distinct_values(self, attr):
+            """
+            Returns a sorted list of the distinct non-null values of the given
+            column among the rows of this query, e.g. for a filter dropdown.
+            These are cached for c.DISTINCT_VALUES_TTL seconds, since they're
+            rarely worth a full scan of the table every time a page is loaded.
+            """
+            query = self.with_entities(attr).filter(attr != None).distinct().order_by(attr)
+            compiled = query.statement.compile()
+            key = (str(compiled), repr(sorted(compiled.params.items())))
+            with self._distinct_lock:
+                if key in self._distinct_values and monotonic() - self._distinct_values[key][0] < c.DISTINCT_VALUES_TTL:
+                    return self._distinct_values[key][1]
+
+            values = [val for val, in query]
+            with self._distinct_lock:
+                self._distinct_values[key] = (monotonic(), values)
+            return values
+
     class SessionMixin:
         def admin_attendee(self):
             return self.admin_account(cherrypy.session['account_id']).attendee
@@ -510,6 +880,18 @@ class Session(SessionManager):
                 assert attendee.amount_extra >= c.SEASON_LEVEL
                 return attendee
 
+        def season_passes_by_id(self, ids):
+            """
+            Returns a dict mapping each of the given ids to the season pass
+            holder returned by season_pass(), using one query per table.
+            """
+            ids = set(ids)
+            passes = {pss.id: pss for pss in self.query(PrevSeasonSupporter).filter(PrevSeasonSupporter.id.in_(ids))} if ids else {}
+            if ids - set(passes):
+                passes.update({a.id: a for a in self.query(Attendee).filter(Attendee.id.in_(ids - set(passes)),
+                                                                           Attendee.amount_extra >= c.SEASON_LEVEL)})
+            return passes
+
         def season_passes(self):
             attendees = {a.email: a for a in self.query(Attendee).filter(Attendee.amount_extra >= c.SEASON_LEVEL).all()}
             prev = [pss for pss in self.query(PrevSeasonSupporter).all() if pss.email not in attendees]
@@ -531,26 +913,37 @@ class Session(SessionManager):
             if badge_type not in c.PREASSIGNED_BADGE_TYPES:
                 return 0
 
-            sametype = self.query(Attendee).filter(Attendee.badge_type == badge_type,
-                                                   Attendee.badge_num >= c.BADGE_RANGES[badge_type][0],
-                                                   Attendee.badge_num <= c.BADGE_RANGES[badge_type][1])
-            if sametype.count():
-                next = sametype.order_by(Attendee.badge_num.desc()).first().badge_num
-                if old_badge_num and next == old_badge_num:
-                    next = next  # Prevents incrementing if the current badge already has the highest badge number in the range.
-                else:
-                    next += 1
+            lowest, highest = c.BADGE_RANGES[badge_type]
+            highest_taken = self.query(func.max(Attendee.badge_num)).filter(Attendee.badge_type == badge_type,
+                                                                            Attendee.badge_num >= lowest,
+                                                                            Attendee.badge_num <= highest).scalar()
+            if highest_taken is None:
+                next = lowest
+            elif old_badge_num and highest_taken == old_badge_num:
+                next = highest_taken  # Prevents incrementing if the current badge already has the highest badge number in the range.
             else:
-                next = c.BADGE_RANGES[badge_type][0]
+                next = highest_taken + 1
 
             # Adjusts the badge number based on badges in the session
-            for attendee in [m for m in chain(self.new, self.dirty) if isinstance(m, Attendee)]:
-                if attendee.badge_type == badge_type:
+            for attendee in chain(self.new, self.dirty):
+                if isinstance(attendee, Attendee) and attendee.badge_type == badge_type:
                     next = max(next, 1 + attendee.badge_num)
 
             return next
 
         def shift_badges(self, badge_type, badge_num, *, until=None, **direction):
+            """
+            Moves every badge of the given type from badge_num through until
+            one number up or down with a single UPDATE, which is recorded as one
+            Tracking entry rather than one for every badge we renumbered.  Any
+            of those attendees already loaded in this session are updated too.
+
+            When we're called from inside a flush (e.g. from a predelete
+            adjustment) we can't flush first, so a bulk UPDATE could match
+            attendees by stale numbers and throw away their unflushed edits;
+            in that case we renumber the attendees one at a time instead and
+            let the flush in progress write them out.
+            """
             # assert_badge_locked()
             until = until or c.MAX_BADGE
             assert c.SHIFT_CUSTOM_BADGES
@@ -558,11 +951,19 @@ class Session(SessionManager):
             assert len(direction) < 2, 'you cannot specify both up and down parameters'
             down = (not direction['up']) if 'up' in direction else direction.get('down', True)
             shift = -1 if down else 1
-            for a in self.query(Attendee).filter(Attendee.badge_type == badge_type,
-                                                 Attendee.badge_num >= badge_num,
-                                                 Attendee.badge_num <= until,
-                                                 Attendee.badge_num != 0):
-                a.badge_num += shift
+            to_shift = self.query(Attendee).filter(Attendee.badge_type == badge_type,
+                                                   Attendee.badge_num >= badge_num,
+                                                   Attendee.badge_num <= until,
+                                                   Attendee.badge_num != 0)
+            if self._flushing:
+                for a in to_shift:
+                    a.badge_num += shift
+                return
+
+            self._autoflush()
+            shifted = to_shift.update({Attendee.badge_num: Attendee.badge_num + shift}, synchronize_session='evaluate')
+            if shifted:
+                Tracking.track_badge_shift(self, badge_type, badge_num, until, shift, shifted)
 
         def change_badge(self, attendee, badge_type, badge_num=None):
             # assert_badge_locked()
@@ -631,7 +1032,7 @@ class Session(SessionManager):
                        .order_by(Attendee.full_name).all()
 
         def match_to_group(self, attendee, group):
-            with c.BADGE_LOCK:
+            with BadgeLocks.locked(self, attendee.badge_type):
                 available = [a for a in group.attendees if a.is_unassigned]
                 matching = [a for a in available if a.badge_type == attendee.badge_type]
                 if not available:
@@ -647,6 +1048,7 @@ class Session(SessionManager):
 
         def everything(self, location=None):
             location_filter = [Job.location == location] if location else []
+            dept_filter = [] if c.AT_THE_CON or not location else [MultiChoiceValue.selected(Attendee.assigned_depts, location)]
             jobs = self.query(Job) \
                        .filter(*location_filter) \
                        .options(joinedload(Job.shifts)) \
@@ -655,11 +1057,11 @@ class Session(SessionManager):
                          .filter(*location_filter) \
                          .options(joinedload(Shift.job), joinedload(Shift.attendee)) \
                          .join(Shift.job).order_by(Job.start_time).all()
-            attendees = [a for a in self.query(Attendee)
-                                        .filter_by(staffing=True)
-                                        .options(joinedload(Attendee.shifts), joinedload(Attendee.group))
-                                        .order_by(Attendee.full_name).all()
-                         if c.AT_THE_CON or not location or int(location) in a.assigned_depts_ints]
+            attendees = self.query(Attendee) \
+                            .filter_by(staffing=True) \
+                            .filter(*dept_filter) \
+                            .options(joinedload(Attendee.shifts), joinedload(Attendee.group)) \
+                            .order_by(Attendee.full_name).all()
             for job in jobs:
                 job._available_staffers = [a for a in attendees if not job.restricted or a.trusted]
             return jobs, shifts, attendees
@@ -674,22 +1076,34 @@ class Session(SessionManager):
                     return attendees.icontains(Group.name, term.strip())
 
             terms = text.split()
-            if len(terms) == 2:
+            if len(terms) == 2 and not terms[0].endswith(','):
                 first, last = terms
-                if first.endswith(','):
-                    last, first = first.strip(','), last
-                return attendees.icontains(first_name=first, last_name=last)
+                return attendees.filter(AttendeeSearch.contains(first), AttendeeSearch.contains(last)) \
+                                .icontains(first_name=first, last_name=last)
+            elif len(terms) == 2:
+                last, first = terms[0].strip(','), terms[1]
+                return attendees.filter(AttendeeSearch.contains(first), AttendeeSearch.contains(last)) \
+                                .icontains(first_name=first, last_name=last)
             elif len(terms) == 1 and terms[0].endswith(','):
-                return attendees.icontains(last_name=terms[0].rstrip(','))
+                last = terms[0].rstrip(',')
+                return attendees.filter(AttendeeSearch.contains(last)).icontains(last_name=last)
             elif len(terms) == 1 and terms[0].isdigit():
-                return attendees.filter(Attendee.badge_num == terms[0])
+                return attendees.filter(Attendee.badge_num == int(terms[0]))
             elif len(terms) == 1 and re.match('[a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}', terms[0]):
                 return attendees.filter(or_(Attendee.id == terms[0], Group.id == terms[0]))
             else:
-                checks = [Group.name.ilike('%' + text + '%')]
-                for attr in ['first_name', 'last_name', 'badge_printed_name', 'email', 'comments', 'admin_notes', 'for_review']:
-                    checks.append(getattr(Attendee, attr).ilike('%' + text + '%'))
-                return attendees.filter(or_(*checks))
+                # each of these can be answered from an index, so rather than OR-ing them together
+                # across our join with the group table, we look up the matching ids separately
+                matches, rank = AttendeeSearch.matches(text)
+                pattern = '%' + text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                matching_ids = union(
+                    select([Attendee.id]).where(matches),
+                    select([Attendee.id]).where(AttendeeSearch.contains(text)),
+                    select([Attendee.id]).select_from(Attendee.__table__.join(Group.__table__, Attendee.group_id == Group.id))
+                                         .where(func.lower(Group.name).like(pattern, escape='\\'))
+                )
+                attendees = attendees.filter(Attendee.id.in_(matching_ids))
+                return attendees.order_by(rank) if rank is not None else attendees
 
         def delete_from_group(self, attendee, group):
             '''
@@ -992,8 +1406,8 @@ class Attendee(MagModel, TakesPaymentMixin):
 
     staffing         = Column(Boolean, default=False)
     fire_safety_cert = Column(UnicodeText)
-    requested_depts  = Column(MultiChoice(c.JOB_INTEREST_OPTS))
-    assigned_depts   = Column(MultiChoice(c.JOB_LOCATION_OPTS), admin_only=True)
+    requested_depts  = Column(MultiChoice(c.JOB_INTEREST_OPTS, indexed=True))
+    assigned_depts   = Column(MultiChoice(c.JOB_LOCATION_OPTS, indexed=True), admin_only=True)
     trusted          = Column(Boolean, default=False, admin_only=True)
     nonshift_hours   = Column(Integer, default=0, admin_only=True)
     past_years       = Column(UnicodeText, admin_only=True)
@@ -1309,26 +1723,59 @@ class Attendee(MagModel, TakesPaymentMixin):
                 all_hours[hour] = shift.job
         return all_hours
 
+    def _hour_cache(self):
+        """
+        Returns a bitmask of the hours this attendee works (see hour_mask() in
+        uber.utils) along with a dict mapping each of those hours to the job
+        being worked.  We cache this on the instance and our event listeners
+        clear that cache whenever this attendee's shifts or their jobs' times
+        change, since we check it once for every job we might sign them up for.
+        """
+        if self.__dict__.get('_hour_cache_value') is None:
+            mask, jobs = 0, {}
+            for shift in self.shifts:
+                mask |= shift.job.hour_mask
+                for i in range(shift.job.duration):
+                    jobs[shift.job.first_hour + i] = shift.job
+            self.__dict__['_hour_cache_value'] = (mask, jobs)
+        return self.__dict__['_hour_cache_value']
+
+    @property
+    def hour_mask(self):
+        return self._hour_cache()[0]
+
+    @property
+    def hour_index_map(self):
+        return self._hour_cache()[1]
+
     @cached_property
     def possible(self):
+        """
+        Returns the jobs this attendee could sign up for.  Job.filled_slots
+        lets the database skip full jobs (and jobs this attendee isn't allowed
+        to work) using the index on location and start_time, so the only check
+        left to do in Python is the bitmask test for overlapping shifts.
+        """
         assert self.session, '.possible property may only be accessed for jobs attached to a session'
         if not self.assigned_depts and not c.AT_THE_CON:
             return []
-        else:
-            return [job for job in self.session.query(Job)
-                                       .filter(*[] if c.AT_THE_CON else [Job.location.in_(self.assigned_depts_ints)])
-                                       .options(joinedload(Job.shifts))
-                                       .order_by(Job.start_time).all()
-                        if job.slots > len(job.shifts)
-                           and job.no_overlap(self)
-                           and (job.type != c.SETUP or self.approved_for_setup)
-                           and (job.type != c.TEARDOWN or self.approved_for_teardown)
-                           and (not job.restricted or self.trusted)]
+
+        jobs = self.session.query(Job).filter(Job.slots > Job.filled_slots)
+        if not c.AT_THE_CON:
+            jobs = jobs.filter(Job.location.in_(self.assigned_depts_ints))
+        if not self.trusted:
+            jobs = jobs.filter(Job.restricted == False)
+        if not self.approved_for_setup:
+            jobs = jobs.filter(Job.type != c.SETUP)
+        if not self.approved_for_teardown:
+            jobs = jobs.filter(Job.type != c.TEARDOWN)
+        return [job for job in jobs.order_by(Job.start_time) if job.no_overlap(self)]
 
     @property
     def possible_opts(self):
+        now = sa.localized_now()
         return [(job.id, '(%s) [%s] %s' % (hour_day_format(job.start_time), job.location_label, job.name))
-                for job in self.possible if sa.localized_now() < job.start_time]
+                for job in self.possible if now < job.start_time]
 
     @property
     def possible_and_current(self):
@@ -1410,22 +1857,69 @@ class AdminAccount(MagModel):
 
     @staticmethod
     def admin_name():
-        try:
-            with Session() as session:
-                return session.admin_attendee().full_name
-        except:
-            return None
+        return AdminIdentity.current().name
 
     @staticmethod
     def access_set(id=None):
+        if id is None:
+            return set(AdminIdentity.current().access)
         try:
             with Session() as session:
-                id = id or cherrypy.session['account_id']
                 return set(session.admin_account(id).access_ints)
         except:
             return set()
 
 
+class AdminIdentity:
+    """
+    A single admin page render can check the logged-in admin's access levels
+    and name dozens of times, e.g. the @restricted decorator, every HAS_*_ACCESS
+    check in our templates, and every Tracking row written during a flush.  So
+    rather than opening a new session and querying the AdminAccount table for
+    each of those, we look up the account once per CherryPy request and stash
+    the result on the request object, which is thread-local and discarded once
+    the request finishes.
+
+    We store plain values rather than the AdminAccount itself, since the
+    session used to load the account is closed immediately afterwards.
+    """
+    def __init__(self, account_id=None):
+        self.account_id, self.attendee_id, self.name, self.access = account_id, None, None, frozenset()
+        if account_id:
+            try:
+                with Session() as session:
+                    account = session.admin_account(account_id)
+                    self.attendee_id = account.attendee_id
+                    self.name = account.attendee.full_name
+                    self.access = frozenset(account.access_ints)
+            except:
+                log.debug('unable to load admin account {}', account_id, exc_info=True)
+
+    @staticmethod
+    def _current_account_id():
+        try:
+            return cherrypy.session.get('account_id')
+        except:
+            return None  # e.g. we're in a DaemonTask thread which has no session
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the identity of the admin making the current request, loading
+        it from the database only on first use or if the logged-in account has
+        changed since we last looked (e.g. someone just logged in).
+        """
+        account_id = cls._current_account_id()
+        identity = getattr(cherrypy.request, 'admin_identity', None)
+        if identity is None or identity.account_id != account_id:
+            identity = cherrypy.request.admin_identity = cls(account_id)
+        return identity
+
+    @staticmethod
+    def invalidate():
+        cherrypy.request.admin_identity = None
+
+
 class PasswordReset(MagModel):
     account_id = Column(UUID, ForeignKey('admin_account.id'), unique=True)
     generated  = Column(UTCDateTime, server_default=utcnow())
@@ -1534,8 +2028,26 @@ class Job(MagModel):
     extra15     = Column(Boolean, default=False)
     shifts      = relationship('Shift', backref='job')
 
+    # the number of shifts for this job, kept up to date by _update_filled_slots()
+    # so we can find jobs with open slots without loading every shift
+    filled_slots = Column(Integer, default=0, admin_only=True)
+
+    __table_args__ = (
+        Index('ix_job_location_start_time', 'location', 'start_time'),
+    )
+
     _repr_attr_names = ['name']
 
+    @classmethod
+    def filled_slots_update(cls, job_ids=None):
+        """
+        Returns an UPDATE statement which recounts filled_slots for the given
+        job ids, or for every job if no ids are given.
+        """
+        count = select([func.count(Shift.id)]).where(Shift.job_id == cls.id).as_scalar()
+        update = cls.__table__.update().values(filled_slots=count)
+        return update if job_ids is None else update.where(cls.id.in_(job_ids))
+
     @property
     def hours(self):
         hours = set()
@@ -1547,16 +2059,23 @@ class Job(MagModel):
     def end_time(self):
         return self.start_time + timedelta(hours=self.duration)
 
+    @property
+    def first_hour(self):
+        return hour_index(self.start_time)
+
+    @property
+    def hour_mask(self):
+        if self.__dict__.get('_hour_mask') is None:
+            self.__dict__['_hour_mask'] = hour_mask(self.start_time, self.duration)
+        return self.__dict__['_hour_mask']
+
     def no_overlap(self, attendee):
-        before = self.start_time - timedelta(hours=1)
-        after  = self.start_time + timedelta(hours=self.duration)
-        return (not self.hours.intersection(attendee.hours)
-            and (before not in attendee.hour_map
-                or not attendee.hour_map[before].extra15
-                or self.location == attendee.hour_map[before].location)
-            and (after not in attendee.hour_map
-                or not self.extra15
-                or self.location == attendee.hour_map[after].location))
+        worked = attendee.hour_index_map
+        before = worked.get(self.first_hour - 1)
+        after = worked.get(self.first_hour + self.duration)
+        return (not self.hour_mask & attendee.hour_mask
+            and (not before or not before.extra15 or self.location == before.location)
+            and (not after or not self.extra15 or self.location == after.location))
 
     @property
     def slots_taken(self):
@@ -1574,11 +2093,15 @@ class Job(MagModel):
     def is_teardown(self):
         return self.start_time >= c.ESCHATON
 
-    @property
+    @hybrid_property
     def real_duration(self):
         return self.duration + (0.25 if self.extra15 else 0)
 
-    @property
+    @real_duration.expression
+    def real_duration(cls):
+        return cls.duration + case([(cls.extra15 == True, 0.25)], else_=0)
+
+    @hybrid_property
     def weighted_hours(self):
         return self.weight * self.real_duration
 
@@ -1588,7 +2111,9 @@ class Job(MagModel):
 
     @cached_property
     def all_staffers(self):
-        return self.session.query(Attendee).order_by(Attendee.last_first).all()
+        return self.session.query(Attendee) \
+                           .options(subqueryload(Attendee.shifts).joinedload(Shift.job)) \
+                           .order_by(Attendee.last_first).all()
 
     @cached_property
     def available_staffers(self):
@@ -1605,6 +2130,10 @@ class Shift(MagModel):
     rating      = Column(Choice(c.RATING_OPTS), default=c.UNRATED)
     comment     = Column(UnicodeText)
 
+    __table_args__ = (
+        Index('ix_shift_job_id', 'job_id'),
+    )
+
     @property
     def name(self):
         return "{self.attendee.full_name}'s {self.job.name!r} shift".format(self=self)
@@ -1614,6 +2143,31 @@ class Shift(MagModel):
         return {shift.id: shift.to_dict() for shift in shifts}
 
 
+def _clear_hour_cache(attendee, *ignored):
+    attendee.__dict__.pop('_hour_cache_value', None)
+
+
+def _clear_hour_cache_on_expire(attendee, attrs):
+    if attrs is None or 'shifts' in attrs:
+        _clear_hour_cache(attendee)
+
+
+def _clear_job_hour_caches(job, *ignored):
+    job.__dict__.pop('_hour_mask', None)
+    for shift in job.__dict__.get('shifts', []):
+        if 'attendee' in shift.__dict__ and shift.attendee:
+            _clear_hour_cache(shift.attendee)
+
+listen(Attendee.shifts, 'append', _clear_hour_cache)
+listen(Attendee.shifts, 'remove', _clear_hour_cache)
+listen(Attendee, 'expire', _clear_hour_cache_on_expire)
+listen(Attendee, 'refresh', _clear_hour_cache)
+listen(Job.start_time, 'set', _clear_job_hour_caches)
+listen(Job.duration, 'set', _clear_job_hour_caches)
+listen(Job, 'expire', _clear_job_hour_caches)
+listen(Job, 'refresh', _clear_job_hour_caches)
+
+
 class MPointsForCash(MagModel):
     attendee_id = Column(UUID, ForeignKey('attendee.id'))
     amount      = Column(Integer)
@@ -1686,11 +2240,15 @@ class ApprovedEmail(MagModel):
 class Email(MagModel):
     fk_id   = Column(UUID, nullable=True)
     model   = Column(UnicodeText)
-    when    = Column(UTCDateTime, default=lambda: datetime.now(UTC))
+    when    = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(UTC))
     subject = Column(UnicodeText)
     dest    = Column(UnicodeText)
     body    = Column(UnicodeText)
 
+    __table_args__ = (
+        Index('ix_email_when', 'when', 'id'),
+    )
+
     _repr_attr_names = ['subject']
 
     @cached_property
@@ -1715,20 +2273,461 @@ class Email(MagModel):
             return SafeString(self.body.replace('\n', '<br/>'))
 
 
+class OutgoingEmail(MagModel):
+    """
+    Emails waiting to be sent.  Rather than talking to our mail provider while
+    someone waits on a page to load, send_email just inserts one of these, and
+    our send_pending DaemonTask hands them off to our email transport.  Once an
+    email is delivered we delete it from here and record it in the Email table;
+    when delivery fails we try again later, waiting twice as long each time.
+    """
+    fk_id        = Column(UUID, nullable=True)
+    model        = Column(UnicodeText, nullable=True)
+    created      = Column(UTCDateTime, default=lambda: datetime.now(UTC))
+    next_attempt = Column(UTCDateTime, default=lambda: datetime.now(UTC))
+    attempts     = Column(Integer, default=0)
+    last_error   = Column(UnicodeText)
+    source       = Column(UnicodeText)
+    dest         = Column(UnicodeText)
+    recipients   = Column(UnicodeText)
+    cc           = Column(UnicodeText)
+    bcc          = Column(UnicodeText)
+    subject      = Column(UnicodeText)
+    body         = Column(UnicodeText)
+    format       = Column(UnicodeText, default='text')
+
+    _repr_attr_names = ['subject']
+
+    @classmethod
+    def enqueue(cls, source, to, cc, bcc, subject, body, format='text', dest=None, model=None):
+        """
+        Saves an email to be sent in the background.  If dest and model are
+        provided then we'll record an Email row for the model once it's sent.
+        """
+        body = body.decode('utf-8') if isinstance(body, bytes) else body
+        fk = {}
+        if model and dest:
+            fk = {'model': 'n/a'} if model == 'n/a' else {'fk_id': model.id, 'model': model.__class__.__name__}
+        with Session() as session:
+            session.add(cls(source=source, recipients=','.join(to), cc=','.join(cc), bcc=','.join(bcc),
+                            subject=subject, body=body, format=format, dest=dest and ','.join(listify(dest)), **fk))
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Claims up to the given number of emails which are due to be sent by
+        pushing their next attempt out by c.EMAIL_CLAIM_SECONDS, returning their
+        ids.  Each claim is a conditional UPDATE, so if another process claims
+        the same email first (Postgres makes us wait for its transaction), our
+        UPDATE matches no rows and we leave that email to them.
+        """
+        now = datetime.now(UTC)
+        claimed_until = now + timedelta(seconds=c.EMAIL_CLAIM_SECONDS)
+        with Session() as session:
+            due = session.query(cls.id).filter(cls.next_attempt <= now, cls.attempts < c.EMAIL_MAX_ATTEMPTS) \
+                                       .order_by(cls.created).limit(limit).all()
+            return [id for id, in due if session.execute(cls.__table__.update()
+                                                                   .where(and_(cls.id == id, cls.next_attempt <= now))
+                                                                   .values(next_attempt=claimed_until)).rowcount]
+
+    @classmethod
+    def send_pending(cls):
+        claimed = cls.claim(c.EMAIL_QUEUE_SIZE)
+        if claimed:
+            with Session() as session:
+                for outgoing in session.query(cls).filter(cls.id.in_(claimed)).order_by(cls.created):
+                    email_transport.send(outgoing.source, outgoing.recipients_list, outgoing.cc_list, outgoing.bcc_list,
+                                         outgoing.subject, outgoing.body, outgoing.format,
+                                         on_sent=partial(cls.sent, outgoing.id), on_error=partial(cls.failed, outgoing.id))
+
+        # wait until everything is sent so that we never have more than one batch in flight
+        email_transport.flush()
+
+    @classmethod
+    def sent(cls, id):
+        try:
+            with Session() as session:
+                outgoing = session.outgoing_email(id)
+                if outgoing.model:
+                    session.add(Email(fk_id=outgoing.fk_id, model=outgoing.model, subject=outgoing.subject,
+                                      dest=outgoing.dest, body=outgoing.body))
+                session.delete(outgoing)
+        except Exception:
+            # the email was delivered, so we'd rather lose our record of it than send it again once our claim expires
+            log.error('unable to record that email {} was sent, marking it as given up on instead', id, exc_info=True)
+            with Session() as session:
+                session.query(cls).filter_by(id=id).update({
+                    'attempts': c.EMAIL_MAX_ATTEMPTS,
+                    'last_error': 'delivered, but we were unable to record it in the email table'
+                }, synchronize_session=False)
+
+    @classmethod
+    def failed(cls, id, error):
+        with Session() as session:
+            outgoing = session.outgoing_email(id)
+            outgoing.attempts += 1
+            outgoing.last_error = error
+            outgoing.next_attempt = datetime.now(UTC) + timedelta(seconds=c.EMAIL_RETRY_DELAY * 2 ** (outgoing.attempts - 1))
+            if outgoing.attempts >= c.EMAIL_MAX_ATTEMPTS:
+                log.error('giving up on sending {!r} email to {} after {} attempts', outgoing.subject, outgoing.recipients, outgoing.attempts)
+
+    @property
+    def recipients_list(self):
+        return [addr for addr in self.recipients.split(',') if addr]
+
+    @property
+    def cc_list(self):
+        return [addr for addr in (self.cc or '').split(',') if addr]
+
+    @property
+    def bcc_list(self):
+        return [addr for addr in (self.bcc or '').split(',') if addr]
+
+
+class StatsSnapshot(MagModel):
+    """
+    Saved results of our expensive reports, e.g. the registration stats page,
+    which admins tend to refresh constantly during the event.  Reports are
+    functions which take a session and return JSON-serializable template
+    data; registering one with @StatsSnapshot.register(Attendee, Group, ...)
+    means that our refresh DaemonTask recomputes it whenever any of those
+    tables have changed (checked every c.STATS_SNAPSHOT_INTERVAL seconds)
+    and at least every c.STATS_SNAPSHOT_MAX_AGE seconds regardless.
+
+    Each time a report's results change we save a new version rather than
+    overwriting the old one, so history() and diff() can show how the
+    numbers have changed over the last c.STATS_SNAPSHOT_HISTORY days.
+    """
+    report   = Column(UnicodeText)
+    version  = Column(Integer)
+    computed = Column(UTCDateTime, default=lambda: datetime.now(UTC))
+    data     = Column(UnicodeText)
+
+    __table_args__ = (
+        Index('ix_stats_snapshot_report_version', 'report', 'version', unique=True),
+    )
+
+    _repr_attr_names = ['report', 'version']
+
+    lock = RLock()
+    reports = OrderedDict()
+    refreshed = {}
+    changed_tables = set()
+
+    @classmethod
+    def register(cls, *models):
+        def decorator(func):
+            cls.reports[cls.report_name(func)] = (func, {model.__tablename__ for model in models})
+            return func
+        return decorator
+
+    @staticmethod
+    def report_name(func):
+        return '{}.{}'.format(func.__module__.split('.')[-1], func.__name__)
+
+    @classmethod
+    def latest(cls, session, name):
+        return session.query(cls).filter_by(report=name).order_by(cls.version.desc()).first()
+
+    @classmethod
+    def compute(cls, session, name):
+        """
+        Runs the given report and saves its results, returning the snapshot.
+        If nothing has changed since the last version, we just update when
+        that version was computed rather than saving an identical copy.  We
+        only flush, leaving it to the caller to commit.
+        """
+        func, tables = cls.reports[name]
+        data = json.dumps(func(session), sort_keys=True)
+        snapshot = cls.latest(session, name)
+        if snapshot and snapshot.data == data:
+            snapshot.computed = datetime.now(UTC)
+            session.flush()
+        else:
+            snapshot = cls(report=name, version=snapshot.version + 1 if snapshot else 1, data=data)
+            try:
+                with session.begin_nested():
+                    session.add(snapshot)
+            except sqlalchemy.exc.IntegrityError:
+                # another process saved this version at the same time, and its results are just as fresh
+                snapshot = cls.latest(session, name)
+        with cls.lock:
+            cls.refreshed[name] = monotonic()
+        return snapshot
+
+    @classmethod
+    def get(cls, session, func, live=False):
+        """
+        Returns the template data for the given report from its latest
+        snapshot, or runs the report right now if live is set.  The data also
+        includes when it was computed so that our pages can show how fresh the
+        numbers are.
+        """
+        name = cls.report_name(func)
+        snapshot = None if live else cls.latest(session, name)
+        if not snapshot:
+            snapshot = cls.compute(session, name)
+        return dict(json.loads(snapshot.data), snapshot_computed=snapshot.computed, snapshot_live=bool(live))
+
+    @classmethod
+    def refresh(cls):
+        with cls.lock:
+            changed, cls.changed_tables = cls.changed_tables, set()
+
+        for name, (func, tables) in cls.reports.items():
+            last = cls.refreshed.get(name)
+            if last is None or monotonic() - last > c.STATS_SNAPSHOT_MAX_AGE or tables & changed:
+                try:
+                    with Session() as session:
+                        cls.compute(session, name)
+                except:
+                    log.error('unable to refresh the {} report', name, exc_info=True)
+
+        with Session() as session:
+            session.query(cls).filter(cls.computed < datetime.now(UTC) - timedelta(days=c.STATS_SNAPSHOT_HISTORY)) \
+                              .delete(synchronize_session=False)
+
+    @classmethod
+    def note_changes(cls, tables):
+        with cls.lock:
+            cls.changed_tables.update(tables)
+
+    @classmethod
+    def history(cls, session, func, since=None):
+        """
+        Returns a list of (computed, data) tuples for every saved version of the
+        given report, oldest first, optionally only those computed since the
+        given datetime.
+        """
+        snapshots = session.query(cls).filter_by(report=cls.report_name(func))
+        if since:
+            snapshots = snapshots.filter(cls.computed >= since)
+        return [(snapshot.computed, json.loads(snapshot.data)) for snapshot in snapshots.order_by(cls.version)]
+
+    @classmethod
+    def trend(cls, session, func, *path, since=None):
+        """
+        Returns a list of (computed, value) tuples for a single number in the
+        given report over time, e.g. trend(session, registration_stats, 'total_count')
+        """
+        trend = []
+        for computed, data in cls.history(session, func, since=since):
+            try:
+                for key in path:
+                    data = data[key]
+            except (KeyError, IndexError, TypeError):
+                data = None
+            trend.append((computed, data))
+        return trend
+
+    @classmethod
+    def diff(cls, old, new, path=()):
+        """
+        Returns a list of (path, old_value, new_value) tuples for every value
+        which differs between two versions of a report's data, where each path
+        is a tuple of the keys and list indices leading to that value.
+        """
+        if isinstance(old, dict) and isinstance(new, dict):
+            return list(chain.from_iterable(cls.diff(old.get(key), new.get(key), path + (key,))
+                                            for key in sorted(set(old).union(new))))
+        elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+            return list(chain.from_iterable(cls.diff(o, n, path + (i,)) for i, (o, n) in enumerate(zip(old, new))))
+        else:
+            return [] if old == new else [(path, old, new)]
+
+
+class MultiChoiceValue(MagModel):
+    """
+    One row for each option selected in each MultiChoice column declared with
+    indexed=True, e.g. one for each department an attendee is assigned to.
+    Looking up every attendee in a department this way uses an index, unlike
+    filtering the comma-separated column with LIKE, and can't mistake
+    department 1 for department 10.  A before_flush listener keeps these rows
+    in sync with the columns, and rebuild() recreates all of them, which we
+    do on startup if there aren't any yet, e.g. for an existing database.
+    """
+    model = Column(UnicodeText)
+    field = Column(UnicodeText)
+    value = Column(Integer)
+    fk_id = Column(UUID)
+
+    __table_args__ = (
+        Index('ix_multi_choice_value_lookup', 'model', 'field', 'value', 'fk_id'),
+        Index('ix_multi_choice_value_fk_id', 'fk_id'),
+    )
+
+    @classmethod
+    def selected(cls, attr, value):
+        """
+        Returns a filter for rows with the given option selected in the given
+        column, e.g. MultiChoiceValue.selected(Attendee.assigned_depts, c.CONSOLE)
+        """
+        assert attr.property.columns[0].type.indexed, '{} is not an indexed MultiChoice column'.format(attr)
+        return attr.class_.id.in_(select([cls.fk_id]).where(and_(
+            cls.model == attr.class_.__tablename__,
+            cls.field == attr.key,
+            cls.value == int(value))))
+
+    @staticmethod
+    def parse(raw):
+        raw = raw if isinstance(raw, str) or raw is None else ','.join(map(str, raw))
+        return sorted({int(val) for val in (raw or '').split(',') if val})
+
+    @classmethod
+    def rows(cls, tablename, id, name, raw):
+        return [{'id': str(uuid4()), 'model': tablename, 'field': name, 'value': val, 'fk_id': id} for val in cls.parse(raw)]
+
+    @classmethod
+    def sync(cls, session):
+        """
+        Replaces the rows for every indexed column which is about to be saved
+        for a new or changed instance, and deletes the rows of deleted ones.
+        """
+        stale, inserts = defaultdict(list), []
+        for instance in chain(session.new, session.dirty, session.deleted):
+            names = ModelMetadata.get(instance.__class__).indexed_multichoice_columns
+            if names and instance in session.deleted:
+                for name in names:
+                    stale[name].append(instance.id)
+            elif names:
+                is_new = instance in session.new
+                for name in names:
+                    if is_new or get_history(instance, name).has_changes():
+                        if not is_new:
+                            stale[name].append(instance.id)
+                        inserts.extend(cls.rows(instance.__tablename__, instance.id, name, getattr(instance, name)))
+
+        for name, ids in stale.items():
+            session.execute(cls.__table__.delete().where(and_(cls.field == name, cls.fk_id.in_(ids))))
+        if inserts:
+            session.execute(cls.__table__.insert(), inserts)
+
+    @classmethod
+    def rebuild(cls, session):
+        """
+        Deletes and recreates every row from the indexed MultiChoice columns
+        themselves, returning how many rows we saved.
+        """
+        session.execute(cls.__table__.delete())
+        count = 0
+        for model in Session.all_models():
+            for name in ModelMetadata.get(model).indexed_multichoice_columns:
+                rows = []
+                for id, raw in session.query(model.id, getattr(model, name)).filter(getattr(model, name) != '').yield_per(c.CSV_BATCH_SIZE):
+                    rows.extend(cls.rows(model.__tablename__, id, name, raw))
+                    if len(rows) >= c.CSV_BATCH_SIZE:
+                        session.execute(cls.__table__.insert(), rows)
+                        count, rows = count + len(rows), []
+                if rows:
+                    session.execute(cls.__table__.insert(), rows)
+                    count += len(rows)
+        return count
+
+
 class Tracking(MagModel):
-    fk_id  = Column(UUID)
+    fk_id  = Column(UUID, nullable=True)  # null for summaries of many rows, e.g. badge number shifts
     model  = Column(UnicodeText)
-    when   = Column(UTCDateTime, default=lambda: datetime.now(UTC))
+    when   = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(UTC))
     who    = Column(UnicodeText)
     which  = Column(UnicodeText)
     links  = Column(UnicodeText)
     action = Column(Choice(c.TRACKING_OPTS))
     data   = Column(UnicodeText)
+    changes = Column(UnicodeText, default='')
+
+    link_rows = relationship('TrackingLink', backref='tracking')
+
+    __table_args__ = (
+        Index('ix_tracking_when', 'when', 'id'),
+        Index('ix_tracking_who', 'who'),
+        Index('ix_tracking_action', 'action', 'when'),
+    )
+
+    @property
+    def changed(self):
+        """
+        Returns a dictionary mapping the name of each column this change set to
+        an [old value, new value] list, e.g. {"paid": [1, 2]} for an update.
+        Unlike our data string these are the actual column values, with
+        datetimes and dates as ISO-formatted strings.
+        """
+        return json.loads(self.changes) if self.changes else {}
 
     @classmethod
     def format(cls, values):
         return ', '.join('{}={}'.format(k, v) for k, v in values.items())
 
+    @classmethod
+    def json_value(cls, column, value):
+        if column.name == 'hashed':
+            return '<bcrypted>'
+        elif isinstance(value, (datetime, date)):
+            return value.isoformat()
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        else:
+            return str(value)
+
+    @classmethod
+    def json_changes(cls, instance, changed):
+        columns = instance.__table__.columns
+        return json.dumps({attr: [cls.json_value(columns[attr], old), cls.json_value(columns[attr], new)]
+                           for attr, (old, new) in changed.items()}, sort_keys=True)
+
+    _foreign_keys = {}
+
+    @classmethod
+    def foreign_keys(cls, model):
+        """
+        Returns a list of (column name, table name) tuples for each of the given
+        model's foreign key columns, which we only need to work out once.
+        """
+        if model not in cls._foreign_keys:
+            cls._foreign_keys[model] = [(name, list(column.foreign_keys)[0].column.table.name)
+                                        for name, column in model.__table__.columns.items() if column.foreign_keys]
+        return cls._foreign_keys[model]
+
+    @classmethod
+    def link_keys(cls, instance):
+        """
+        Returns a list of (table name, id) tuples for the instance itself and
+        every row it has a foreign key to, which we save as TrackingLink rows.
+        """
+        keys = [(instance.__tablename__, instance.id)]
+        for name, tablename in cls.foreign_keys(instance.__class__):
+            if getattr(instance, name):
+                keys.append((tablename, getattr(instance, name)))
+        return keys
+
+    @classmethod
+    def related(cls, session, id):
+        """
+        Returns a query for every change made to the row with the given id or to
+        any row with a foreign key pointing at it, e.g. an attendee's shifts.
+        """
+        return session.query(cls).filter(cls.id.in_(session.query(TrackingLink.tracking_id).filter_by(fk_id=id)))
+
+    @classmethod
+    def search_filter(cls, text):
+        """
+        Returns a filter for changes with the given text in their description or
+        the values they set, which the trigram indexes can answer on Postgres.
+        """
+        pattern = '%' + text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return or_(func.lower(cls.data).like(pattern, escape='\\'), func.lower(cls.which).like(pattern, escape='\\'))
+
+    @classmethod
+    def create_indexes(cls):
+        if Session.engine.dialect.name == 'postgresql':
+            with Session.engine.begin() as conn:
+                try:
+                    with conn.begin_nested():
+                        conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                        conn.execute('CREATE INDEX IF NOT EXISTS ix_tracking_data_trigram ON tracking USING gin (lower(data) gin_trgm_ops)')
+                        conn.execute('CREATE INDEX IF NOT EXISTS ix_tracking_which_trigram ON tracking USING gin (lower(which) gin_trgm_ops)')
+                except:
+                    log.warning('unable to create trigram indexes, keyword searches of the feed will scan the tracking table', exc_info=True)
+
     @classmethod
     def repr(cls, column, value):
         try:
@@ -1746,66 +2745,159 @@ class Tracking(MagModel):
             raise ValueError('error formatting {} ({!r})'.format(column.name, value)) from e
 
     @classmethod
-    def differences(cls, instance):
-        diff = {}
+    def changed_values(cls, instance):
+        changed = OrderedDict()
         for attr, column in instance.__table__.columns.items():
             new_val = getattr(instance, attr)
             old_val = instance.orig_value_of(attr)
             if old_val != new_val:
-                diff[attr] = "'{} -> {}'".format(cls.repr(column, old_val), cls.repr(column, new_val))
-        return diff
+                changed[attr] = (old_val, new_val)
+        return changed
 
-    # TODO: add new table for page views to eliminated track_pageview method and to eliminate Budget special case
     @classmethod
-    def track(cls, action, instance):
+    def differences(cls, instance, changed=None):
+        columns = instance.__table__.columns
+        changed = cls.changed_values(instance) if changed is None else changed
+        return OrderedDict((attr, "'{} -> {}'".format(cls.repr(columns[attr], old_val), cls.repr(columns[attr], new_val)))
+                           for attr, (old_val, new_val) in changed.items())
+
+    @staticmethod
+    def current_who():
+        return AdminAccount.admin_name() or (current_thread().name if current_thread().daemon else 'non-admin')
+
+    @classmethod
+    def modified_values(cls, instance):
+        """
+        Like changed_values(), but only checks the history of the attributes
+        SQLAlchemy has marked as modified rather than of every column.
+        """
+        changed = OrderedDict()
+        columns = instance.__table__.columns
+        for attr in instance_state(instance).committed_state:
+            if attr in columns:
+                old_val, new_val = instance.orig_value_of(attr), getattr(instance, attr)
+                if old_val != new_val:
+                    changed[attr] = (old_val, new_val)
+        return changed
+
+    @classmethod
+    def row_values(cls, action, instance, who, when, changed=None):
+        """
+        Returns a tuple of (Tracking column values, [TrackingLink column values])
+        for the given change to the given instance, or None if it's an update
+        which didn't actually change anything.
+        """
+        changes = ''
         if action in [c.CREATED, c.UNPAID_PREREG, c.EDITED_PREREG]:
             vals = {attr: cls.repr(column, getattr(instance, attr)) for attr, column in instance.__table__.columns.items()}
             data = cls.format(vals)
+            changes = cls.json_changes(instance, {attr: (None, getattr(instance, attr)) for attr in instance.__table__.columns.keys()})
         elif action == c.UPDATED:
-            diff = cls.differences(instance)
+            changed = cls.changed_values(instance) if changed is None else changed
+            diff = cls.differences(instance, changed)
             data = cls.format(diff)
+            changes = cls.json_changes(instance, changed)
             if len(diff) == 1 and 'badge_num' in diff:
                 action = c.AUTO_BADGE_SHIFT
             elif not data:
-                return
-        elif instance == 'Budget':  # Vaguely horrifying special-casing where we make up fake data so we can insert this entry into the tracking DB
-            data = 'Budget Page'
-            who = AdminAccount.admin_name() or (current_thread().name if current_thread().daemon else 'non-admin')
+                return None
+        else:
+            data = 'id={}'.format(instance.id)
+
+        link_keys = cls.link_keys(instance)
+        values = {
+            'id': str(uuid4()),
+            'model': instance.__class__.__name__,
+            'fk_id': instance.id,
+            'when': when,
+            'which': repr(instance),
+            'who': who,
+            'links': ', '.join('{}({})'.format(model, fk_id) for model, fk_id in link_keys[1:]),
+            'action': action,
+            'data': data,
+            'changes': changes
+        }
+        return values, [{'id': str(uuid4()), 'tracking_id': values['id'], 'model': model, 'fk_id': fk_id} for model, fk_id in link_keys]
+
+    # TODO: add new table for page views to eliminated track_pageview method and to eliminate Budget special case
+    @classmethod
+    def track(cls, action, instance):
+        if instance == 'Budget':  # Vaguely horrifying special-casing where we make up fake data so we can insert this entry into the tracking DB
             with Session() as session:
                 session.add(Tracking(
                     model='Budget',
                     fk_id=str(uuid4()),
                     which='Budget',
-                    who=who,
+                    who=cls.current_who(),
                     links='',
                     action=action,
-                    data=data
+                    data='Budget Page'
                 ))
             return
-        else:
-            data = 'id={}'.format(instance.id)
-        links = ', '.join(
-            '{}({})'.format(list(column.foreign_keys)[0].column.table.name, getattr(instance, name))
-            for name, column in instance.__table__.columns.items()
-            if column.foreign_keys and getattr(instance, name)
-        )
-        who = AdminAccount.admin_name() or (current_thread().name if current_thread().daemon else 'non-admin')
-
-        def _insert(session):
-            session.add(Tracking(
-                model=instance.__class__.__name__,
-                fk_id=instance.id,
-                which=repr(instance),
-                who=who,
-                links=links,
-                action=action,
-                data=data
-            ))
-        if instance.session:
-            _insert(instance.session)
-        else:
-            with Session() as session:
-                _insert(session)
+
+        tracked = cls.row_values(action, instance, cls.current_who(), datetime.now(UTC))
+        if tracked:
+            values, links = tracked
+            if instance.session:
+                instance.session.add(Tracking(link_rows=[TrackingLink(**link) for link in links], **values))
+            else:
+                with Session() as session:
+                    session.add(Tracking(link_rows=[TrackingLink(**link) for link in links], **values))
+
+    @classmethod
+    def track_flush(cls, session):
+        """
+        Tracks every change in the session which is about to be flushed, looking
+        up who made them only once and saving them with one INSERT for our
+        Tracking rows and one for their TrackingLink rows.  With
+        c.TRACKING_ASYNC the rows are instead handed to our tracking_writer
+        once the transaction is committed, so that nobody waits on them.
+        """
+        who, when = cls.current_who(), datetime.now(UTC)
+        rows, links = [], []
+        for action, instances in [(c.CREATED, session.new), (c.UPDATED, session.dirty), (c.DELETED, session.deleted)]:
+            for instance in instances:
+                if instance.__class__ not in cls.UNTRACKED:
+                    changed = cls.modified_values(instance) if action == c.UPDATED else None
+                    tracked = cls.row_values(action, instance, who, when, changed)
+                    if tracked:
+                        rows.append(tracked[0])
+                        links.extend(tracked[1])
+
+        if rows and c.TRACKING_ASYNC:
+            session.info.setdefault('tracking_rows', []).append((session.transaction, rows, links))
+        elif rows:
+            cls.insert_rows(session, rows, links)
+
+    @classmethod
+    def insert_rows(cls, session, rows, links):
+        session.execute(cls.__table__.insert(), rows)
+        if links:
+            session.execute(TrackingLink.__table__.insert(), links)
+
+    @classmethod
+    def track_badge_shift(cls, session, badge_type, badge_num, until, shift, count):
+        session.add(Tracking(
+            model='Attendee',
+            fk_id=None,
+            which='{} badges #{} - #{}'.format(c.BADGES[badge_type], badge_num, min(until, c.BADGE_RANGES[badge_type][1])),
+            who=cls.current_who(),
+            links='',
+            action=c.AUTO_BADGE_SHIFT,
+            data='badge_num {} by 1 for {} badges'.format('decreased' if shift < 0 else 'increased', count)
+        ))
+
+    @classmethod
+    def track_bulk_import(cls, session, model, count):
+        session.add(Tracking(
+            model=model.__name__,
+            fk_id=None,
+            which='{} imported {}s'.format(count, model.__name__),
+            who=cls.current_who(),
+            links='',
+            action=c.CREATED,
+            data='bulk import of {} {} rows'.format(count, model.__tablename__)
+        ))
 
     @classmethod
     def track_pageview(cls, url, query):
@@ -1829,7 +2921,207 @@ class Tracking(MagModel):
                     group = session.query(Group).filter(Group.id == params['id']).first()
                     Tracking.track(c.PAGE_VIEWED, group)
 
-Tracking.UNTRACKED = [Tracking, Email]
+
+class TrackingLink(MagModel):
+    """
+    One row for each row a Tracking entry is about, i.e. the changed row itself
+    and every row it had a foreign key to, so that e.g. an attendee's history
+    page can look up every related change by id instead of searching through
+    the links string of every Tracking row.
+    """
+    tracking_id = Column(UUID, ForeignKey('tracking.id', ondelete='cascade'))
+    model       = Column(UnicodeText)
+    fk_id       = Column(UUID)
+
+    __table_args__ = (
+        Index('ix_tracking_link_fk_id', 'fk_id', 'model'),
+        Index('ix_tracking_link_tracking_id', 'tracking_id'),
+    )
+
+    @classmethod
+    def backfill(cls, session):
+        """
+        Creates the link rows for Tracking entries saved before we had this
+        table, by parsing their links strings, returning how many we linked.
+        """
+        tablenames = {}
+        linked = session.query(cls.tracking_id).distinct().subquery()
+        rows, count = [], 0
+        entries = session.query(Tracking.id, Tracking.model, Tracking.fk_id, Tracking.links) \
+                         .filter(~Tracking.id.in_(linked)).yield_per(c.CSV_BATCH_SIZE)
+        for id, model, fk_id, links in entries:
+            if model not in tablenames:
+                try:
+                    tablenames[model] = Session.resolve_model(model).__tablename__
+                except Exception:
+                    tablenames[model] = None
+            if tablenames[model] and fk_id:
+                rows.append({'id': str(uuid4()), 'tracking_id': id, 'model': tablenames[model], 'fk_id': fk_id})
+            for tablename, link_id in re.findall(r'(\w+)\(([0-9a-f-]{36})\)', links or ''):
+                rows.append({'id': str(uuid4()), 'tracking_id': id, 'model': tablename, 'fk_id': link_id})
+            count += 1
+            if len(rows) >= c.CSV_BATCH_SIZE:
+                session.execute(cls.__table__.insert(), rows)
+                rows = []
+        if rows:
+            session.execute(cls.__table__.insert(), rows)
+        return count
+
+
+class TrackingWriter:
+    """
+    Saves tracked changes on a background thread when c.TRACKING_ASYNC is set,
+    so that committing a transaction never waits on our tracking INSERTs.
+    Whatever has been queued by the time the thread gets to it is saved in a
+    single session; call flush() to wait until everything queued is saved.
+    """
+    def __init__(self):
+        self.queue = Queue(maxsize=c.TRACKING_QUEUE_SIZE)
+        self.thread = None
+        self.lock = RLock()
+
+    def start(self):
+        with self.lock:
+            if not self.thread:
+                self.thread = Thread(target=self._run, name='tracking_writer', daemon=True)
+                self.thread.start()
+
+    def write(self, rows, links):
+        if stopped.is_set():
+            self.save([(rows, links)])
+        else:
+            self.start()
+            self.queue.put((rows, links))
+
+    def save(self, batches):
+        with Session() as session:
+            for rows, links in batches:
+                Tracking.insert_rows(session, rows, links)
+
+    def flush(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            batches = [self.queue.get()]
+            while self.queue.qsize() and len(batches) < c.TRACKING_QUEUE_SIZE:
+                batches.append(self.queue.get())
+            try:
+                self.save(batches)
+            except:
+                log.error('unable to save {} tracked changes', sum(len(rows) for rows, links in batches), exc_info=True)
+            finally:
+                for batch in batches:
+                    self.queue.task_done()
+
+tracking_writer = TrackingWriter()
+
+Tracking.UNTRACKED = [Tracking, TrackingLink, MultiChoiceValue, Email, OutgoingEmail, StatsSnapshot]
+
+
+class BadgeCounts:
+    """
+    c.BADGES_SOLD and c.SUPPORTER_COUNT are read on every prereg page and on
+    every poll of our public stats pages, so rather than running COUNT queries
+    each time, we keep these totals in memory.  Our session listeners work out
+    how much each flush changes these totals and apply those changes once the
+    transaction is committed.  We also periodically re-run the real queries
+    with a DaemonTask, since other processes may be writing to the database,
+    and if that hasn't happened within c.BADGE_COUNT_STALENESS seconds then we
+    re-run the queries the next time a count is read.
+    """
+    lock = RLock()
+    counts = {}
+    reconciled = None
+
+    @staticmethod
+    def query_counts(session):
+        attendees = session.query(Attendee)
+        individuals = attendees.filter(or_(Attendee.paid == c.HAS_PAID, Attendee.paid == c.REFUNDED)).count()
+        group_badges = attendees.join(Attendee.group).filter(Attendee.paid == c.PAID_BY_GROUP, Group.amount_paid > 0).count()
+        individual_supporters = attendees.filter(Attendee.paid.in_([c.HAS_PAID, c.REFUNDED]),
+                                                 Attendee.amount_extra >= c.SUPPORTER_LEVEL).count()
+        group_supporters = attendees.filter(Attendee.paid == c.PAID_BY_GROUP,
+                                            Attendee.amount_extra >= c.SUPPORTER_LEVEL,
+                                            Attendee.amount_paid >= c.SUPPORTER_LEVEL).count()
+        return {
+            'badges_sold': individuals + group_badges,
+            'supporter_count': individual_supporters + group_supporters
+        }
+
+    @classmethod
+    def reconcile(cls):
+        with Session() as session:
+            counts = cls.query_counts(session)
+        with cls.lock:
+            cls.counts, cls.reconciled = counts, monotonic()
+
+    @classmethod
+    def get(cls, name):
+        # reconcile() runs its queries before taking the lock, so other readers don't wait on them
+        with cls.lock:
+            stale = cls.reconciled is None or monotonic() - cls.reconciled > c.BADGE_COUNT_STALENESS
+        if stale:
+            cls.reconcile()
+        with cls.lock:
+            return cls.counts[name]
+
+    @classmethod
+    def apply(cls, deltas):
+        with cls.lock:
+            if cls.reconciled is not None:
+                for name, delta in deltas.items():
+                    cls.counts[name] += delta
+
+    @staticmethod
+    def _group_paid(session, attendee, orig):
+        if orig:
+            group_id = attendee.orig_value_of('group_id')
+            group = group_id and session.query(Group).get(group_id)
+            return bool(group) and (group.orig_value_of('amount_paid') or 0) > 0
+        else:
+            group = attendee.group or attendee.group_id and session.query(Group).get(attendee.group_id)
+            return bool(group) and (group.amount_paid or 0) > 0
+
+    @classmethod
+    def contributions(cls, session, attendee, orig=False):
+        """
+        Returns how much this attendee adds to each of our counts, either as
+        they currently are or as they were before any unflushed changes.
+        """
+        value = attendee.orig_value_of if orig else lambda name: getattr(attendee, name)
+        paid = value('paid')
+        individual = paid in [c.HAS_PAID, c.REFUNDED]
+        by_group = paid == c.PAID_BY_GROUP
+        return {
+            'badges_sold': int(individual or by_group and cls._group_paid(session, attendee, orig)),
+            'supporter_count': int((value('amount_extra') or 0) >= c.SUPPORTER_LEVEL
+                                   and (individual or by_group and (value('amount_paid') or 0) >= c.SUPPORTER_LEVEL))
+        }
+
+    @classmethod
+    def changes(cls, session):
+        """
+        Returns how much the pending changes in this session will add to or
+        subtract from each of our counts once they're flushed.
+        """
+        deltas = defaultdict(int)
+        touched = {m for m in chain(session.new, session.dirty, session.deleted) if isinstance(m, Attendee)}
+        for attendee in touched:
+            before = {} if attendee in session.new else cls.contributions(session, attendee, orig=True)
+            after = {} if attendee in session.deleted else cls.contributions(session, attendee)
+            for name in set(before).union(after):
+                deltas[name] += after.get(name, 0) - before.get(name, 0)
+
+        for group in chain(session.dirty, session.deleted):
+            if isinstance(group, Group):
+                was_paid = (group.orig_value_of('amount_paid') or 0) > 0
+                now_paid = group not in session.deleted and (group.amount_paid or 0) > 0
+                if was_paid != now_paid:
+                    affected = len([a for a in group.attendees if a not in touched and a.paid == c.PAID_BY_GROUP])
+                    deltas['badges_sold'] += affected if now_paid else -affected
+
+        return {name: delta for name, delta in deltas.items() if delta}
 
 
 def _make_getter(model):
@@ -1857,40 +3149,419 @@ for _model in Session.all_models():
     setattr(Session.SessionMixin, _model.__tablename__, _make_getter(_model))
 
 
-def _presave_adjustments(session, context, instances='deprecated'):
-    c.BADGE_LOCK.acquire()
-    for model in chain(session.dirty, session.new):
-        model.presave_adjustments()
-    for model in session.deleted:
-        model.predelete_adjustments()
+class AttendeeSearch:
+    """
+    Database indexes for Session.search(), which is run on nearly every
+    keystroke at the registration desk and would otherwise scan the whole
+    attendee table with ILIKE for each search.
+
+    On Postgres we index a tsvector of each attendee's names and email for
+    ranked prefix matching (so "jo smi" finds John Smith), and a pg_trgm
+    trigram index of those plus their notes so that substring matches can
+    still use an index.  SQLite (which we only use for development and
+    testing) gets an FTS5 table kept up to date by triggers, or falls back
+    to plain LIKE queries if it wasn't compiled with FTS5.  Both also get an
+    index on badge_num for badge number lookups.
+
+    These are created by create_indexes() when Session.initialize_db() creates
+    our tables, and since Postgres only uses an expression index when a query
+    uses exactly the same expression, we build both from the same SQL below.
+    """
+    name_columns = ['first_name', 'last_name', 'badge_printed_name', 'email']
+    note_columns = ['comments', 'admin_notes', 'for_review']
+    fts_available = None
 
+    @classmethod
+    def expression(cls, columns, table=''):
+        return "lower({})".format(" || ' ' || ".join("coalesce({}{}, '')".format(table, col) for col in columns))
 
-def _release_badge_lock(session, context):
-    try:
-        c.BADGE_LOCK.release()
-    except:
-        log.error('failed releasing c.BADGE_LOCK after session flush; this should never actually happen, but we want to just keep going if it ever does')
+    @classmethod
+    def dialect(cls):
+        return Session.engine.dialect.name
+
+    @classmethod
+    def create_indexes(cls):
+        with Session.engine.begin() as conn:
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_attendee_badge_num ON attendee (badge_num)')
+            if cls.dialect() == 'postgresql':
+                conn.execute("""CREATE INDEX IF NOT EXISTS ix_attendee_search_vector ON attendee
+                                USING gin (to_tsvector('simple', {}))""".format(cls.expression(cls.name_columns)))
+                try:
+                    with conn.begin_nested():
+                        conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                        conn.execute("""CREATE INDEX IF NOT EXISTS ix_attendee_search_trigram ON attendee
+                                        USING gin ({} gin_trgm_ops)""".format(cls.expression(cls.name_columns + cls.note_columns)))
+                        conn.execute('CREATE INDEX IF NOT EXISTS ix_group_name_trigram ON "group" USING gin (lower(name) gin_trgm_ops)')
+                except:
+                    log.warning('unable to create trigram indexes, substring searches will scan the attendee table', exc_info=True)
+            elif cls.dialect() == 'sqlite':
+                cls.create_fts_table(conn)
+
+    @classmethod
+    def create_fts_table(cls, conn):
+        expression = cls.expression(cls.name_columns, 'new.')
+        try:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'attendee_search'").first()
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS attendee_search USING fts5(id UNINDEXED, names)")
+        except:
+            log.warning('SQLite was not compiled with FTS5, so attendee searches will scan the attendee table')
+            cls.fts_available = False
+            return
+
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS attendee_search_insert AFTER INSERT ON attendee BEGIN
+                            INSERT INTO attendee_search (id, names) VALUES (new.id, {});
+                        END""".format(expression))
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS attendee_search_update AFTER UPDATE ON attendee BEGIN
+                            DELETE FROM attendee_search WHERE id = old.id;
+                            INSERT INTO attendee_search (id, names) VALUES (new.id, {});
+                        END""".format(expression))
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS attendee_search_delete AFTER DELETE ON attendee BEGIN
+                            DELETE FROM attendee_search WHERE id = old.id;
+                        END""")
+        if not exists:
+            conn.execute('INSERT INTO attendee_search (id, names) SELECT id, {} FROM attendee'.format(cls.expression(cls.name_columns)))
+        cls.fts_available = True
+
+    @staticmethod
+    def terms(text):
+        return re.findall(r'[\w@.+-]+', text.lower())
+
+    @classmethod
+    def contains(cls, text):
+        """
+        Returns a filter for attendees with the given text anywhere in their
+        names, email or notes, which the trigram index can answer on Postgres.
+        """
+        pattern = '%' + text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return literal_column(cls.expression(cls.name_columns + cls.note_columns, 'attendee.')).like(pattern, escape='\\')
+
+    @classmethod
+    def matches(cls, text):
+        """
+        Returns a tuple of (filter, rank) for attendees whose names or email
+        start with each word of the given text, where rank is an expression to
+        order the results by, or None if we have no way to rank them.
+        """
+        terms = cls.terms(text)
+        if not terms:
+            return false(), None
+        elif cls.dialect() == 'postgresql':
+            vector = func.to_tsvector('simple', literal_column(cls.expression(cls.name_columns, 'attendee.')))
+            query = func.to_tsquery('simple', ' & '.join("'{}':*".format(term.replace("'", '')) for term in terms))
+            return vector.op('@@')(query), func.ts_rank(vector, query).desc()
+        elif cls.dialect() == 'sqlite' and cls.fts_available:
+            match = ' '.join('"{}"*'.format(term.replace('"', '')) for term in terms)
+            return (text_clause('attendee.id IN (SELECT id FROM attendee_search WHERE attendee_search MATCH :match)').bindparams(match=match),
+                    text_clause('(SELECT rank FROM attendee_search WHERE attendee_search MATCH :rank_match AND attendee_search.id = attendee.id)').bindparams(rank_match=match))
+        else:
+            return and_(*[cls.contains(term) for term in terms]), None
+
+
+class BadgeLocks:
+    """
+    Badge numbers are assigned and shifted around by our presave adjustments,
+    so two flushes which renumber badges of the same type must never run at
+    the same time.  Rather than making every flush wait on one global lock, we
+    only lock the pre-assigned badge types whose numbers a flush might change,
+    which means that most flushes don't lock anything at all.
+
+    By default these are thread locks which are released after each flush.
+    When running more than one process against Postgres, set badge_lock_mode
+    to "advisory" to use transaction-level advisory locks instead, which
+    Postgres releases when the transaction is committed or rolled back.
+    """
+    badge_attrs = ['badge_type', 'badge_num', 'paid', 'ribbon', 'amount_extra', 'staffing', 'first_name']
+
+    # the first key of our two-key advisory locks, so they can't collide with anyone else's locks on the same database
+    advisory_namespace = 0x55424552  # "UBER"
+
+    lock = RLock()
+    locks = {}
+
+    @classmethod
+    def get(cls, badge_type):
+        with cls.lock:
+            return cls.locks.setdefault(badge_type, RLock())
+
+    @classmethod
+    def badge_types(cls, session):
+        """
+        Returns the pre-assigned badge types whose numbering the pending
+        changes in this session might affect, including the types which our
+        presave adjustments might move an attendee into.
+        """
+        types = set()
+        for attendee in chain(session.new, session.dirty, session.deleted):
+            if isinstance(attendee, Attendee):
+                if attendee in session.dirty and not any(get_history(attendee, attr).has_changes() for attr in cls.badge_attrs):
+                    continue
+                types.update([attendee.badge_type, attendee.orig_value_of('badge_type')])
+                if (attendee.amount_extra or 0) >= c.SUPPORTER_LEVEL:
+                    types.add(c.SUPPORTER_BADGE)
+                if attendee.staffing or attendee.ribbon == c.DEPT_HEAD_RIBBON:
+                    types.add(c.STAFF_BADGE)
+        return sorted(badge_type for badge_type in types if badge_type in c.PREASSIGNED_BADGE_TYPES)
+
+    @classmethod
+    def acquire(cls, session, badge_types):
+        held = session.info.setdefault('badge_locks', [])
+        for badge_type in sorted(badge_types):
+            if c.BADGE_LOCK_MODE == 'advisory':
+                session.execute(select([func.pg_advisory_xact_lock(cls.advisory_namespace, badge_type)]))
+            elif badge_type not in held:
+                cls.get(badge_type).acquire()
+                held.append(badge_type)
+
+    @classmethod
+    def release(cls, session):
+        for badge_type in reversed(session.info.pop('badge_locks', [])):
+            try:
+                cls.get(badge_type).release()
+            except:
+                log.error('failed releasing badge lock for badge type {}; this should never actually happen, but we want to just keep going if it ever does', badge_type)
+
+    @classmethod
+    @contextmanager
+    def locked(cls, session, *badge_types):
+        """
+        Holds the locks for the given badge types for the duration of a with
+        block, for code which reads badge numbers and then changes them.
+        """
+        if c.BADGE_LOCK_MODE == 'advisory':
+            cls.acquire(session, badge_types)
+            yield
+        else:
+            locks = [cls.get(badge_type) for badge_type in sorted(badge_types)]
+            for lock in locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
 
 
-def _release_badge_lock_on_error(*args, **kwargs):
+def _presave_adjustments(session, context, instances='deprecated'):
+    BadgeLocks.acquire(session, BadgeLocks.badge_types(session))
     try:
-        c.BADGE_LOCK.release()
+        for model in chain(session.dirty, session.new):
+            model.presave_adjustments()
+        for model in session.deleted:
+            model.predelete_adjustments()
     except:
-        log.warn('failed releasing c.BADGE_LOCK on db error; these errors should not happen in the first place and we do not expect releasing the lock to fail when they do, but we still want to keep going if/when this does occur')
+        BadgeLocks.release(session)
+        raise
+
+
+def _release_badge_locks(session, context):
+    BadgeLocks.release(session)
+
+
+def _release_badge_locks_on_rollback(session, previous_transaction):
+    BadgeLocks.release(session)
+
+
+def _count_badge_changes(session, context, instances='deprecated'):
+    with session.no_autoflush:
+        deltas = BadgeCounts.changes(session)
+    if any(deltas.values()):
+        session.info.setdefault('badge_count_deltas', []).append((session.transaction, deltas))
+
+
+def _apply_badge_count_changes(session):
+    if not _committing_savepoint(session):
+        for transaction, deltas in session.info.pop('badge_count_deltas', []):
+            BadgeCounts.apply(deltas)
+
+
+def _discard_badge_count_changes(session, previous_transaction):
+    _discard_pending(session, 'badge_count_deltas', previous_transaction)
+
+
+def _committing_savepoint(session):
+    """
+    after_commit also fires when a SAVEPOINT is released, while it's still the
+    session's current transaction, so our after_commit listeners use this to
+    wait until the outermost transaction has actually been committed.
+    """
+    return session.transaction is not None and session.transaction.nested
+
+
+def _discard_pending(session, key, previous_transaction):
+    """
+    Drops the (transaction, ...) tuples saved in session.info[key] within a
+    rolled back transaction; for a savepoint that's only the ones saved since
+    it began, otherwise it's all of them.
+    """
+    def within(transaction):
+        while transaction is not None:
+            if transaction is previous_transaction:
+                return True
+            transaction = transaction._parent
+        return False
+
+    if not previous_transaction.nested:
+        session.info.pop(key, None)
+    elif key in session.info:
+        session.info[key] = [pending for pending in session.info[key] if not within(pending[0])]
+
+
+class QueryCounter:
+    """
+    Counts the queries issued against each table while a page is loading, and
+    logs a warning for each table with more than c.N_PLUS_ONE_THRESHOLD of
+    them when it's done.  That many queries for the same table almost always
+    means a relationship is being lazy loaded once per row, which can usually
+    be fixed by loading it up front with Query.load().  Our page decorators
+    use this as a context manager, e.g.
+
+        with QueryCounter('uber.site_sections.hotel.hours'):
+            ...
+    """
+    _local = threading.local()
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.outer = getattr(self._local, 'counts', None)
+        self._local.counts = defaultdict(int) if c.N_PLUS_ONE_THRESHOLD else None
+        return self
+
+    def __exit__(self, *exc_info):
+        self.counts, self._local.counts = self._local.counts or {}, self.outer
+        for table, count in sorted(self.counts.items()):
+            if count > c.N_PLUS_ONE_THRESHOLD:
+                log.warning('{} issued {} queries against the {} table; its relationships should probably be eager loaded with Query.load()', self.name, count, table)
+
+    @staticmethod
+    def table_name(statement):
+        """
+        Returns the name of the table a compiled statement loads or modifies.
+        For SELECTs this is the table of the first column we select rather
+        than the first table in the FROM clause, since the queries emitted by
+        subqueryload select from a subquery of the parent table and join the
+        table actually being loaded onto that.
+        """
+        if isinstance(statement, sqlalchemy.sql.dml.UpdateBase):
+            return statement.table.name
+        for column in getattr(statement, 'inner_columns', []):
+            if isinstance(getattr(column, 'table', None), sqlalchemy.Table):
+                return column.table.name
+        for table in getattr(statement, 'froms', []):
+            if isinstance(table, sqlalchemy.Table):
+                return table.name
+
+    @classmethod
+    def count(cls, conn, cursor, statement, parameters, context, executemany):
+        counts = getattr(cls._local, 'counts', None)
+        if counts is not None:
+            table = cls.table_name(getattr(context.compiled, 'statement', None))
+            if table:
+                counts[table] += 1
+
+
+def note_changed_tables(session, *tablenames):
+    """
+    Records that the given tables were changed within the session's current
+    transaction, so that their cached pages and stats snapshots are refreshed
+    once it's committed.  Our flush listener does this for every model we
+    save; code which bypasses the ORM, e.g. with bulk inserts, calls this.
+    """
+    if tablenames:
+        session.info.setdefault('changed_tables', []).append((session.transaction, set(tablenames)))
+
+
+def _note_changed_tables(session, context):
+    note_changed_tables(session, *{model.__tablename__ for model in chain(session.new, session.dirty, session.deleted)
+                                   if not isinstance(model, StatsSnapshot)})
+
+
+def _apply_changed_tables(session):
+    if not _committing_savepoint(session):
+        tables = set()
+        for transaction, changed in session.info.pop('changed_tables', []):
+            tables.update(changed)
+        if tables:
+            StatsSnapshot.note_changes(tables)
+            page_cache.invalidate(*tables)
+
+
+def _discard_changed_tables(session, previous_transaction):
+    _discard_pending(session, 'changed_tables', previous_transaction)
+
+
+def _update_filled_slots(session, context):
+    job_ids = set()
+    for shift in chain(session.new, session.dirty, session.deleted):
+        if isinstance(shift, Shift):
+            if shift in session.new:
+                job_ids.add(shift.job_id)
+            else:
+                job_ids.update(get_history(shift, 'job_id').sum())  # includes the old job if it was reassigned
+    job_ids.discard(None)
+    if job_ids:
+        # Lock the jobs (in a consistent order, to avoid deadlocks) before the
+        # recount, so that two transactions changing shifts for the same job
+        # take turns and the second one counts the first one's committed shift.
+        job_ids = sorted(job_ids)
+        session.execute(select([Job.id]).where(Job.id.in_(job_ids)).order_by(Job.id).with_for_update())
+        session.execute(Job.filled_slots_update(job_ids))
+        session.info.setdefault('filled_slots_changed', set()).update(job_ids)
+
+
+def _expire_filled_slots(session, context):
+    for job_id in session.info.pop('filled_slots_changed', []):
+        job = session.identity_map.get(sqlalchemy.orm.util.identity_key(Job, job_id))
+        if job is not None:
+            session.expire(job, ['filled_slots'])
+
+
+def _sync_multichoice_values(session, context, instances='deprecated'):
+    MultiChoiceValue.sync(session)
 
 
 def _track_changes(session, context, instances='deprecated'):
-    for action, instances in {c.CREATED: session.new, c.UPDATED: session.dirty, c.DELETED: session.deleted}.items():
-        for instance in instances:
-            if instance.__class__ not in Tracking.UNTRACKED:
-                Tracking.track(action, instance)
+    Tracking.track_flush(session)
+
+
+def _write_tracking_rows(session):
+    if not _committing_savepoint(session):
+        for transaction, rows, links in session.info.pop('tracking_rows', []):
+            tracking_writer.write(rows, links)
+
+
+def _discard_tracking_rows(session, previous_transaction):
+    _discard_pending(session, 'tracking_rows', previous_transaction)
+
+
+def _invalidate_admin_identity(session, context):
+    identity = getattr(cherrypy.request, 'admin_identity', None)
+    if identity:
+        for model in chain(session.new, session.dirty, session.deleted):
+            if isinstance(model, AdminAccount) or isinstance(model, Attendee) and model.id == identity.attendee_id:
+                AdminIdentity.invalidate()
+                break
 
 
 def register_session_listeners():
+    listen(Session.engine, 'before_cursor_execute', QueryCounter.count)
     listen(Session.session_factory, 'before_flush', _presave_adjustments)
+    listen(Session.session_factory, 'before_flush', _count_badge_changes)
     listen(Session.session_factory, 'before_flush', _track_changes)
-    listen(Session.session_factory, 'after_flush', _release_badge_lock)
-    listen(Session.engine, 'dbapi_error', _release_badge_lock_on_error)
+    listen(Session.session_factory, 'before_flush', _sync_multichoice_values)
+    listen(Session.session_factory, 'after_flush', _release_badge_locks)
+    listen(Session.session_factory, 'after_flush', _invalidate_admin_identity)
+    listen(Session.session_factory, 'after_flush', _note_changed_tables)
+    listen(Session.session_factory, 'after_flush', _update_filled_slots)
+    listen(Session.session_factory, 'after_flush_postexec', _expire_filled_slots)
+    listen(Session.session_factory, 'after_commit', _apply_badge_count_changes)
+    listen(Session.session_factory, 'after_commit', _apply_changed_tables)
+    listen(Session.session_factory, 'after_commit', _write_tracking_rows)
+    listen(Session.session_factory, 'after_soft_rollback', _discard_badge_count_changes)
+    listen(Session.session_factory, 'after_soft_rollback', _release_badge_locks_on_rollback)
+    listen(Session.session_factory, 'after_soft_rollback', _discard_changed_tables)
+    listen(Session.session_factory, 'after_soft_rollback', _discard_tracking_rows)
 register_session_listeners()
 
 
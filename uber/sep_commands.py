@@ -34,3 +34,101 @@ def reset_uber_db():
     assert c.DEV_BOX, 'reset_uber_db is only available on development boxes'
     Session.initialize_db(drop=True, modify_tables=True)
     insert_admin()
+
+
+@entry_point
+def link_tracking_history():
+    """
+    Creates the TrackingLink rows for changes which were tracked before we had
+    that table, so that they show up on attendee history pages.
+    """
+    with Session() as session:
+        print('linked {} tracked changes'.format(TrackingLink.backfill(session)))
+
+
+@entry_point
+def benchmark_email_sending():
+    """
+    Sends fake emails through the "file" email backend as fast as our email
+    transport allows, to measure its throughput without a network connection;
+    pass the number of emails to send, e.g. "sep benchmark_email_sending 5000"
+    """
+    count = int(sys.argv[-1]) if sys.argv[-1].isdigit() else 1000
+    transport = EmailTransport(backend=FileBackend(), rate=count)
+    before = monotonic()
+    for i in range(count):
+        transport.send(c.ADMIN_EMAIL, ['benchmark{}@mailinator.com'.format(i)], [], [],
+                       'Benchmark email #{}'.format(i), 'This is only a test.', 'text')
+    transport.flush()
+    elapsed = monotonic() - before
+    print('sent {} emails in {:.2f} seconds ({:.1f} per second)'.format(count, elapsed, count / elapsed))
+
+
+@entry_point
+def benchmark_badge_locking():
+    """
+    Measures how much our badge locks slow down concurrent writes by having
+    several threads repeatedly flush changes and then roll them back, first
+    for changes which don't touch badges at all and then for new pre-assigned
+    badges of a single type and of every type; pass the number of threads,
+    e.g. "sep benchmark_badge_locking 8"
+    """
+    thread_count = int(sys.argv[-1]) if sys.argv[-1].isdigit() else 8
+    flush_count = 25
+
+    def new_badge(badge_type, i):
+        return Attendee(placeholder=True, first_name='Benchmark', last_name=str(i), paid=c.NEED_NOT_PAY, badge_type=badge_type)
+
+    scenarios = OrderedDict([
+        ('unrelated writes', lambda n, i: ApprovedEmail(subject='Benchmark {} {}'.format(n, i))),
+        ('badges of one type', lambda n, i: new_badge(c.PREASSIGNED_BADGE_TYPES[0], i)),
+        ('badges of every type', lambda n, i: new_badge(c.PREASSIGNED_BADGE_TYPES[n % len(c.PREASSIGNED_BADGE_TYPES)], i))
+    ])
+
+    def flush_repeatedly(n, make_model):
+        for i in range(flush_count):
+            with Session() as session:
+                session.add(make_model(n, i))
+                session.flush()
+                session.rollback()
+
+    for name, make_model in scenarios.items():
+        threads = [Thread(target=flush_repeatedly, args=[n, make_model]) for n in range(thread_count)]
+        before = monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = monotonic() - before
+        flushes = thread_count * flush_count
+        print('{}: {} flushes in {:.2f} seconds ({:.1f} per second)'.format(name, flushes, elapsed, flushes / elapsed))
+
+
+@entry_point
+def benchmark_templates():
+    """
+    Renders our heaviest admin pages with the data from their page handlers,
+    first by looking up and compiling each template every time like we used
+    to and then with our template cache; pass the number of times to render
+    each page, e.g. "sep benchmark_templates 50"
+    """
+    from uber.site_sections import registration, summary, jobs
+    count = int(sys.argv[-1]) if sys.argv[-1].isdigit() else 20
+    cherrypy.session = {}
+    with Session() as session:
+        pages = OrderedDict([
+            ('registration/index.html', get_innermost(registration.Root.index)(registration.Root(), session, page='1')),
+            ('summary/index.html', summary.registration_stats(session)),
+            ('jobs/signups.html', get_innermost(jobs.Root.signups)(jobs.Root(), session))
+        ])
+        for name, data in pages.items():
+            before = monotonic()
+            for i in range(count):
+                loader.select_template([name]).render(Context(renderable_data(dict(data))))
+            uncached = monotonic() - before
+
+            before = monotonic()
+            for i in range(count):
+                template_cache.get(name).render(template_cache.context(dict(data)))
+            cached = monotonic() - before
+            print('{}: {:.1f}ms per render uncached, {:.1f}ms cached'.format(name, 1000 * uncached / count, 1000 * cached / count))
@@ -78,6 +78,10 @@ DaemonTask(check_unassigned, interval=300)
 DaemonTask(detect_duplicates, interval=300)
 DaemonTask(check_placeholders, interval=300)
 DaemonTask(AutomatedEmail.send_all, interval=300)
+DaemonTask(OutgoingEmail.send_pending, interval=5)
+DaemonTask(BadgeCounts.reconcile, interval=c.BADGE_COUNT_REFRESH)
+DaemonTask(StatsSnapshot.refresh, interval=c.STATS_SNAPSHOT_INTERVAL)
+DaemonTask(email_transport.refresh_quota, interval=3600)
 
 # TODO: this should be replaced by something a little cleaner, but it can be a useful debugging tool
 # DaemonTask(lambda: log.error(Session.engine.pool.status()), interval=5)
@@ -0,0 +1,191 @@
+from uber.common import *
+
+
+class Staffer:
+    """
+    What the scheduler needs to know about a volunteer, copied out of their
+    Attendee so that checking whether they can work a job is just a few
+    attribute lookups and bitwise operations.  As shifts are proposed we
+    update their hour mask, the jobs they're working each hour (for the
+    extra15 rules) and their weighted hours.
+    """
+    def __init__(self, attendee):
+        self.id, self.name = attendee.id, attendee.full_name
+        self.trusted = attendee.trusted
+        self.setup, self.teardown = attendee.approved_for_setup, attendee.approved_for_teardown
+        self.mask = attendee.hour_mask
+        self.jobs_by_hour = dict(attendee.hour_index_map)
+        self.hours = attendee.weighted_hours
+        self.target = c.HOTEL_REQUIRED_HOURS if attendee.hotel_shifts_required else 0
+
+    def can_work(self, job):
+        """
+        The same checks as Session.assign() and Attendee.possible, i.e.
+        restricted jobs need trusted staffers, setup and teardown jobs need
+        approved hotel nights, and the job can't overlap their other shifts
+        or be next to an extra15 shift in another department.
+        """
+        if job.restricted and not self.trusted \
+                or job.type == c.SETUP and not self.setup \
+                or job.type == c.TEARDOWN and not self.teardown \
+                or job.hour_mask & self.mask:
+            return False
+        before = self.jobs_by_hour.get(job.first_hour - 1)
+        after = self.jobs_by_hour.get(job.first_hour + job.duration)
+        return (not before or not before.extra15 or job.location == before.location) \
+           and (not after or not job.extra15 or job.location == after.location)
+
+    def priority(self):
+        # staffers furthest from their hotel hours come first, then whoever has the fewest hours
+        return (-max(0, self.target - self.hours), self.hours, self.name)
+
+    def add(self, job):
+        self.mask |= job.hour_mask
+        for i in range(job.duration):
+            self.jobs_by_hour[job.first_hour + i] = job
+        self.hours += job.weighted_hours
+
+    def remove(self, job):
+        self.mask &= ~job.hour_mask
+        for i in range(job.duration):
+            self.jobs_by_hour.pop(job.first_hour + i, None)
+        self.hours -= job.weighted_hours
+
+
+class ShiftScheduler:
+    """
+    Proposes shift assignments to fill the open slots of a department's jobs
+    with the volunteers assigned to that department, rather than having dept
+    heads assign them one at a time.  Nothing is saved until the plan is
+    applied, so admins can look it over first.
+
+    We fill the hardest jobs first (restricted, then setup and teardown, then
+    everything else in order of how few staffers can work them), giving each
+    open slot to the eligible staffers who most need the hours; anyone under
+    the hours they need for their hotel room comes first, followed by whoever
+    has the fewest hours.  Nobody is given shifts beyond max_hours.  After
+    that greedy pass we try to repair each slot we couldn't fill by moving
+    one proposed shift which blocks a staffer to someone else who can work it.
+
+    Every check is done against in-memory hour bitmasks, so scheduling a
+    whole event only takes one query for the jobs and one for the staffers.
+    """
+    def __init__(self, session, location, max_hours=None):
+        self.session, self.location = session, int(location)
+        self.max_hours = max_hours
+        self.jobs = session.query(Job).filter_by(location=self.location) \
+                           .options(subqueryload(Job.shifts)).order_by(Job.start_time).all()
+        self.staffers = [Staffer(a) for a in session.query(Attendee)
+                                                    .filter_by(staffing=True)
+                                                    .has_choice(assigned_depts=self.location)
+                                                    .options(subqueryload(Attendee.shifts).joinedload(Shift.job),
+                                                             joinedload(Attendee.hotel_requests))]
+        self.assignments = []  # (job, staffer) tuples
+        self.unfilled = {}     # job id -> number of slots we couldn't fill
+
+    def under_limit(self, staffer, job):
+        return self.max_hours is None or staffer.hours + job.weighted_hours <= self.max_hours
+
+    def candidates(self, job):
+        return [s for s in self.staffers if s.can_work(job) and self.under_limit(s, job)]
+
+    def run(self):
+        open_jobs = [job for job in self.jobs if job.slots > len(job.shifts)]
+        eligible = {job.id: self.candidates(job) for job in open_jobs}
+        open_jobs.sort(key=lambda job: (not job.restricted, job.type == c.REGULAR, len(eligible[job.id]), job.start_time))
+
+        for job in open_jobs:
+            # proposing shifts only ever makes staffers ineligible, so we only need to recheck the original candidates
+            slots = job.slots - len(job.shifts)
+            candidates = [s for s in eligible[job.id] if s.can_work(job) and self.under_limit(s, job)]
+            for staffer in heapq.nsmallest(slots, candidates, key=Staffer.priority):
+                self.assign(job, staffer)
+                slots -= 1
+            if slots:
+                self.unfilled[job.id] = slots
+
+        for job in [job for job in open_jobs if job.id in self.unfilled]:
+            while self.unfilled.get(job.id) and self.repair(job):
+                self.unfilled[job.id] -= 1
+            if not self.unfilled.get(job.id):
+                self.unfilled.pop(job.id, None)
+        return self
+
+    def assign(self, job, staffer):
+        staffer.add(job)
+        self.assignments.append((job, staffer))
+
+    def repair(self, job):
+        """
+        Tries to free up a staffer for one open slot of the given job by moving
+        a single proposed shift which overlaps it to another staffer, returning
+        whether we were able to fill the slot.
+        """
+        working = {staffer.id for j, staffer in self.assignments if j is job} | {shift.attendee_id for shift in job.shifts}
+        for i, (other_job, staffer) in enumerate(self.assignments):
+            if other_job is job or staffer.id in working or not other_job.hour_mask & job.hour_mask:
+                continue
+
+            staffer.remove(other_job)
+            if staffer.can_work(job) and self.under_limit(staffer, job):
+                replacements = [s for s in self.candidates(other_job) if s is not staffer]
+                if replacements:
+                    replacement = min(replacements, key=Staffer.priority)
+                    replacement.add(other_job)
+                    self.assignments[i] = (other_job, replacement)
+                    self.assign(job, staffer)
+                    return True
+            staffer.add(other_job)
+        return False
+
+    @property
+    def unfilled_jobs(self):
+        return [(job, self.unfilled[job.id]) for job in self.jobs if job.id in self.unfilled]
+
+    def plan(self):
+        """
+        Returns the proposed assignments as a list of (job id, attendee id)
+        tuples, which is what we save in the admin's session to apply later.
+        """
+        return [(job.id, staffer.id) for job, staffer in self.assignments]
+
+    def preview(self):
+        return sorted([{
+            'job': job,
+            'staffer_id': staffer.id,
+            'staffer_name': staffer.name,
+            'hours': staffer.hours
+        } for job, staffer in self.assignments], key=lambda d: (d['job'].start_time, d['job'].name, d['staffer_name']))
+
+    @staticmethod
+    def apply(session, plan):
+        """
+        Saves the given (job id, attendee id) plan in the caller's transaction,
+        skipping any assignment which is no longer possible, e.g. because the
+        job has since been filled or the staffer has since taken another shift
+        or lost the trust or hotel approval the job needs.  Returns a tuple of the
+        number of shifts created and a list of error messages for the ones we
+        skipped.
+        """
+        job_ids, attendee_ids = {job_id for job_id, attendee_id in plan}, {attendee_id for job_id, attendee_id in plan}
+        jobs = {job.id: job for job in session.query(Job).filter(Job.id.in_(job_ids)).options(subqueryload(Job.shifts))} if job_ids else {}
+        attendees = {a.id: a for a in session.query(Attendee).filter(Attendee.id.in_(attendee_ids))
+                                             .options(subqueryload(Attendee.shifts).joinedload(Shift.job),
+                                                      joinedload(Attendee.hotel_requests))} if attendee_ids else {}
+        created, errors = 0, []
+        for job_id, attendee_id in plan:
+            job, attendee = jobs.get(job_id), attendees.get(attendee_id)
+            if not job or not attendee:
+                errors.append('A job or volunteer in this plan has since been deleted')
+            elif job.slots <= len(job.shifts):
+                errors.append('All slots for {} have since been filled'.format(job.name))
+            elif job.location not in attendee.assigned_depts_ints:
+                errors.append('{} is no longer assigned to {}'.format(attendee.full_name, job.location_label))
+            elif not job.no_overlap(attendee):
+                errors.append('{} has since signed up for another shift during {}'.format(attendee.full_name, job.name))
+            elif not Staffer(attendee).can_work(job):
+                errors.append('{} is no longer allowed to work {}'.format(attendee.full_name, job.name))
+            else:
+                session.add(Shift(attendee=attendee, job=job))
+                created += 1
+        return created, errors
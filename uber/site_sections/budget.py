@@ -23,24 +23,28 @@ def sale_money(session):
     return dict(sales)  # converted to a dict so we can say sales.items in our template
 
 
+@StatsSnapshot.register(Attendee, Group, Sale)
+def budget_totals(session):
+    sales   = sale_money(session)
+    preregs = prereg_money(session)
+    total = sum(preregs.values()) + sum(sales.values())
+    return {
+        'total':   total,
+        'preregs': preregs,
+        'sales':   sales
+    }
+
+
 @all_renderable(c.MONEY)
 class Root:
     @log_pageview
-    def index(self, session):
-        sales   = sale_money(session)
-        preregs = prereg_money(session)
-        total = sum(preregs.values()) + sum(sales.values())
-        return {
-            'total':   total,
-            'preregs': preregs,
-            'sales':   sales
-        }
-
-    # TODO: add joinedload options here for efficiency
+    def index(self, session, live=False):
+        return StatsSnapshot.get(session, budget_totals, boolean_param(live))
+
     @log_pageview
     def mpoints(self, session):
         groups = defaultdict(list)
-        for mpu in session.query(MPointsForCash).all():
+        for mpu in session.query(MPointsForCash).load('attendee.group').all():
             groups[mpu.attendee and mpu.attendee.group].append(mpu)
         all = [(sum(mpu.amount for mpu in mpus), group, mpus)
                for group, mpus in groups.items()]
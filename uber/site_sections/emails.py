@@ -3,12 +3,11 @@ from uber.common import *
 
 @all_renderable(c.PEOPLE)
 class Root:
-    def index(self, session, page='1'):
-        emails = session.query(Email).order_by(Email.when.desc())
+    def index(self, session, cursor=''):
+        emails = session.query(Email)
         return {
-            'page': page,
-            'emails': get_page(page, emails),
-            'count': emails.count()
+            'emails': emails.keyset('-when', cursor),
+            'count': emails.estimated_count()
         }
 
     def sent(self, session, **params):
@@ -25,9 +24,7 @@ class Root:
         count = 0
         examples = []
         email = AutomatedEmail.instances[subject]
-        attendees, groups = session.everyone()
-        models = {Attendee: attendees, Group: groups, 'SeasonPass': session.season_passes()}
-        for x in models[email.model]:
+        for x in email.candidates(session):
             if email.filter(x):
                 count += 1
                 url = {
@@ -16,16 +16,14 @@ class Root:
             'checklist': session.checklist_status('hotel_eligible', department),
             'attendees': session.query(Attendee)
                                 .filter_by(badge_type=c.STAFF_BADGE)
-                                .filter(Attendee.assigned_depts.contains(str(department)))
+                                .has_choice(assigned_depts=department)
                                 .order_by(Attendee.full_name).all()
         }
 
     def requests(self, session, department=None):
-        dept_filter = []
-        requests = session.query(HotelRequests).join(HotelRequests.attendee).options(joinedload(HotelRequests.attendee)).order_by(Attendee.full_name).all()
-        if department:
-            dept_filter = [Attendee.assigned_depts.contains(department)]
-            requests = [r for r in requests if r.attendee.assigned_to(department)]
+        dept_filter = [MultiChoiceValue.selected(Attendee.assigned_depts, department)] if department else []
+        requests = session.query(HotelRequests).join(HotelRequests.attendee).options(joinedload(HotelRequests.attendee)) \
+                          .filter(*dept_filter).order_by(Attendee.full_name).all()
 
         return {
             'requests': requests,
@@ -37,12 +35,12 @@ class Root:
         }
 
     def hours(self, session):
-        staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by(Attendee.full_name).all()
-        staffers = [s for s in staffers if s.hotel_shifts_required and s.weighted_hours < 30]
+        staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).load('hotel_requests', 'shifts.job').order_by(Attendee.full_name).all()
+        staffers = [s for s in staffers if s.hotel_shifts_required and s.weighted_hours < c.HOTEL_REQUIRED_HOURS]
         return {'staffers': staffers}
 
     def no_shows(self, session):
-        staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by(Attendee.full_name).all()
+        staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).load('hotel_requests').order_by(Attendee.full_name).all()
         staffers = [s for s in staffers if s.hotel_nights and not s.checked_in]
         return {'staffers': staffers}
 
@@ -59,9 +57,9 @@ class Root:
         return {'nights': hr.nights_display}
 
     @csv_file
-    def ordered(self, out, session):
-        reqs = [hr for hr in session.query(HotelRequests).options(joinedload(HotelRequests.attendee)).all() if hr.nights]
-        assigned = {ra.attendee for ra in session.query(RoomAssignment).options(joinedload(RoomAssignment.attendee), joinedload(RoomAssignment.room)).all()}
+    def ordered(self, session):
+        reqs = [hr for hr in session.query(HotelRequests).load('attendee.hotel_requests').all() if hr.nights]
+        assigned = {ra.attendee for ra in session.query(RoomAssignment).load('attendee', 'room').all()}
         unassigned = {hr.attendee for hr in reqs if hr.attendee not in assigned}
 
         names = {}
@@ -83,25 +81,24 @@ class Root:
                     except:
                         pass
 
-        writerow = lambda a, hr: out.writerow([
+        row = lambda a, hr: [
             a.full_name, a.email, a.cellphone,
             a.hotel_requests.nights_display, ' / '.join(a.assigned_depts_labels),
             hr.wanted_roommates, hr.unwanted_roommates, hr.special_needs
-        ])
+        ]
         grouped = {frozenset(group) for group in lookup.values()}
-        out.writerow(['Name', 'Email', 'Phone', 'Nights', 'Departments', 'Roomate Requests', 'Roomate Anti-Requests', 'Special Needs'])
-        # TODO: for better efficiency, a multi-level joinedload would be preferable here
-        for room in session.query(Room).options(joinedload(Room.room_assignments)).order_by(Room.department).all():
+        yield ['Name', 'Email', 'Phone', 'Nights', 'Departments', 'Roomate Requests', 'Roomate Anti-Requests', 'Special Needs']
+        for room in session.query(Room).load('room_assignments.attendee.hotel_requests').order_by(Room.department).all():
             for i in range(3):
-                out.writerow([])
-            out.writerow([room.department_label + ' room created by department heads for ' + room.nights_display + (' ({})'.format(room.notes) if room.notes else '')])
+                yield []
+            yield [room.department_label + ' room created by department heads for ' + room.nights_display + (' ({})'.format(room.notes) if room.notes else '')]
             for ra in room.room_assignments:
-                writerow(ra.attendee, ra.attendee.hotel_requests)
+                yield row(ra.attendee, ra.attendee.hotel_requests)
         for group in sorted(grouped, key=len, reverse=True):
             for i in range(3):
-                out.writerow([])
+                yield []
             for a in group:
-                writerow(a, a.hotel_requests)
+                yield row(a, a.hotel_requests)
 
     def assignments(self, session, department):
         if cannot_modify_rooms():
@@ -228,7 +225,7 @@ def _get_declined(session, department):
                                               .join(Attendee.hotel_requests)
                                               .filter(Attendee.hotel_requests != None,
                                                       HotelRequests.nights == '',
-                                                      Attendee.assigned_depts.contains(str(department))).all()]
+                                                      MultiChoiceValue.selected(Attendee.assigned_depts, department)).all()]
 
 
 def _get_unconfirmed(session, department, assigned_ids):
@@ -236,13 +233,13 @@ def _get_unconfirmed(session, department, assigned_ids):
                                               .order_by(Attendee.full_name)
                                               .filter(Attendee.badge_type == c.STAFF_BADGE,
                                                       Attendee.hotel_requests == None,
-                                                      Attendee.assigned_depts.contains(str(department))).all()
+                                                      MultiChoiceValue.selected(Attendee.assigned_depts, department)).all()
                               if a not in assigned_ids]
 
 
 def _get_unassigned(session, department, assigned_ids):
     has_override_access = c.STAFF_ROOMS in AdminAccount.access_set()
-    assigned_to_dept = [] if has_override_access else [Attendee.assigned_depts.like('%{}%'.format(department))]
+    assigned_to_dept = [] if has_override_access else [MultiChoiceValue.selected(Attendee.assigned_depts, department)]
     return [_attendee_dict(a) for a in session.query(Attendee)
                                               .order_by(Attendee.full_name)
                                               .join(Attendee.hotel_requests)
@@ -258,7 +255,7 @@ def _get_assigned_elsewhere(session, department):
                              .options(joinedload(RoomAssignment.attendee), joinedload(RoomAssignment.room))
                              .join(RoomAssignment.room, RoomAssignment.attendee)
                              .filter(Room.department != department,
-                                     Attendee.assigned_depts.like('%{}%'.format(department))).all()]
+                                     MultiChoiceValue.selected(Attendee.assigned_depts, department)).all()]
 
 
 def _hotel_dump(session, department):
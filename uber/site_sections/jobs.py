@@ -116,24 +116,26 @@ class Root:
     def staffers(self, session, location=None, message=''):
         attendee = session.admin_attendee()
         location = int(location or c.JOB_LOCATION_OPTS[0][0])
-        jobs, shifts, attendees = session.everything(location)
-        attendees = [a for a in attendees if a.assigned_to(location)]
-        hours_here = defaultdict(int)
-        for shift in shifts:
-            hours_here[shift.attendee] += shift.job.weighted_hours
+        rollup = StaffingRollup(session)
+        attendees = session.query(Attendee) \
+                           .filter_by(staffing=True) \
+                           .has_choice(assigned_depts=location) \
+                           .options(subqueryload(Attendee.shifts).joinedload(Shift.job), joinedload(Attendee.hotel_requests)) \
+                           .order_by(Attendee.full_name).all()
+        hours_here = rollup.hours_by_staffer(location)
         for attendee in attendees:
-            attendee.hours_here = hours_here[attendee]
+            attendee.hours_here = hours_here[attendee.id]
         return {
             'location':           location,
             'attendees':          attendees,
             'checklist':          session.checklist_status('assigned_volunteers', location),
             'emails':             ','.join(a.email for a in attendees),
-            'regular_total':      sum(j.total_hours for j in jobs if not j.restricted),
-            'restricted_total':   sum(j.total_hours for j in jobs if j.restricted),
-            'all_total':          sum(j.total_hours for j in jobs),
-            'regular_signups':    sum(s.job.weighted_hours for s in shifts if not s.job.restricted),
-            'restricted_signups': sum(s.job.weighted_hours for s in shifts if s.job.restricted),
-            'all_signups':        sum(s.job.weighted_hours for s in shifts)
+            'regular_total':      rollup.offered_hours(location, restricted=False),
+            'restricted_total':   rollup.offered_hours(location, restricted=True),
+            'all_total':          rollup.offered_hours(location),
+            'regular_signups':    rollup.taken_hours(location, restricted=False),
+            'restricted_signups': rollup.taken_hours(location, restricted=True),
+            'all_signups':        rollup.taken_hours(location)
         }
 
     def form(self, session, message='', **params):
@@ -229,18 +231,16 @@ class Root:
         return {}
 
     def summary(self, session):
-        all_jobs, all_shifts, attendees = session.everything()
+        rollup = StaffingRollup(session)
         locations = {}
         for loc, name in c.JOB_LOCATION_OPTS:
-            jobs = [j for j in all_jobs if j.location == loc]
-            shifts = [s for s in all_shifts if s.job.location == loc]
             locations[name] = {
-                'regular_total':      sum(j.total_hours for j in jobs if not j.restricted),
-                'restricted_total':   sum(j.total_hours for j in jobs if j.restricted),
-                'all_total':          sum(j.total_hours for j in jobs),
-                'regular_signups':    sum(s.job.weighted_hours for s in shifts if not s.job.restricted),
-                'restricted_signups': sum(s.job.weighted_hours for s in shifts if s.job.restricted),
-                'all_signups':        sum(s.job.weighted_hours for s in shifts)
+                'regular_total':      rollup.offered_hours(loc, restricted=False),
+                'restricted_total':   rollup.offered_hours(loc, restricted=True),
+                'all_total':          rollup.offered_hours(loc),
+                'regular_signups':    rollup.taken_hours(loc, restricted=False),
+                'restricted_signups': rollup.taken_hours(loc, restricted=True),
+                'all_signups':        rollup.taken_hours(loc)
             }
         totals = [('All Departments Combined', {
             attr: sum(loc[attr] for loc in locations.values())
@@ -264,8 +264,36 @@ class Root:
             'not_already_here': [
                 (a.id, a.full_name)
                 for a in session.query(Attendee)
-                                .filter(Attendee.email != '',
-                                         ~Attendee.assigned_depts.contains(str(location)))
+                                .filter(Attendee.email != '')
+                                .lacks_choice(assigned_depts=location)
                                 .order_by(Attendee.full_name).all()
             ]
         }
+
+    def auto_schedule(self, session, location=None, max_hours='', message=''):
+        location = int(location or c.JOB_LOCATION_OPTS[0][0])
+        if max_hours and not max_hours.isdigit():
+            raise HTTPRedirect('auto_schedule?location={}&message={}', location, 'The maximum hours must be a whole number')
+
+        scheduler = ShiftScheduler(session, location, max_hours=int(max_hours) if max_hours else None).run()
+        cherrypy.session['shift_plan'] = {'location': location, 'plan': scheduler.plan()}
+        return {
+            'message':   message,
+            'location':  location,
+            'max_hours': max_hours,
+            'proposed':  scheduler.preview(),
+            'unfilled':  scheduler.unfilled_jobs
+        }
+
+    @csrf_protected
+    def apply_schedule(self, session, location):
+        saved = cherrypy.session.pop('shift_plan', None)
+        if not saved or saved['location'] != int(location):
+            raise HTTPRedirect('auto_schedule?location={}&message={}', location, 'Please review the proposed shifts before applying them')
+
+        created, errors = ShiftScheduler.apply(session, saved['plan'])
+        session.commit()
+        message = '{} shifts assigned'.format(created)
+        if errors:
+            message += ' ({} skipped: {})'.format(len(errors), '; '.join(errors[:5]))
+        raise HTTPRedirect('signups?location={}&message={}', location, message)
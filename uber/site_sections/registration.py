@@ -32,7 +32,7 @@ def check_atd(func):
 
 @all_renderable(c.PEOPLE, c.REG_AT_CON)
 class Root:
-    def index(self, session, message='', page='0', search_text='', uploaded_id='', order='last_first'):
+    def index(self, session, message='', page='0', search_text='', uploaded_id='', order='last_first', cursor=''):
         total_count = session.query(Attendee).count()
         count = 0
         if search_text:
@@ -42,8 +42,6 @@ class Root:
             attendees = session.query(Attendee).options(joinedload(Attendee.group))
             count = total_count
 
-        attendees = attendees.order(order)
-
         groups = []
         for group in session.query(Group) \
                             .options(joinedload(Group.leader)) \
@@ -54,7 +52,7 @@ class Root:
                                        .subquery())).all():
             groups.append((group.id, group.name + (' ({})'.format(group.leader.full_name) if group.leader else '')))
 
-        page = int(page)
+        page = int(page) or (1 if cursor else 0)
         if search_text:
             page = page or 1
             if search_text and count == total_count:
@@ -62,13 +60,22 @@ class Root:
             elif search_text and count == 1 and (not c.AT_THE_CON or search_text.isdigit()):
                 raise HTTPRedirect('form?id={}&message={}', attendees.one().id, 'This attendee was the only search result')
 
-        pages = range(1, int(math.ceil(count / 100)) + 1)
-        attendees = attendees[-100 + 100*page: 100*page] if page else []
+        # search results are sorted by relevance first, so we page through them by number, but
+        # the full list of attendees is paged by the sort key of the last attendee on the page
+        keyset = count == total_count
+        pages = [] if keyset else range(1, int(math.ceil(count / 100)) + 1)
+        if not page:
+            attendees = []
+        elif keyset:
+            attendees = attendees.keyset(order, cursor)
+        else:
+            attendees = attendees.order(order)[-100 + 100*page: 100*page]
 
         return {
             'message':        message if isinstance(message, str) else message[-1],
             'page':           page,
             'pages':          pages,
+            'keyset':         keyset,
             'search_text':    search_text,
             'search_results': bool(search_text),
             'attendees':      attendees,
@@ -139,10 +146,7 @@ class Root:
                                .filter(or_(Email.dest == attendee.email,
                                            and_(Email.model == 'Attendee', Email.fk_id == id)))
                                .order_by(Email.when).all(),
-            'changes':  session.query(Tracking)
-                               .filter(or_(Tracking.links.like('%attendee({})%'.format(id)),
-                                           and_(Tracking.model == 'Attendee', Tracking.fk_id == id)))
-                               .order_by(Tracking.when).all()
+            'changes':  Tracking.related(session, id).order_by(Tracking.when).all()
         }
 
     @csrf_protected
@@ -708,37 +712,36 @@ class Root:
         session.delete(shift)
         raise HTTPRedirect('shifts?id={}&message={}', shift.attendee.id, 'Staffer unassigned from shift')
 
-    def feed(self, session, page='1', who='', what='', action=''):
-        feed = session.query(Tracking).filter(Tracking.action != c.AUTO_BADGE_SHIFT).order_by(Tracking.when.desc())
+    def feed(self, session, cursor='', who='', what='', action=''):
+        feed = session.query(Tracking).filter(Tracking.action != c.AUTO_BADGE_SHIFT)
         if who:
             feed = feed.filter_by(who=who)
         if what:
-            like = '%' + what + '%'  # SQLAlchemy should have an icontains for this
-            feed = feed.filter(or_(Tracking.data.ilike(like), Tracking.which.ilike(like)))
+            feed = feed.filter(Tracking.search_filter(what))
         if action:
             feed = feed.filter_by(action=action)
         return {
             'who': who,
             'what': what,
-            'page': page,
             'action': action,
-            'count': feed.count(),
-            'feed': get_page(page, feed),
+            'count': feed.estimated_count(),
+            'feed': feed.keyset('-when', cursor),
             'action_opts': [opt for opt in c.TRACKING_OPTS if opt[0] != c.AUTO_BADGE_SHIFT],
-            'who_opts': [who for [who] in session.query(Tracking).distinct().order_by(Tracking.who).values(Tracking.who)]
+            'who_opts': session.query(Tracking).distinct_values(Tracking.who)
         }
 
     def staffers(self, session, message='', order='first_name', search_text=''):
-        jobs, shifts, staffers = session.everything()
-        if search_text:
-            staffers = session.search(search_text, Attendee.staffing == True).options(joinedload(Attendee.shifts)).all()
+        rollup = StaffingRollup(session)
+        staffers = session.search(search_text, Attendee.staffing == True) if search_text \
+              else session.query(Attendee).filter_by(staffing=True)
+        staffers = staffers.options(subqueryload(Attendee.shifts).joinedload(Shift.job)).all()
         return {
             'order': Order(order),
             'message': message,
             'search_text': search_text,
             'staffer_count': len(staffers),
-            'total_hours': sum(j.weighted_hours * j.slots for j in jobs),
-            'taken_hours': sum(s.job.weighted_hours for s in shifts),
+            'total_hours': rollup.offered_hours(),
+            'taken_hours': rollup.taken_hours(),
             'staffers': sorted(staffers, reverse=order.startswith('-'), key=lambda s: getattr(s, order.lstrip('-')))
         }
 
@@ -749,8 +752,10 @@ class Root:
 
     def season_pass_tickets(self, session):
         events = defaultdict(list)
-        for spt in session.query(SeasonPassTicket).all():
-            events[spt.slug].append(spt.fk)
+        tickets = session.query(SeasonPassTicket).all()
+        passes = session.season_passes_by_id(spt.fk_id for spt in tickets)
+        for spt in tickets:
+            events[spt.slug].append(passes[spt.fk_id])
         for attending in events.values():
             attending.sort(key=lambda a: (a.first_name, a.last_name))
         return {'events': dict(events)}
@@ -774,76 +779,31 @@ class Root:
 
         return {'message': message}
 
-    def attendee_upload(self, session, message='', attendee_import=None, date_format="%Y-%m-%d"):
-        attendees = None
+    def attendee_upload(self, session, message='', attendee_import=None, date_format="%Y-%m-%d", bulk=''):
+        attendees, errors = None, []
 
         if attendee_import:
-            cols = {col.name: getattr(Attendee, col.name) for col in Attendee.__table__.columns}
-            result = csv.DictReader(attendee_import.file.read().decode('utf-8').split('\n'))
-            id_list = []
-
-            for row in result:
-                if 'id' in row:
-                    id = row.pop('id')  # id needs special treatment
-
-                try:
-                    # get the Attendee if it already exists
-                    attendee = session.attendee(id)
-                except:
-                    session.rollback()
-                    # otherwise, make a new one and add it to the session for when we commit
-                    attendee = Attendee()
-                    session.add(attendee)
-
-                for colname, val in row.items():
-                    col = cols[colname]
-                    if not val:
-                        # in a lot of cases we'll just have the empty string, so we'll just
-                        # do nothing for those cases
-                        continue
-                    if isinstance(col.type, Choice):
-                        # the export has labels, and we want to convert those back into their
-                        # integer values, so let's look that up (note: we could theoretically
-                        # modify the Choice class to do this automatically in the future)
-                        label_lookup = {val: key for key, val in col.type.choices.items()}
-                        val = label_lookup[val]
-                    elif isinstance(col.type, MultiChoice):
-                        # the export has labels separated by ' / ' and we want to convert that
-                        # back into a comma-separate list of integers
-                        label_lookup = {val: key for key, val in col.type.choices}
-                        vals = [label_lookup[label] for label in val.split(' / ')]
-                        val = ','.join(map(str, vals))
-                    elif isinstance(col.type, UTCDateTime):
-                        # we'll need to make sure we use whatever format string we used to
-                        # export this date in the first place
-                        try:
-                            val = UTC.localize(datetime.strptime(val, date_format + ' %H:%M:%S'))
-                        except:
-                            val = UTC.localize(datetime.strptime(val, date_format))
-                    elif isinstance(col.type, Date):
-                        val = datetime.strptime(val, date_format).date()
-                    elif isinstance(col.type, Integer):
-                        val = int(val)
-
-                    # now that we've converted val to whatever it actually needs to be, we
-                    # can just set it on the attendee
-                    setattr(attendee, colname, val)
-
-                try:
-                    session.commit()
-                except:
-                    log.error('ImportError', exc_info=True)
-                    session.rollback()
-                    message = 'Import unsuccessful'
-
-                id_list.append(attendee.id)
-
-            if id_list:
-                attendees = session.query(Attendee).filter(Attendee.id.in_(id_list)).all()
+            importer = AttendeeImport(session, date_format, bulk=bool(bulk))
+            try:
+                importer.run(attendee_import.file)
+            except Exception as e:
+                log.error('ImportError', exc_info=True)
+                session.rollback()
+                message = 'Import unsuccessful: {}'.format(e)
+            else:
+                message = '{} attendees imported ({} new, {} updated) in {:.1f} seconds ({:.0f} rows per second)'.format(
+                    importer.created + importer.updated, importer.created, importer.updated, importer.elapsed, importer.rows_per_second)
+                if importer.errors:
+                    message += '; {} rows could not be imported'.format(len(importer.errors))
+                errors = importer.errors
+                if importer.ids:
+                    attendees = session.query(Attendee).options(joinedload(Attendee.group)) \
+                                       .filter(Attendee.id.in_(importer.ids)).all()
 
         return {
             'message': message,
-             'attendees': attendees
+            'errors': errors,
+            'attendees': attendees
         }
 
     def placeholders(self, session, department=''):
@@ -851,9 +811,9 @@ class Root:
             'department': department,
             'dept_name': c.JOB_LOCATIONS[int(department)] if department else 'All',
             'checklist': session.checklist_status('placeholders', department),
-            'placeholders': [a for a in session.query(Attendee)
-                                               .filter(Attendee.placeholder == True,
-                                                       Attendee.staffing == True,
-                                                       Attendee.assigned_depts.contains(department))
-                                               .order_by(Attendee.full_name).all()]
+            'placeholders': session.query(Attendee)
+                                   .filter(Attendee.placeholder == True,
+                                           Attendee.staffing == True,
+                                           *([MultiChoiceValue.selected(Attendee.assigned_depts, department)] if department else []))
+                                   .order_by(Attendee.full_name).all()
         }
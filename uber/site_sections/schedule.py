@@ -4,7 +4,7 @@ from uber.common import *
 @all_renderable(c.STUFF)
 class Root:
     @unrestricted
-    @cached
+    @cached(Event)
     def index(self, session, message=''):
         if c.HIDE_SCHEDULE and not AdminAccount.access_set() and not cherrypy.session.get('staffer_id'):
             return "The " + c.EVENT_NAME + " schedule is being developed and will be made public when it's closer to being finalized."
@@ -83,16 +83,17 @@ class Root:
         })
 
     @csv_file
-    def panels(self, out, session):
-        out.writerow(['Panel', 'Time', 'Duration', 'Room', 'Description', 'Panelists'])
-        for event in sorted(session.query(Event).all(), key=lambda e: [e.start_time, e.location_label]):
+    def panels(self, session):
+        yield ['Panel', 'Time', 'Duration', 'Room', 'Description', 'Panelists']
+        events = session.query(Event).load('assigned_panelists.attendee').all()
+        for event in sorted(events, key=lambda e: [e.start_time, e.location_label]):
             if 'Panel' in event.location_label or 'Autograph' in event.location_label:
-                out.writerow([event.name,
-                              event.start_time_local.strftime('%I%p %a').lstrip('0'),
-                              '{} minutes'.format(event.minutes),
-                              event.location_label,
-                              event.description,
-                              ' / '.join(ap.attendee.full_name for ap in sorted(event.assigned_panelists, key=lambda ap: ap.attendee.full_name))])
+                yield [event.name,
+                       event.start_time_local.strftime('%I%p %a').lstrip('0'),
+                       '{} minutes'.format(event.minutes),
+                       event.location_label,
+                       event.description,
+                       ' / '.join(ap.attendee.full_name for ap in sorted(event.assigned_panelists, key=lambda ap: ap.attendee.full_name))]
 
     @unrestricted
     def now(self, session, when=None):
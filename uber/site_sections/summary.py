@@ -1,27 +1,124 @@
 from uber.common import *
 
 
+@StatsSnapshot.register(Attendee, Group)
+def registration_stats(session):
+    stats = AttendeeStats(session)
+    return {
+        'total_count':   stats.total,
+        'shirt_sizes':   stats.breakdown('shirt', c.SHIRT_OPTS),
+        'paid_counts':   stats.breakdown('paid', c.PAYMENT_OPTS),
+        'badge_counts':  [(desc, stats.count(badge_type=bt), stats.count(paid=c.NOT_PAID, badge_type=bt), stats.count(paid=c.HAS_PAID, badge_type=bt)) for bt, desc in c.BADGE_OPTS],
+        'aff_counts':    [(aff['text'], stats.count(badge_type=c.SUPPORTER_BADGE, affiliate=aff['text'], paid=c.HAS_PAID), stats.count(badge_type=c.SUPPORTER_BADGE, affiliate=aff['text'], paid=c.NOT_PAID)) for aff in session.affiliates()],
+        'checkin_count': stats.count(checked_in=False),
+        'paid_noshows':  stats.count(paid=c.HAS_PAID, checked_in=False) + stats.count(paid=c.PAID_BY_GROUP, group_paid=True, checked_in=False),
+        'free_noshows':  stats.count(paid=c.NEED_NOT_PAY, checked_in=False),
+        'interests':     stats.multichoice_breakdown('interests', c.INTEREST_OPTS, paid=c.NOT_PAID),
+        'age_counts':    stats.breakdown('age_group', c.AGE_GROUP_OPTS),
+        'paid_group':    stats.count(paid=c.PAID_BY_GROUP, group_paid=True),
+        'free_group':    stats.count(paid=c.PAID_BY_GROUP, group_paid=False),
+        'shirt_sales':   stats.registered_by_week(Attendee.shirt != c.NO_SHIRT),
+        'ribbons':       stats.breakdown('ribbon', [(val, desc) for val, desc in c.RIBBON_OPTS if val != c.NO_RIBBON]),
+    }
+
+
+@StatsSnapshot.register(Attendee)
+def department_requests(session):
+    attendees = session.query(Attendee).filter_by(staffing=True).order_by(Attendee.full_name).all()
+    summarize = lambda a: {'id': a.id, 'full_name': a.full_name, 'email': a.email, 'ribbon': a.ribbon}
+    everything = []
+    for department, name in c.JOB_LOCATION_OPTS:
+        assigned = [a for a in attendees if department in a.assigned_depts_ints]
+        unassigned = [a for a in attendees if department in a.requested_depts_ints and a not in assigned]
+        everything.append([name, [summarize(a) for a in assigned], [summarize(a) for a in unassigned]])
+    return {'everything': everything}
+
+
+@StatsSnapshot.register(Attendee, FoodRestrictions, Shift, Job)
+def food_restriction_counts(session):
+    all_fr = session.query(FoodRestrictions).all()
+    guests = session.query(Attendee).filter_by(badge_type=c.GUEST_BADGE).count()
+    volunteers = len([a for a in session.query(Attendee).filter_by(staffing=True).all()
+                        if a.badge_type == c.STAFF_BADGE or a.weighted_hours or not a.takes_shifts])
+    return {
+        'guests': guests,
+        'volunteers': volunteers,
+        'notes': [fr.freeform for fr in all_fr if getattr(fr, 'freeform', '')],
+        'standard': {
+            c.FOOD_RESTRICTIONS[globals()[category]]: len([fr for fr in all_fr if getattr(fr, category)])
+            for category in c.FOOD_RESTRICTION_VARS
+        },
+        'sandwich_prefs': {
+            sandtype: len([fr for fr in all_fr if fr.sandwich_pref == globals()[sandtype]])
+            for sandtype in c.SANDWICH_VARS
+        },
+        'no_cheese': len([fr for fr in all_fr if fr.no_cheese])
+    }
+
+
+@StatsSnapshot.register(Attendee, Job, Shift)
+def staffing_totals(session):
+    rollup = StaffingRollup(session)
+    return {
+        'hour_total': rollup.offered_hours(),
+        'shift_total': rollup.taken_hours(),
+        'volunteers': rollup.volunteers,
+        'departments': rollup.departments()
+    }
+
+
+@StatsSnapshot.register(Attendee, Shift, Job)
+def shirt_totals(session):
+    counts = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    labels = ['size unknown'] + [label for val, label in c.SHIRT_OPTS][1:]
+    sort = lambda d: sorted(d.items(), key=lambda tup: labels.index(tup[0]))
+    label = lambda s: 'size unknown' if s == 'no shirt' else s
+    status = lambda got_merch: 'picked_up' if got_merch else 'outstanding'
+    for attendee in session.query(Attendee).all():
+        if attendee.gets_free_shirt:
+            counts['free'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
+            counts['all'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
+        if attendee.gets_paid_shirt:
+            counts['paid'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
+            counts['all'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
+    return {
+        'categories': [
+            ('Eligible free', sort(counts['free'])),
+            ('Paid', sort(counts['paid'])),
+            ('All pre-ordered', sort(counts['all']))
+        ]
+    }
+
+
+def csv_converter(col):
+    """
+    Returns a function which formats values of the given column for our CSV
+    exports, so that we only have to check each column's type once per export
+    rather than once per cell.
+    """
+    if isinstance(col.type, Choice):
+        # Choice columns are integers with a single value, so we use its label
+        labels = dict(col.type.choices)
+        return lambda val: '' if val is None else labels[int(val)]
+    elif isinstance(col.type, MultiChoice):
+        # MultiChoice columns are comma-separated integer lists, so we use
+        # each of their labels, separated with slashes
+        labels = dict(col.type.choices)
+        return lambda val: ' / '.join(sorted(labels[int(i)] for i in str(val).split(',') if int(i) in labels)) if val else ''
+    elif isinstance(col.type, UTCDateTime):
+        # Use the empty string if this is null, otherwise use strftime.
+        # Also you should fill in whatever actual format you want.
+        return lambda val: val.strftime('%Y-%m-%d %H:%M:%S') if val else ''
+    else:
+        # For everything else we'll just dump the value, although we might
+        # consider adding more special cases for things like foreign keys.
+        return lambda val: val
+
+
 @all_renderable(c.STATS)
 class Root:
-    def index(self, session):
-        attendees, groups = session.everyone()
-        count = lambda **kwargs: len([a for a in attendees if all(val == getattr(a, name) for name, val in kwargs.items())])
-        return {
-            'total_count':   len(attendees),
-            'shirt_sizes':   [(desc, count(shirt=shirt)) for shirt, desc in c.SHIRT_OPTS],
-            'paid_counts':   [(desc, count(paid=status)) for status, desc in c.PAYMENT_OPTS],
-            'badge_counts':  [(desc, count(badge_type=bt), count(paid=c.NOT_PAID, badge_type=bt), count(paid=c.HAS_PAID, badge_type=bt)) for bt, desc in c.BADGE_OPTS],
-            'aff_counts':    [(aff['text'], count(badge_type=c.SUPPORTER_BADGE, affiliate=aff['text'], paid=c.HAS_PAID), count(badge_type=c.SUPPORTER_BADGE, affiliate=aff['text'], paid=c.NOT_PAID)) for aff in session.affiliates()],
-            'checkin_count': count(checked_in=None),
-            'paid_noshows':  count(paid=c.HAS_PAID, checked_in=None) + len([a for a in attendees if a.paid == c.PAID_BY_GROUP and a.group.amount_paid and not a.checked_in]),
-            'free_noshows':  count(paid=c.NEED_NOT_PAY, checked_in=None),
-            'interests':     [(desc, len([a for a in attendees if a.paid == c.NOT_PAID and dept in a.interests_ints])) for dept, desc in c.INTEREST_OPTS],
-            'age_counts':    [(desc, count(age_group=ag)) for ag, desc in c.AGE_GROUP_OPTS],
-            'paid_group':    len([a for a in attendees if a.paid == c.PAID_BY_GROUP and a.group.amount_paid]),
-            'free_group':    len([a for a in attendees if a.paid == c.PAID_BY_GROUP and not a.group.amount_paid]),
-            'shirt_sales':   [(i, len([a for a in attendees if a.registered <= datetime.now(UTC) - timedelta(days=i * 7) and a.shirt != c.NO_SHIRT])) for i in range(50)],
-            'ribbons':       [(desc, count(ribbon=val)) for val, desc in c.RIBBON_OPTS if val != c.NO_RIBBON],
-        }
+    def index(self, session, live=False):
+        return StatsSnapshot.get(session, registration_stats, boolean_param(live))
 
     def affiliates(self, session):
         class AffiliateCounts:
@@ -50,72 +147,38 @@ class Root:
                            for amount, desc in sorted(c.DONATION_TIERS.items()) if amount]
         }
 
-    def departments(self, session):
-        attendees = session.query(Attendee).filter_by(staffing=True).order_by(Attendee.full_name).all()
-        everything = []
-        for department, name in c.JOB_LOCATION_OPTS:
-            assigned = [a for a in attendees if department in a.assigned_depts_ints]
-            unassigned = [a for a in attendees if department in a.requested_depts_ints and a not in assigned]
-            everything.append([name, assigned, unassigned])
-        return {'everything': everything}
+    def departments(self, session, live=False):
+        return StatsSnapshot.get(session, department_requests, boolean_param(live))
 
     def found_how(self, session):
         return {'all': sorted([a.found_how for a in session.query(Attendee).filter(Attendee.found_how != '').all()], key=lambda s: s.lower())}
 
     def all_schedules(self, session):
-        return {'staffers': [a for a in session.query(Attendee).filter_by(staffing=True).order_by(Attendee.full_name) if a.shifts]}
+        return {'staffers': [a for a in session.query(Attendee).filter_by(staffing=True).load('shifts.job').order_by(Attendee.full_name) if a.shifts]}
 
-    def food_restrictions(self, session):
-        all_fr = session.query(FoodRestrictions).all()
-        guests = session.query(Attendee).filter_by(badge_type=c.GUEST_BADGE).count()
-        volunteers = len([a for a in session.query(Attendee).filter_by(staffing=True).all()
-                            if a.badge_type == c.STAFF_BADGE or a.weighted_hours or not a.takes_shifts])
-        return {
-            'guests': guests,
-            'volunteers': volunteers,
-            'notes': filter(bool, [getattr(fr, 'freeform', '') for fr in all_fr]),
-            'standard': {
-                c.FOOD_RESTRICTIONS[globals()[category]]: len([fr for fr in all_fr if getattr(fr, category)])
-                for category in c.FOOD_RESTRICTION_VARS
-            },
-            'sandwich_prefs': {
-                sandtype: len([fr for fr in all_fr if fr.sandwich_pref == globals()[sandtype]])
-                for sandtype in c.SANDWICH_VARS
-            },
-            'no_cheese': len([fr for fr in all_fr if fr.no_cheese])
-        }
+    def food_restrictions(self, session, live=False):
+        return StatsSnapshot.get(session, food_restriction_counts, boolean_param(live))
 
     def ratings(self, session):
         return {'attendees': [a for a in session.query(Attendee).filter_by(staffing=True).order_by(Attendee.full_name).all()
                                 if 'poorly' in a.past_years]}
 
-    def staffing_overview(self, session):
-        jobs, shifts, attendees = session.everything()
-        return {
-            'hour_total': sum(j.weighted_hours * j.slots for j in jobs),
-            'shift_total': sum(s.job.weighted_hours for s in shifts),
-            'volunteers': len(attendees),
-            'departments': [{
-                'department': desc,
-                'assigned': len([a for a in attendees if dept in a.assigned_depts_ints]),
-                'total_hours': sum(j.weighted_hours * j.slots for j in jobs if j.location == dept),
-                'taken_hours': sum(s.job.weighted_hours for s in shifts if s.job.location == dept)
-            } for dept, desc in c.JOB_LOCATION_OPTS]
-        }
+    def staffing_overview(self, session, live=False):
+        return StatsSnapshot.get(session, staffing_totals, boolean_param(live))
 
     @csv_file
-    def personalized_badges(self, out, session):
-        for a in session.query(Attendee).filter(Attendee.badge_num != 0).order_by('badge_num').all():
-            out.writerow([a.badge_num, a.badge_type_label, a.badge_printed_name or a.full_name])
+    def personalized_badges(self, session):
+        for a in session.query(Attendee).filter(Attendee.badge_num != 0).order_by('badge_num').yield_per(c.CSV_BATCH_SIZE):
+            yield [a.badge_num, a.badge_type_label, a.badge_printed_name or a.full_name]
         for a in session.query(Attendee).filter(Attendee.badge_type == c.STAFF_BADGE,
-                                                Attendee.amount_extra >= c.SUPPORTER_LEVEL).order_by(Attendee.full_name).all():
-            out.writerow(['', 'Supporter', a.badge_printed_name or a.full_name])
+                                                Attendee.amount_extra >= c.SUPPORTER_LEVEL).order_by(Attendee.full_name).yield_per(c.CSV_BATCH_SIZE):
+            yield ['', 'Supporter', a.badge_printed_name or a.full_name]
 
     def food_eligible(self, session):
         cherrypy.response.headers['Content-Type'] = 'application/xml'
         eligible = {
             a: {attr.lower(): getattr(a.food_restrictions, attr, False) for attr in c.FOOD_RESTRICTION_VARS}
-            for a in session.query(Attendee).order_by(Attendee.full_name).all()
+            for a in session.query(Attendee).load('food_restrictions', 'shifts.job').order_by(Attendee.full_name).all()
             if not a.is_unassigned
                 and (a.badge_type in (c.STAFF_BADGE, c.GUEST_BADGE)
                   or a.ribbon == c.VOLUNTEER_RIBBON and a.weighted_hours >= 12)
@@ -128,65 +191,30 @@ class Root:
             out.writerow([a.badge_num, a.full_name])
 
     @csv_file
-    def all_attendees(self, out, session):
+    def all_attendees(self, session):
         cols = [getattr(Attendee, col.name) for col in Attendee.__table__.columns]
-        out.writerow([col.name for col in cols])
-
-        for attendee in session.query(Attendee).filter(Attendee.first_name != '').order_by(Attendee.badge_num).all():
-            row = []
-            for col in cols:
-                if isinstance(col.type, Choice):
-                    # Choice columns are integers with a single value with an automatic
-                    # _label property, e.g. the "shirt" column has a "shirt_label"
-                    # property, so we'll use that.
-                    row.append(getattr(attendee, col.name + '_label'))
-                elif isinstance(col.type, MultiChoice):
-                    # MultiChoice columns are comma-separated integer lists with an
-                    # automatic _labels property which is a list of string labels.
-                    # So we'll get that and then separate the labels with slashes.
-                    row.append(' / '.join(getattr(attendee, col.name + '_labels')))
-                elif isinstance(col.type, UTCDateTime):
-                    # Use the empty string if this is null, otherwise use strftime.
-                    # Also you should fill in whatever actual format you want.
-                    val = getattr(attendee, col.name)
-                    row.append(val.strftime('%Y-%m-%d %H:%M:%S') if val else '')
-                else:
-                    # For everything else we'll just dump the value, although we might
-                    # consider adding more special cases for things like foreign keys.
-                    row.append(getattr(attendee, col.name))
-            out.writerow(row)
-
-    def shirt_counts(self, session):
-        counts = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-        labels = ['size unknown'] + [label for val, label in c.SHIRT_OPTS][1:]
-        sort = lambda d: sorted(d.items(), key=lambda tup: labels.index(tup[0]))
-        label = lambda s: 'size unknown' if s == 'no shirt' else s
-        status = lambda got_merch: 'picked_up' if got_merch else 'outstanding'
-        for attendee in session.query(Attendee).all():
-            if attendee.gets_free_shirt:
-                counts['free'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
-                counts['all'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
-            if attendee.gets_paid_shirt:
-                counts['paid'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
-                counts['all'][label(attendee.shirt_label)][status(attendee.got_merch)] += 1
-        return {
-            'categories': [
-                ('Eligible free', sort(counts['free'])),
-                ('Paid', sort(counts['paid'])),
-                ('All pre-ordered', sort(counts['all']))
-            ]
-        }
+        converters = [csv_converter(col) for col in cols]
+        yield [col.name for col in cols]
+
+        # we query the columns themselves rather than Attendee objects, since we don't
+        # need any properties and this avoids building thousands of model instances
+        for values in session.query(*cols).filter(Attendee.first_name != '').order_by(Attendee.badge_num).yield_per(c.CSV_BATCH_SIZE):
+            yield [convert(val) for convert, val in zip(converters, values)]
+
+    def shirt_counts(self, session, live=False):
+        return StatsSnapshot.get(session, shirt_totals, boolean_param(live))
 
     def extra_merch(self, session):
         return {'attendees': session.query(Attendee).filter(Attendee.extra_merch != '').order_by(Attendee.full_name).all()}
 
     def restricted_untaken(self, session):
         jobs, shifts, attendees = session.everything()
-        untaken = defaultdict(lambda: defaultdict(list))
+        untaken = defaultdict(list)
+        untaken_masks = defaultdict(int)
         for job in jobs:
             if job.restricted and job.slots_taken < job.slots:
-                for hour in job.hours:
-                    untaken[job.location][hour].append(job)
+                untaken[job.location].append(job)
+                untaken_masks[job.location] |= job.hour_mask
         flagged = []
         for attendee in attendees:
             if attendee.trusted and not attendee.is_dept_head:
@@ -194,25 +222,20 @@ class Root:
                 for shift in attendee.shifts:
                     if not shift.job.restricted:
                         for dept in attendee.assigned_depts_ints:
-                            for hour in shift.job.hours:
-                                if hour in untaken[dept]:
-                                    overlapping[shift.job].update(untaken[dept][hour])
+                            if shift.job.hour_mask & untaken_masks[dept]:
+                                overlapping[shift.job].update(job for job in untaken[dept] if job.hour_mask & shift.job.hour_mask)
                 if overlapping:
                     flagged.append([attendee, sorted(overlapping.items(), key=lambda tup: tup[0].start_time)])
         return {'flagged': flagged}
 
     def consecutive_threshold(self, session):
-        def exceeds_threshold(start_time, attendee):
-            time_slice = [start_time + timedelta(hours=i) for i in range(18)]
-            return len([h for h in attendee.hours if h in time_slice]) > 12
+        windows = [hour_mask(start_time, 18) for start_time, desc in c.START_TIME_OPTS[::6]]
         jobs, shifts, attendees = session.everything()
         flagged = []
         for attendee in attendees:
             if attendee.staffing and attendee.weighted_hours > 12:
-                for start_time, desc in c.START_TIME_OPTS[::6]:
-                    if exceeds_threshold(start_time, attendee):
-                        flagged.append(attendee)
-                        break
+                if any(bin(attendee.hour_mask & window).count('1') > 12 for window in windows):
+                    flagged.append(attendee)
         return {'flagged': flagged}
 
     def setup_teardown_neglect(self, session):
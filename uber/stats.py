@@ -0,0 +1,157 @@
+from uber.common import *
+
+
+class AttendeeStats:
+    """
+    Counts attendees by any combination of the fields in AttendeeStats.fields,
+    e.g. AttendeeStats(session).count(badge_type=c.STAFF_BADGE, paid=c.NEED_NOT_PAY)
+
+    Rather than loading every attendee and scanning the full list once for
+    each number we want, we do a single GROUP BY query over all of these
+    fields and then tally the (much smaller) list of grouped rows.  Tallies
+    are cached by the set of fields they're keyed on, so asking for the count
+    of every badge type only walks the grouped rows once.
+
+    In addition to the attendee columns listed in fields, each row has a
+    checked_in boolean and a group_paid boolean for whether the attendee's
+    group has paid us anything.  Extra SQL filters can be passed to only count
+    some attendees, e.g. AttendeeStats(session, Attendee.staffing == True)
+    """
+    fields = ['badge_type', 'paid', 'shirt', 'age_group', 'ribbon', 'affiliate', 'interests', 'checked_in', 'group_paid']
+
+    def __init__(self, session, *criteria):
+        self.session, self.criteria = session, criteria
+        columns = [getattr(Attendee, name) for name in self.fields[:-2]] + [
+            Attendee.checked_in != None,
+            case([(Group.amount_paid > 0, True)], else_=False)
+        ]
+        query = session.query(func.count(Attendee.id), *columns).outerjoin(Attendee.group)
+        self.rows = [(row[0], dict(zip(self.fields, row[1:])))
+                     for row in query.filter(*criteria).group_by(*columns).all()]
+        self.tallies = {}
+
+    @property
+    def total(self):
+        return sum(count for count, row in self.rows)
+
+    def tally(self, *fields):
+        """
+        Returns a dictionary mapping tuples of values of the given fields to the
+        number of attendees with those values, e.g. tally('paid', 'badge_type')
+        returns {(c.HAS_PAID, c.ATTENDEE_BADGE): 123, ...}
+        """
+        if fields not in self.tallies:
+            tally = defaultdict(int)
+            for count, row in self.rows:
+                tally[tuple(bool(row[name]) if name in ['checked_in', 'group_paid'] else row[name] for name in fields)] += count
+            self.tallies[fields] = tally
+        return self.tallies[fields]
+
+    def count(self, **kwargs):
+        fields = tuple(sorted(kwargs))
+        return self.tally(*fields).get(tuple(kwargs[name] for name in fields), 0)
+
+    def breakdown(self, field, opts, **kwargs):
+        """
+        Returns a list of (description, count) tuples for each of the given
+        options of the given field, e.g. breakdown('shirt', c.SHIRT_OPTS)
+        """
+        return [(desc, self.count(**dict(kwargs, **{field: val}))) for val, desc in opts]
+
+    def multichoice_breakdown(self, field, opts, **kwargs):
+        """
+        Like breakdown() but for MultiChoice columns, where each attendee can
+        be counted towards more than one option.
+        """
+        counts = defaultdict(int)
+        fields = tuple(sorted(kwargs))
+        for key, count in self.tally(field, *fields).items():
+            if key[1:] == tuple(kwargs[name] for name in fields) and key[0]:
+                for val in set(str(key[0]).split(',')):
+                    counts[int(val)] += count
+        return [(desc, counts[val]) for val, desc in opts]
+
+    def registered_by_week(self, *criteria, weeks=50):
+        """
+        Returns a list of (i, count) tuples with the number of attendees who had
+        registered by i weeks ago for each of the last few weeks.  We only load
+        the registration dates which fall within that window; everyone else is
+        counted towards every week with a single COUNT query.
+        """
+        now = datetime.now(UTC)
+        cutoff = now - timedelta(days=7 * weeks)
+        query = self.session.query(Attendee.registered).filter(*(self.criteria + criteria))
+        older = query.filter(Attendee.registered <= cutoff).count()
+        weeks_ago = [0] * weeks
+        for registered, in query.filter(Attendee.registered > cutoff):
+            weeks_ago[min(weeks - 1, (now - registered).days // 7)] += 1
+
+        totals, total = [], older
+        for i in reversed(range(weeks)):
+            total += weeks_ago[i]
+            totals.append((i, total))
+        return list(reversed(totals))
+
+
+class StaffingRollup:
+    """
+    Totals the shift hours offered and taken in each department, split by
+    whether the jobs are restricted, along with how many volunteers there are
+    and how many are assigned to each department.
+
+    Rather than loading every job, shift and volunteer and then summing them
+    again for every department, each of these is a single GROUP BY query, so
+    the work done in Python is proportional to the number of departments.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.offered = {(location, bool(restricted)): hours or 0 for location, restricted, hours in
+                        session.query(Job.location, Job.restricted, func.sum(Job.weighted_hours * Job.slots))
+                               .group_by(Job.location, Job.restricted)}
+
+        self.taken, self.shift_counts = {}, {}
+        for location, restricted, hours, count in session.query(Job.location, Job.restricted, func.sum(Job.weighted_hours), func.count(Shift.id)) \
+                                                         .join(Shift.job).group_by(Job.location, Job.restricted):
+            self.taken[location, bool(restricted)] = hours or 0
+            self.shift_counts[location, bool(restricted)] = count
+
+        volunteers = session.query(Attendee.id).filter_by(staffing=True)
+        self.volunteers = volunteers.count()
+        self.assigned = dict(session.query(MultiChoiceValue.value, func.count(MultiChoiceValue.fk_id))
+                                    .filter_by(model=Attendee.__tablename__, field='assigned_depts')
+                                    .filter(MultiChoiceValue.fk_id.in_(volunteers.subquery()))
+                                    .group_by(MultiChoiceValue.value))
+
+    @staticmethod
+    def _total(totals, location, restricted):
+        return sum(hours for (loc, restr), hours in totals.items()
+                   if (location is None or loc == int(location)) and (restricted is None or restr == restricted))
+
+    def offered_hours(self, location=None, restricted=None):
+        return self._total(self.offered, location, restricted)
+
+    def taken_hours(self, location=None, restricted=None):
+        return self._total(self.taken, location, restricted)
+
+    def shifts(self, location=None, restricted=None):
+        return self._total(self.shift_counts, location, restricted)
+
+    def assigned_count(self, location):
+        return self.assigned.get(int(location), 0)
+
+    def departments(self):
+        return [{
+            'department': desc,
+            'assigned': self.assigned_count(dept),
+            'total_hours': self.offered_hours(dept),
+            'taken_hours': self.taken_hours(dept)
+        } for dept, desc in c.JOB_LOCATION_OPTS]
+
+    def hours_by_staffer(self, location):
+        """
+        Returns a dictionary mapping attendee ids to the weighted hours of the
+        shifts they've signed up for in the given department.
+        """
+        return defaultdict(int, self.session.query(Shift.attendee_id, func.sum(Job.weighted_hours))
+                                            .join(Shift.job).filter(Job.location == location)
+                                            .group_by(Shift.attendee_id))
@@ -0,0 +1,56 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def account_id():
+    with Session() as session:
+        attendee = session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one()
+        account = AdminAccount(attendee=attendee, access=str(c.PEOPLE))
+        session.add(account)
+        session.commit()
+        return account.id
+
+
+@pytest.fixture(autouse=True)
+def no_identity():
+    cherrypy.request.admin_identity = None
+
+
+def test_not_logged_in():
+    assert AdminAccount.access_set() == set()
+    assert AdminAccount.admin_name() is None
+    assert not AdminAccount.is_nick()
+
+
+def test_logged_in(account_id):
+    cherrypy.session['account_id'] = account_id
+    assert AdminAccount.access_set() == {c.PEOPLE}
+    assert AdminAccount.admin_name() == 'Regular Attendee'
+    assert c.HAS_PEOPLE_ACCESS and not c.HAS_ACCOUNTS_ACCESS
+
+
+def test_cached_per_request(account_id):
+    cherrypy.session['account_id'] = account_id
+    identity = AdminIdentity.current()
+    AdminAccount.access_set(), AdminAccount.admin_name(), c.HAS_PEOPLE_ACCESS
+    assert AdminIdentity.current() is identity
+
+
+def test_access_set_is_a_copy(account_id):
+    cherrypy.session['account_id'] = account_id
+    AdminAccount.access_set().discard(c.PEOPLE)
+    assert AdminAccount.access_set() == {c.PEOPLE}
+
+
+def test_invalidated_on_edit(account_id):
+    cherrypy.session['account_id'] = account_id
+    assert AdminAccount.access_set() == {c.PEOPLE}
+    with Session() as session:
+        session.admin_account(account_id).access = '{},{}'.format(c.PEOPLE, c.ACCOUNTS)
+    assert AdminAccount.access_set() == {c.PEOPLE, c.ACCOUNTS}
+
+
+def test_login_changes_identity(account_id):
+    assert AdminAccount.access_set() == set()
+    cherrypy.session['account_id'] = account_id
+    assert AdminAccount.access_set() == {c.PEOPLE}
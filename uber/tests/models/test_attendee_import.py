@@ -0,0 +1,60 @@
+from io import BytesIO
+from uber.tests import *
+
+
+def csv_bytes(*rows):
+    out = StringIO()
+    csv.writer(out).writerows(rows)
+    return BytesIO(out.getvalue().encode('utf-8'))
+
+
+def test_creates_and_updates():
+    with Session() as session:
+        existing = session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one()
+        importer = AttendeeImport(session)
+        importer.run(csv_bytes(
+            ['id', 'first_name', 'last_name', 'paid', 'interests'],
+            [existing.id, 'Irregular', '', '', ''],
+            ['', 'New', 'Attendee', c.PAYMENTS[c.NEED_NOT_PAY], ' / '.join([c.INTERESTS[c.ARCADE], c.INTERESTS[c.CONSOLE]])]
+        ))
+        assert (importer.created, importer.updated, importer.errors) == (1, 1, [])
+        assert existing.first_name == 'Irregular' and existing.last_name == 'Attendee'
+        new = session.query(Attendee).filter_by(first_name='New').one()
+        assert new.paid == c.NEED_NOT_PAY and new.interests_ints == [c.ARCADE, c.CONSOLE]
+
+
+def test_bad_rows_reported():
+    with Session() as session:
+        importer = AttendeeImport(session)
+        importer.run(csv_bytes(
+            ['first_name', 'last_name', 'paid'],
+            ['Good', 'Row', ''],
+            ['Bad', 'Row', 'not a payment status']
+        ))
+        assert importer.created == 1
+        assert [row_num for row_num, error in importer.errors] == [3]
+
+
+def test_unknown_columns():
+    with Session() as session:
+        pytest.raises(ValueError, AttendeeImport(session).run, csv_bytes(['first_name', 'not_a_column']))
+
+
+def test_bulk_insert():
+    with Session() as session:
+        before = session.query(Tracking).count()
+        importer = AttendeeImport(session, bulk=True)
+        importer.run(csv_bytes(['first_name', 'last_name'], ['Bulk', 'One'], ['Bulk', 'Two']))
+        assert importer.created == 2
+        assert session.query(Attendee).filter_by(first_name='Bulk').count() == 2
+        session.flush()
+        assert session.query(Tracking).count() == before + 1
+        assert session.query(Tracking).filter_by(which='2 imported Attendees').one().fk_id is None
+
+
+def test_bulk_insert_indexes_departments():
+    dept = c.JOB_LOCATION_OPTS[0][0]
+    with Session() as session:
+        importer = AttendeeImport(session, bulk=True)
+        importer.run(csv_bytes(['first_name', 'last_name', 'assigned_depts'], ['Bulk', 'Staffer', c.JOB_LOCATIONS[dept]]))
+        assert [a.first_name for a in session.query(Attendee).has_choice(assigned_depts=dept)] == ['Bulk']
@@ -0,0 +1,96 @@
+from uber.tests import *
+
+
+@pytest.fixture(autouse=True)
+def unreconciled():
+    BadgeCounts.reconciled = None
+
+
+def assert_counts_match():
+    with Session() as session:
+        assert BadgeCounts.counts == BadgeCounts.query_counts(session)
+
+
+def test_initial_counts():
+    assert c.BADGES_SOLD == 0
+    assert c.SUPPORTER_COUNT == 0
+
+
+def test_paid_attendee():
+    c.BADGES_SOLD
+    with Session() as session:
+        session.add(Attendee(first_name='Paid', last_name='Attendee', paid=c.HAS_PAID,
+                             amount_extra=c.SUPPORTER_LEVEL))
+    assert BadgeCounts.counts == {'badges_sold': 1, 'supporter_count': 1}
+    assert_counts_match()
+
+
+def test_rollback_discards_changes():
+    c.BADGES_SOLD
+    with Session() as session:
+        session.add(Attendee(first_name='Paid', last_name='Attendee', paid=c.HAS_PAID))
+        session.flush()
+        session.rollback()
+    assert BadgeCounts.counts['badges_sold'] == 0
+
+
+def test_unpaying_and_deleting():
+    with Session() as session:
+        session.add(Attendee(first_name='Paid', last_name='Attendee', paid=c.HAS_PAID))
+    c.BADGES_SOLD
+    with Session() as session:
+        session.query(Attendee).filter_by(first_name='Paid').one().paid = c.NOT_PAID
+    assert BadgeCounts.counts['badges_sold'] == 0
+    with Session() as session:
+        session.query(Attendee).filter_by(first_name='Paid').one().paid = c.HAS_PAID
+    assert BadgeCounts.counts['badges_sold'] == 1
+    with Session() as session:
+        session.delete(session.query(Attendee).filter_by(first_name='Paid').one())
+    assert BadgeCounts.counts['badges_sold'] == 0
+
+
+def test_group_payment():
+    with Session() as session:
+        group = Group(name='Test Group')
+        session.add(group)
+        for i in range(3):
+            session.add(Attendee(first_name='Group', last_name=str(i), paid=c.PAID_BY_GROUP, group=group))
+    c.BADGES_SOLD
+    assert BadgeCounts.counts['badges_sold'] == 0
+    with Session() as session:
+        session.query(Group).filter_by(name='Test Group').one().amount_paid = 100
+    assert BadgeCounts.counts['badges_sold'] == 3
+    assert_counts_match()
+
+
+def test_stale_counts_are_recounted(monkeypatch):
+    c.BADGES_SOLD
+    BadgeCounts.counts['badges_sold'] = 12345
+    monkeypatch.setattr(BadgeCounts, 'reconciled', monotonic() - c.BADGE_COUNT_STALENESS - 1)
+    assert c.BADGES_SOLD == 0
+
+
+def test_released_savepoint_rolled_back():
+    c.BADGES_SOLD
+    with Session() as session:
+        with session.begin_nested():
+            session.add(Attendee(first_name='Paid', last_name='Attendee', paid=c.HAS_PAID))
+        assert BadgeCounts.counts['badges_sold'] == 0
+        session.rollback()
+    assert BadgeCounts.counts['badges_sold'] == 0
+
+
+def test_rolled_back_savepoint_keeps_earlier_changes():
+    c.BADGES_SOLD
+    with Session() as session:
+        with session.begin_nested():
+            session.add(Attendee(first_name='Kept', last_name='Attendee', paid=c.HAS_PAID))
+        try:
+            with session.begin_nested():
+                session.add(Attendee(first_name='Discarded', last_name='Attendee', paid=c.HAS_PAID))
+                session.flush()
+                raise ValueError()
+        except ValueError:
+            pass
+    assert BadgeCounts.counts['badges_sold'] == 1
+    assert_counts_match()
@@ -103,6 +103,21 @@ class TestShiftBadges:
         session.shift_badges(STAFF_BADGE, 5, up=True)
         assert [1, 2, 3, 4, 6] == self.staff_badges(session)
 
+    def test_loaded_attendees_updated(self, session):
+        session.shift_badges(STAFF_BADGE, 3, up=True)
+        assert 4 == session.staff_three.badge_num and 2 == session.staff_two.badge_num
+
+    def test_single_tracking_entry(self, session):
+        session.shift_badges(STAFF_BADGE, 2)
+        assert session.query(Tracking).filter_by(action=AUTO_BADGE_SHIFT).one().fk_id is None
+
+    def test_shift_during_flush_keeps_pending_edits(self, session):
+        session.staff_five.first_name = 'Renamed'
+        session.delete(session.staff_three)
+        session.commit()
+        assert [1, 2, 3, 4] == self.staff_badges(session)
+        assert 4 == session.staff_five.badge_num and 'Renamed' == session.staff_five.first_name
+
 
 class TestPreassignedBadgeChange:
     @pytest.fixture(autouse=True)
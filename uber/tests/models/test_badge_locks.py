@@ -0,0 +1,31 @@
+from uber.tests import *
+
+
+def test_unrelated_changes():
+    with Session() as session:
+        session.add(ApprovedEmail(subject='Unrelated'))
+        attendee = session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one()
+        attendee.admin_notes = 'Not a badge change'
+        assert BadgeLocks.badge_types(session) == []
+
+
+def test_new_staffer():
+    with Session() as session:
+        session.add(Attendee(first_name='New', last_name='Staffer', paid=c.NEED_NOT_PAY, badge_type=c.STAFF_BADGE))
+        assert BadgeLocks.badge_types(session) == [c.STAFF_BADGE]
+
+
+def test_badge_type_change():
+    with Session() as session:
+        attendee = session.query(Attendee).filter_by(first_name='One', badge_type=c.STAFF_BADGE).one()
+        attendee.badge_type = c.SUPPORTER_BADGE
+        assert BadgeLocks.badge_types(session) == sorted([c.STAFF_BADGE, c.SUPPORTER_BADGE])
+
+
+def test_released_after_flush():
+    with Session() as session:
+        session.add(Attendee(first_name='New', last_name='Staffer', paid=c.NEED_NOT_PAY, badge_type=c.STAFF_BADGE))
+        session.flush()
+        assert 'badge_locks' not in session.info
+        assert BadgeLocks.get(c.STAFF_BADGE).acquire(blocking=False)
+        BadgeLocks.get(c.STAFF_BADGE).release()
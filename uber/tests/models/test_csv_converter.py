@@ -0,0 +1,26 @@
+from uber.tests import *
+from uber.site_sections.summary import csv_converter
+
+
+def test_choice():
+    convert = csv_converter(Attendee.__table__.c.paid)
+    assert convert(None) == ''
+    assert convert(c.HAS_PAID) == 'yes'
+
+
+def test_multichoice():
+    convert = csv_converter(Attendee.__table__.c.interests)
+    assert convert('') == ''
+    assert convert('{},{}'.format(c.CONSOLE, c.ARCADE)) == ' / '.join(sorted([c.INTERESTS[c.ARCADE], c.INTERESTS[c.CONSOLE]]))
+
+
+def test_datetime():
+    convert = csv_converter(Attendee.__table__.c.checked_in)
+    assert convert(None) == ''
+    assert convert(datetime(2016, 1, 2, 3, 4, 5, tzinfo=UTC)) == '2016-01-02 03:04:05'
+
+
+def test_matches_model_labels():
+    attendee = Attendee(paid=c.NEED_NOT_PAY, interests='{}'.format(c.ARCADE))
+    assert csv_converter(Attendee.__table__.c.paid)(attendee.paid) == attendee.paid_label
+    assert csv_converter(Attendee.__table__.c.interests)(attendee.interests) == ' / '.join(attendee.interests_labels)
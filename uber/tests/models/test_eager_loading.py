@@ -0,0 +1,49 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    job = Job(name='Test Job', start_time=c.EPOCH, duration=1, slots=5, weight=1, location=c.JOB_LOCATION_OPTS[0][0])
+    for attendee in session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE):
+        session.add(Shift(attendee=attendee, job=job))
+    session.commit()
+    request.addfinalizer(session.close)
+    return session
+
+
+def weighted_hours(session, query):
+    with QueryCounter('test') as counter:
+        hours = [a.weighted_hours for a in query.filter_by(badge_type=c.STAFF_BADGE)]
+    session.expunge_all()
+    return hours, counter.counts
+
+
+def test_lazy_loads_counted(session):
+    hours, counts = weighted_hours(session, session.query(Attendee))
+    assert counts['shift'] == 5 and counts['job'] == 1
+
+
+def test_load_paths(session):
+    hours, counts = weighted_hours(session, session.query(Attendee).load('shifts.job'))
+    assert hours == [1.0] * 5
+    assert counts['attendee'] == counts['shift'] == 1 and counts['job'] <= 1
+
+
+def test_joined_scalar(session):
+    with QueryCounter('test') as counter:
+        assert {shift.job.name for shift in session.query(Shift).load('job')} == {'Test Job'}
+    assert counter.counts == {'shift': 1}
+
+
+def test_warning_threshold(session, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(log, 'warning', lambda *args: warnings.append(args))
+    monkeypatch.setattr(c, 'N_PLUS_ONE_THRESHOLD', 3)
+    weighted_hours(session, session.query(Attendee))
+    assert [args[3] for args in warnings] == ['shift']
+
+
+def test_disabled(session, monkeypatch):
+    monkeypatch.setattr(c, 'N_PLUS_ONE_THRESHOLD', 0)
+    assert weighted_hours(session, session.query(Attendee))[1] == {}
@@ -24,3 +24,17 @@ def test_multi_checks():
     assert not HotelRequests().THURSDAY
     assert HotelRequests(nights='{},{}'.format(FRIDAY, SATURDAY)).FRIDAY
     assert not HotelRequests(nights='{},{}'.format(FRIDAY, SATURDAY)).SUNDAY
+
+def test_properties_added():
+    Attendee().paid_label
+    assert isinstance(Attendee.__dict__['paid_label'], property)
+    assert isinstance(Attendee.__dict__['interests_ints'], property)
+    assert isinstance(Attendee.__dict__['registered_local'], property)
+
+def test_ints_reparsed_after_change():
+    attendee = Attendee(interests=ARCADE)
+    assert [ARCADE] == attendee.interests_ints
+    attendee.interests_ints.append(CONSOLE)
+    assert [ARCADE] == attendee.interests_ints
+    attendee.interests = '{},{}'.format(ARCADE, CONSOLE)
+    assert [ARCADE, CONSOLE] == attendee.interests_ints
@@ -4,6 +4,11 @@ def test_hours():
     assert Job(start_time=EPOCH, duration=1).hours == {EPOCH}
     assert Job(start_time=EPOCH, duration=2).hours == {EPOCH, EPOCH + timedelta(hours=1)}
 
+def test_hour_mask():
+    assert Job(start_time=EPOCH, duration=2).hour_mask == 0b11 << hour_index(EPOCH)
+    assert Job(start_time=EPOCH, duration=2).hour_mask & Job(start_time=EPOCH + timedelta(hours=1), duration=1).hour_mask
+    assert not Job(start_time=EPOCH, duration=2).hour_mask & Job(start_time=EPOCH + timedelta(hours=2), duration=1).hour_mask
+
 def test_real_duration():
     assert Job(duration=2).real_duration == 2
     assert Job(duration=2, extra15=True).real_duration == 2.25
@@ -120,6 +125,24 @@ class TestAssign:
         assert not session.assign(session.staff_one.id, session.job_three.id)
 
 
+class TestNoOverlap:
+    def test_new_shift(self, session):
+        assert session.job_three.no_overlap(session.staff_one)
+        session.staff_one.shifts.append(Shift(job=session.job_two))
+        assert not session.job_three.no_overlap(session.staff_one)
+
+    def test_extra15(self, session):
+        session.staff_one.shifts.append(Shift(job=session.job_one))
+        assert session.job_three.no_overlap(session.staff_one)
+        assert not session.job_five.no_overlap(session.staff_one)
+
+    def test_cached_hours(self, session):
+        session.staff_one.shifts.append(Shift(job=session.job_one))
+        assert not session.job_two.no_overlap(session.staff_one)
+        assert session.job_three.no_overlap(session.staff_one)
+        assert session.staff_one.hour_mask == session.job_one.hour_mask
+
+
 class TestAvailableStaffers:
     @pytest.fixture(autouse=True)
     def extra_setup(self, session, monkeypatch, dept1, dept2):
@@ -144,3 +167,41 @@ class TestAvailableStaffers:
         monkeypatch.setattr(Job, 'no_overlap', lambda self, a: a in [session.staff_one, session.staff_two])
         assert session.job_one.available_staffers == [session.staff_one]
         assert session.job_four.available_staffers == [session.staff_two]
+
+
+class TestFilledSlots:
+    def test_counted(self, session):
+        assert session.job_four.filled_slots == 0
+        assert not session.assign(session.staff_one.id, session.job_four.id)
+        assert not session.assign(session.staff_two.id, session.job_four.id)
+        assert session.job(session.job_four.id).filled_slots == 2
+
+    def test_deleted_and_reassigned(self, session):
+        assert not session.assign(session.staff_one.id, session.job_four.id)
+        assert not session.assign(session.staff_two.id, session.job_four.id)
+        shift_one, shift_two = session.job_four.shifts
+        session.delete(shift_one)
+        shift_two.job = session.job_five
+        session.commit()
+        assert session.job(session.job_four.id).filled_slots == 0
+        assert session.job(session.job_five.id).filled_slots == 1
+
+
+class TestPossible:
+    @pytest.fixture(autouse=True)
+    def extra_setup(self, session, dept2):
+        session.staff_one.assigned_depts = str(dept2)
+        session.commit()
+
+    def test_open_jobs_in_department(self, session):
+        assert session.staff_one.possible == [session.job_four, session.job_five]
+
+    def test_full_and_overlapping(self, session):
+        assert not session.assign(session.staff_two.id, session.job_five.id)
+        assert not session.assign(session.staff_one.id, session.job_four.id)
+        assert session.staff_one.possible == []
+
+    def test_restricted(self, session):
+        session.staff_one.trusted = True
+        session.commit()
+        assert set(session.staff_one.possible) == {session.job_four, session.job_five, session.job_six}
@@ -0,0 +1,72 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    request.addfinalizer(session.close)
+    return session
+
+
+def all_pages(query, order, per_page=3):
+    pages, cursor = [], ''
+    while True:
+        page = query.keyset(order, cursor, per_page=per_page)
+        pages.append(page)
+        if not page.has_next:
+            return pages
+        cursor = page.next_cursor
+
+
+@pytest.mark.parametrize('order', ['last_first', '-badge_num', 'checked_in', 'group_id'])
+def test_every_row_once(session, order):
+    ids = [a.id for page in all_pages(session.query(Attendee), order) for a in page]
+    assert len(ids) == len(set(ids)) == session.query(Attendee).count()
+
+
+def test_same_order_as_sorting(session):
+    ids = [a.id for page in all_pages(session.query(Attendee), '-badge_num') for a in page]
+    by_id = sorted(session.query(Attendee).all(), key=lambda a: a.id, reverse=True)
+    expected = sorted(by_id, key=lambda a: (a.badge_num is None, -(a.badge_num or 0)))
+    assert ids == [a.id for a in expected]
+
+
+def test_tiebreaker_direction(session):
+    assert [desc for expr, desc in session.query(Tracking).keyset_keys(['-when'])] == [True, True]
+    assert [desc for expr, desc in session.query(Tracking).keyset_keys(['when'])] == [False, False]
+
+
+def test_previous_page(session):
+    first, second = all_pages(session.query(Attendee), 'last_first')[:2]
+    assert not first.has_prev and second.has_prev
+    previous = session.query(Attendee).keyset('last_first', second.prev_cursor, per_page=3)
+    assert [a.id for a in previous] == [a.id for a in first]
+    assert previous.has_next
+
+
+def test_invalid_or_mismatched_cursor(session):
+    first = session.query(Attendee).keyset('last_first', per_page=3)
+    assert [a.id for a in session.query(Attendee).keyset('last_first', 'not a cursor', per_page=3)] == [a.id for a in first]
+    assert not session.query(Attendee).keyset('badge_num', first.next_cursor, per_page=3).has_prev
+
+
+def test_datetime_cursor(session):
+    for i in range(5):
+        session.add(Tracking(model='Attendee', who='Test', which='', links='', data='', action=c.UPDATED,
+                             when=datetime.now(UTC) - timedelta(minutes=i)))
+    session.commit()
+    pages = all_pages(session.query(Tracking), '-when', per_page=2)
+    whens = [t.when for page in pages for t in page]
+    assert whens == sorted(whens, reverse=True) and len(whens) == session.query(Tracking).count()
+
+
+def test_estimated_count(session):
+    assert session.query(Attendee).estimated_count() == session.query(Attendee).count()
+
+
+def test_distinct_values_cached(session):
+    names = session.query(Attendee).distinct_values(Attendee.first_name)
+    assert names == sorted(set(names))
+    session.add(Attendee(first_name='Zebulon', last_name='Newcomer'))
+    session.commit()
+    assert session.query(Attendee).distinct_values(Attendee.first_name) == names
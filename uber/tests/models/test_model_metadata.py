@@ -0,0 +1,20 @@
+from uber.tests import *
+
+
+def test_adjustments_in_order():
+    adjustments = ModelMetadata.get(Attendee).adjustments['presave_adjustment']
+    assert adjustments.index('_misc_adjustments') < adjustments.index('_badge_adjustments') < adjustments.index('_staffing_adjustments')
+    assert '_shift_badges' in ModelMetadata.get(Attendee).adjustments['predelete_adjustment']
+
+
+def test_cost_property_names():
+    assert sorted(Group().cost_property_names) == ['amount_extra', 'badge_cost', 'table_cost']
+
+
+def test_labels():
+    assert ModelMetadata.get(Attendee).labels['paid'] == dict(PAYMENT_OPTS)
+
+
+def test_cached_per_class():
+    assert ModelMetadata.get(Attendee) is ModelMetadata.get(Attendee)
+    assert ModelMetadata.get(Attendee) is not ModelMetadata.get(Group)
@@ -0,0 +1,56 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    request.addfinalizer(session.close)
+    return session
+
+
+@pytest.fixture
+def depts():
+    return [c.JOB_LOCATION_OPTS[0][0], c.JOB_LOCATION_OPTS[1][0]]
+
+
+@pytest.fixture
+def attendee(session, depts):
+    attendee = session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one()
+    attendee.assigned_depts = ','.join(map(str, depts))
+    session.commit()
+    return attendee
+
+
+def assigned(session, dept):
+    return [a.id for a in session.query(Attendee).has_choice(assigned_depts=dept)]
+
+
+def values(session):
+    return sorted((v.model, v.field, v.value, v.fk_id) for v in session.query(MultiChoiceValue))
+
+
+def test_kept_in_sync(session, depts, attendee):
+    assert assigned(session, depts[0]) == assigned(session, depts[1]) == [attendee.id]
+    attendee.assigned_depts = str(depts[1])
+    session.commit()
+    assert assigned(session, depts[0]) == [] and assigned(session, depts[1]) == [attendee.id]
+    assert attendee.id not in [a.id for a in session.query(Attendee).lacks_choice(assigned_depts=depts[1])]
+
+
+def test_deleted(session, depts, attendee):
+    session.delete(attendee)
+    session.commit()
+    assert session.query(MultiChoiceValue).filter_by(fk_id=attendee.id).count() == 0
+
+
+def test_rebuild(session, attendee):
+    before = values(session)
+    assert before
+    MultiChoiceValue.rebuild(session)
+    session.commit()
+    assert values(session) == before
+
+
+def test_unindexed_column(session):
+    with pytest.raises(AssertionError):
+        session.query(Attendee).has_choice(interests=c.INTEREST_OPTS[0][0])
@@ -0,0 +1,75 @@
+from uber.tests import *
+
+
+class FakeBackend:
+    def __init__(self, fail=False):
+        self.fail, self.sent = fail, []
+
+    def max_send_rate(self):
+        return 1000
+
+    def send(self, source, to, cc, bcc, subject, body, format):
+        if self.fail:
+            raise Exception('mail server is down')
+        self.sent.append((to, subject))
+
+
+@pytest.fixture
+def attendee_id():
+    with Session() as session:
+        return session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one().id
+
+
+def use_backend(monkeypatch, backend):
+    monkeypatch.setattr(uber.models, 'email_transport', EmailTransport(backend=backend, workers=1, rate=1000))
+
+
+def enqueue(attendee_id):
+    with Session() as session:
+        attendee = session.attendee(attendee_id)
+        OutgoingEmail.enqueue(c.REGDESK_EMAIL, ['test@example.com'], [], [], 'Test Email', b'Hello', dest=attendee.email, model=attendee)
+
+
+def test_sent(monkeypatch, attendee_id):
+    backend = FakeBackend()
+    use_backend(monkeypatch, backend)
+    enqueue(attendee_id)
+    OutgoingEmail.send_pending()
+    assert backend.sent == [(['test@example.com'], 'Test Email')]
+    with Session() as session:
+        assert session.query(OutgoingEmail).count() == 0
+        email = session.query(Email).filter_by(fk_id=attendee_id).one()
+        assert email.subject == 'Test Email' and email.body == 'Hello'
+
+
+def test_retried_with_backoff(monkeypatch, attendee_id):
+    use_backend(monkeypatch, FakeBackend(fail=True))
+    enqueue(attendee_id)
+    OutgoingEmail.send_pending()
+    with Session() as session:
+        outgoing = session.query(OutgoingEmail).one()
+        assert outgoing.attempts == 1 and 'mail server is down' in outgoing.last_error
+        assert outgoing.next_attempt > datetime.now(UTC) + timedelta(seconds=c.EMAIL_RETRY_DELAY - 5)
+        assert session.query(Email).count() == 0
+
+    OutgoingEmail.send_pending()  # not due yet, so nothing should happen
+    with Session() as session:
+        assert session.query(OutgoingEmail).one().attempts == 1
+
+
+def test_claimed_once(attendee_id):
+    enqueue(attendee_id)
+    claimed = OutgoingEmail.claim(10)
+    assert len(claimed) == 1
+    assert OutgoingEmail.claim(10) == []
+    with Session() as session:
+        assert session.outgoing_email(claimed[0]).next_attempt > datetime.now(UTC) + timedelta(seconds=c.EMAIL_CLAIM_SECONDS - 5)
+
+
+def test_unrecorded_send_not_retried(monkeypatch, attendee_id):
+    use_backend(monkeypatch, FakeBackend())
+    monkeypatch.setattr(Session.SessionMixin, 'outgoing_email', lambda self, id: 1 / 0)
+    enqueue(attendee_id)
+    OutgoingEmail.send_pending()
+    with Session() as session:
+        assert session.query(OutgoingEmail).one().attempts == c.EMAIL_MAX_ATTEMPTS
@@ -0,0 +1,55 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def cache():
+    page_cache.clear()
+    yield page_cache
+    page_cache.clear()
+
+
+class Renderer:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return 'rendered {}'.format(self.count).encode()
+
+
+def test_cached_until_invalidated(cache):
+    render = Renderer()
+    assert cache.get('key', {'event'}, render) == b'rendered 1'
+    assert cache.get('key', {'event'}, render) == b'rendered 1'
+    cache.invalidate('attendee')
+    assert cache.get('key', {'event'}, render) == b'rendered 1'
+    cache.invalidate('event')
+    assert cache.get('key', {'event'}, render) == b'rendered 2'
+
+
+def test_invalidated_by_commit(cache):
+    render = Renderer()
+    cache.get('key', {'event'}, render)
+    with Session() as session:
+        session.add(Event(name='Test Event', location=c.EVENT_LOCATION_OPTS[0][0], start_time=c.EPOCH, duration=2))
+    assert cache.entries['key'].stale
+
+
+def test_stale_copy_served_while_regenerating(cache):
+    render = Renderer()
+    cache.get('key', set(), render)
+    entry = cache.entries['key']
+    entry.stale = True
+    with entry.lock:
+        results = []
+        thread = Thread(target=lambda: results.append(cache.get('key', set(), render)))
+        thread.start()
+        thread.join()
+    assert results == [b'rendered 1'] and render.count == 1
+
+
+def test_least_recently_used_evicted(cache, monkeypatch):
+    monkeypatch.setattr(c, 'PAGE_CACHE_SIZE', 2)
+    for key in ['a', 'b', 'a', 'c']:
+        cache.get(key, set(), Renderer())
+    assert list(cache.entries) == ['a', 'c']
@@ -0,0 +1,46 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    request.addfinalizer(session.close)
+    session.add(Attendee(first_name='Johnathan', last_name='Searchable', email='jsearch@example.com', comments='loves pinball'))
+    session.add(Attendee(first_name='Jane', last_name='Findme', email='jane@example.com', badge_num=0))
+    session.commit()
+    return session
+
+
+def names(query):
+    return sorted(a.first_name for a in query.all())
+
+
+def test_prefix_matching(session):
+    assert names(session.search('john sear')) == ['Johnathan']
+    assert names(session.search('jsearch')) == ['Johnathan']
+
+
+def test_substring_in_notes(session):
+    assert names(session.search('pinball')) == ['Johnathan']
+
+
+def test_first_and_last(session):
+    assert names(session.search('Jane Findme')) == ['Jane']
+    assert names(session.search('Findme, Jane')) == ['Jane']
+    assert names(session.search('Findme,')) == ['Jane']
+
+
+def test_badge_number(session):
+    attendee = session.query(Attendee).filter(Attendee.badge_num > 0).first()
+    assert session.search(str(attendee.badge_num)).one().id == attendee.id
+
+
+def test_special_characters(session):
+    assert names(session.search("100% o'brien_")) == []
+
+
+def test_group_name_wildcards_escaped(session):
+    session.add(Attendee(first_name='Grouped', last_name='Member', group=Group(name='Arcade Crew')))
+    session.commit()
+    assert names(session.search('arcade')) == ['Grouped']
+    assert names(session.search('arcade_crew')) == []
@@ -0,0 +1,75 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def dept():
+    return c.JOB_LOCATION_OPTS[0][0]
+
+
+@pytest.fixture
+def session(request, dept):
+    session = Session().session
+    session.staffers = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).order_by(Attendee.first_name).all()
+    for staffer in session.staffers:
+        staffer.staffing = True
+        staffer.assigned_depts = str(dept)
+    session.job_one = Job(name='Job One', start_time=c.EPOCH, duration=2, slots=3, weight=1, location=dept)
+    session.job_two = Job(name='Job Two', start_time=c.EPOCH + timedelta(hours=1), duration=2, slots=3, weight=1, location=dept)
+    session.restricted = Job(name='Restricted', start_time=c.EPOCH + timedelta(hours=4), duration=1, slots=2, weight=1, location=dept, restricted=True)
+    session.add_all([session.job_one, session.job_two, session.restricted])
+    session.commit()
+    request.addfinalizer(session.close)
+    return session
+
+
+def scheduled(session, dept, **kwargs):
+    return ShiftScheduler(session, dept, **kwargs).run()
+
+
+def test_no_overlap(session, dept):
+    plan = scheduled(session, dept).plan()
+    for attendee_id in {attendee_id for job_id, attendee_id in plan}:
+        assert not {session.job_one.id, session.job_two.id} <= {job_id for job_id, other_id in plan if other_id == attendee_id}
+    assert len([job_id for job_id, attendee_id in plan if job_id in [session.job_one.id, session.job_two.id]]) == 5
+
+
+def test_restricted(session, dept):
+    session.staffers[0].trusted = True
+    session.commit()
+    scheduler = scheduled(session, dept)
+    assert [attendee_id for job_id, attendee_id in scheduler.plan() if job_id == session.restricted.id] == [session.staffers[0].id]
+    assert [(job.id, slots) for job, slots in scheduler.unfilled_jobs] == [(session.job_two.id, 1), (session.restricted.id, 1)]
+
+
+def test_max_hours(session, dept):
+    plan = scheduled(session, dept, max_hours=1).plan()
+    assert plan == []
+
+
+def test_apply(session, dept):
+    plan = scheduled(session, dept).plan()
+    created, errors = ShiftScheduler.apply(session, plan)
+    session.commit()
+    assert created == len(plan) and not errors
+    assert session.query(Shift).count() == len(plan)
+    assert scheduled(session, dept).plan() == []
+
+
+def test_apply_skips_taken_slots(session, dept):
+    plan = scheduled(session, dept).plan()
+    session.add(Shift(job=session.job_one, attendee=session.query(Attendee).filter_by(first_name='Regular', last_name='Volunteer').one()))
+    session.commit()
+    created, errors = ShiftScheduler.apply(session, plan)
+    assert created == len(plan) - 1 and len(errors) == 1
+
+
+def test_apply_rechecks_eligibility(session, dept):
+    trusted = session.staffers[0]
+    trusted.trusted = True
+    session.commit()
+    plan = scheduled(session, dept).plan()
+    trusted.trusted = False
+    session.commit()
+    created, errors = ShiftScheduler.apply(session, plan)
+    assert created == len(plan) - 1 and len(errors) == 1
+    assert session.restricted.id not in {shift.job_id for shift in session.query(Shift)}
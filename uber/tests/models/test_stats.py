@@ -0,0 +1,79 @@
+from uber.tests import *
+
+
+def brute_force_count(session, **kwargs):
+    return len([a for a in session.query(Attendee).all() if all(getattr(a, name) == val for name, val in kwargs.items())])
+
+
+def test_counts_match_brute_force():
+    with Session() as session:
+        stats = AttendeeStats(session)
+        assert stats.total == session.query(Attendee).count()
+        for badge_type, desc in c.BADGE_OPTS:
+            for paid, desc in c.PAYMENT_OPTS:
+                assert stats.count(badge_type=badge_type, paid=paid) == brute_force_count(session, badge_type=badge_type, paid=paid)
+
+
+def test_breakdown():
+    with Session() as session:
+        stats = AttendeeStats(session)
+        assert dict(stats.breakdown('badge_type', c.BADGE_OPTS))[c.BADGES[c.STAFF_BADGE]] == 5
+        assert dict(stats.breakdown('paid', c.PAYMENT_OPTS, badge_type=c.SUPPORTER_BADGE))[c.PAYMENTS[c.NEED_NOT_PAY]] == 5
+
+
+def test_multichoice_breakdown():
+    with Session() as session:
+        session.add(Attendee(first_name='Interested', last_name='Attendee', interests='{},{}'.format(c.ARCADE, c.CONSOLE)))
+        session.commit()
+        interests = dict(AttendeeStats(session).multichoice_breakdown('interests', c.INTEREST_OPTS, paid=c.NOT_PAID))
+        assert interests[c.INTERESTS[c.ARCADE]] == 1
+        assert interests[c.INTERESTS[c.CONSOLE]] == 1
+
+
+def test_checked_in_and_group_paid():
+    with Session() as session:
+        group = Group(name='Test Group', amount_paid=100)
+        session.add(group)
+        session.add(Attendee(first_name='Group', last_name='Member', paid=c.PAID_BY_GROUP, group=group, checked_in=datetime.now(UTC)))
+        session.commit()
+        stats = AttendeeStats(session)
+        assert stats.count(paid=c.PAID_BY_GROUP, group_paid=True, checked_in=True) == 1
+        assert stats.count(paid=c.PAID_BY_GROUP, group_paid=False) == 0
+
+
+def test_registered_by_week():
+    with Session() as session:
+        total = session.query(Attendee).count()
+        weeks = AttendeeStats(session).registered_by_week(weeks=3)
+        assert weeks == [(0, total), (1, 0), (2, 0)]
+
+
+@pytest.fixture
+def staffing():
+    with Session() as session:
+        dept, other = c.JOB_LOCATION_OPTS[0][0], c.JOB_LOCATION_OPTS[1][0]
+        staffer = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).first()
+        staffer.staffing, staffer.assigned_depts = True, str(dept)
+        jobs = [
+            Job(name='Regular', location=dept, start_time=EPOCH, duration=2, weight=1, slots=3),
+            Job(name='Restricted', location=dept, start_time=EPOCH, duration=1, weight=2, slots=1, restricted=True, extra15=True),
+            Job(name='Elsewhere', location=other, start_time=EPOCH, duration=4, weight=1.5, slots=2)
+        ]
+        session.add_all(jobs)
+        session.add_all([Shift(job=jobs[0], attendee=staffer), Shift(job=jobs[1], attendee=staffer)])
+        return dept, other, staffer.id
+
+
+def test_staffing_rollup_matches_brute_force(staffing):
+    dept, other, staffer_id = staffing
+    with Session() as session:
+        rollup = StaffingRollup(session)
+        jobs, shifts = session.query(Job).all(), session.query(Shift).all()
+        for loc in [dept, other]:
+            for restricted in [True, False]:
+                assert rollup.offered_hours(loc, restricted) == sum(j.total_hours for j in jobs if j.location == loc and j.restricted == restricted)
+                assert rollup.taken_hours(loc, restricted) == sum(s.job.weighted_hours for s in shifts if s.job.location == loc and s.job.restricted == restricted)
+        assert rollup.offered_hours() == sum(j.total_hours for j in jobs)
+        assert rollup.volunteers == session.query(Attendee).filter_by(staffing=True).count()
+        assert rollup.assigned_count(dept) == len([a for a in session.query(Attendee).filter_by(staffing=True) if a.assigned_to(dept)])
+        assert rollup.hours_by_staffer(dept)[staffer_id] == 2 + 2 * 1.25
@@ -0,0 +1,99 @@
+from uber.tests import *
+
+
+def attendee_total(session):
+    return {'total': session.query(Attendee).count()}
+
+
+@pytest.fixture(autouse=True)
+def reports(monkeypatch):
+    monkeypatch.setattr(StatsSnapshot, 'reports', OrderedDict())
+    monkeypatch.setattr(StatsSnapshot, 'refreshed', {})
+    monkeypatch.setattr(StatsSnapshot, 'changed_tables', set())
+    StatsSnapshot.register(Attendee)(attendee_total)
+
+
+def add_attendee():
+    with Session() as session:
+        session.add(Attendee(first_name='Snapshot', last_name='Attendee'))
+
+
+def test_computed_on_first_read():
+    with Session() as session:
+        data = StatsSnapshot.get(session, attendee_total)
+        assert data['total'] == session.query(Attendee).count()
+        assert not data['snapshot_live']
+        assert session.query(StatsSnapshot).count() == 1
+
+
+def test_snapshot_served_until_refreshed():
+    with Session() as session:
+        before = StatsSnapshot.get(session, attendee_total)['total']
+    add_attendee()
+    with Session() as session:
+        assert StatsSnapshot.get(session, attendee_total)['total'] == before
+        assert StatsSnapshot.get(session, attendee_total, live=True)['total'] == before + 1
+        assert [s.version for s in session.query(StatsSnapshot).order_by(StatsSnapshot.version)] == [1, 2]
+
+
+def test_unchanged_results_are_not_saved_again():
+    with Session() as session:
+        StatsSnapshot.get(session, attendee_total)
+        StatsSnapshot.get(session, attendee_total, live=True)
+        assert session.query(StatsSnapshot).count() == 1
+
+
+def test_refresh_after_table_changes():
+    StatsSnapshot.refresh()
+    add_attendee()
+    assert 'attendee' in StatsSnapshot.changed_tables
+    StatsSnapshot.refresh()
+    with Session() as session:
+        trend = StatsSnapshot.trend(session, attendee_total, 'total')
+        assert [total for computed, total in trend][-1] == trend[0][1] + 1
+
+
+def test_diff():
+    old = {'total': 5, 'counts': [['a', 1], ['b', 2]]}
+    new = {'total': 6, 'counts': [['a', 1], ['b', 3]]}
+    assert StatsSnapshot.diff(old, new) == [(('counts', 1, 1), 2, 3), (('total',), 5, 6)]
+
+
+def test_released_savepoint_waits_for_commit():
+    with Session() as session:
+        with session.begin_nested():
+            session.add(Attendee(first_name='Snapshot', last_name='Attendee'))
+        assert 'attendee' not in StatsSnapshot.changed_tables
+        session.rollback()
+    assert 'attendee' not in StatsSnapshot.changed_tables
+
+
+def test_rolled_back_savepoint_keeps_earlier_changes():
+    with Session() as session:
+        with session.begin_nested():
+            session.add(Attendee(first_name='Snapshot', last_name='Attendee'))
+        try:
+            with session.begin_nested():
+                session.add(Group(name='Discarded Group'))
+                session.flush()
+                raise ValueError()
+        except ValueError:
+            pass
+    assert 'attendee' in StatsSnapshot.changed_tables and 'group' not in StatsSnapshot.changed_tables
+
+
+def test_version_saved_concurrently(monkeypatch):
+    with Session() as session:
+        StatsSnapshot.get(session, attendee_total)
+    add_attendee()
+    latest, calls = StatsSnapshot.latest, []
+    monkeypatch.setattr(StatsSnapshot, 'latest', classmethod(
+        lambda cls, session, name: calls.append(name) or (latest(session, name) if len(calls) > 1 else None)))
+    with Session() as session:
+        assert StatsSnapshot.compute(session, StatsSnapshot.report_name(attendee_total)).version == 1
+        assert session.query(StatsSnapshot).count() == 1
+
+
+def test_live_param():
+    assert boolean_param('true') and boolean_param('1')
+    assert not boolean_param('0') and not boolean_param('false') and not boolean_param(False)
@@ -0,0 +1,89 @@
+from uber.tests import *
+
+
+@pytest.fixture
+def session(request):
+    session = Session().session
+    request.addfinalizer(session.close)
+    return session
+
+
+@pytest.fixture
+def attendee(session):
+    return session.query(Attendee).filter_by(first_name='Regular', last_name='Attendee').one()
+
+
+def test_structured_changes(session, attendee):
+    attendee.first_name = 'Irregular'
+    session.commit()
+    tracked = Tracking.related(session, attendee.id).filter_by(action=c.UPDATED).one()
+    assert tracked.changed == {'first_name': ['Regular', 'Irregular']}
+    assert [(link.model, link.fk_id) for link in tracked.link_rows] == [('attendee', attendee.id)]
+
+
+def test_linked_to_foreign_keys(session):
+    group = Group(name='Linked Group')
+    session.add(group)
+    session.add(Attendee(first_name='Group', last_name='Member', group=group))
+    session.commit()
+    assert {tracked.model for tracked in Tracking.related(session, group.id)} == {'Group', 'Attendee'}
+
+
+def test_backfill(session, attendee):
+    session.add(Tracking(model='Shift', fk_id=str(uuid4()), which='<Shift>', who='Test', action=c.CREATED,
+                         links='attendee({}), job({})'.format(attendee.id, uuid4()), data=''))
+    session.commit()
+    assert Tracking.related(session, attendee.id).filter_by(model='Shift').count() == 0
+    TrackingLink.backfill(session)
+    session.commit()
+    assert Tracking.related(session, attendee.id).filter_by(model='Shift').count() == 1
+
+
+def test_search_filter(session, attendee):
+    attendee.admin_notes = '100% done'
+    session.commit()
+    assert session.query(Tracking).filter(Tracking.search_filter('100% DONE')).count() == 1
+    assert session.query(Tracking).filter(Tracking.search_filter('100_')).count() == 0
+
+
+def test_one_row_per_change(session):
+    attendees = session.query(Attendee).filter_by(badge_type=c.STAFF_BADGE).all()
+    for attendee in attendees:
+        attendee.admin_notes = 'Tracked together'
+    session.commit()
+    tracked = session.query(Tracking).filter(Tracking.data.like('%Tracked together%')).all()
+    assert sorted(t.fk_id for t in tracked) == sorted(a.id for a in attendees)
+    assert len({t.when for t in tracked}) == 1
+
+
+def test_async_tracking(monkeypatch, session, attendee):
+    monkeypatch.setattr(c, 'TRACKING_ASYNC', True)
+    attendee.admin_notes = 'Written later'
+    session.commit()
+    tracking_writer.flush()
+    assert Tracking.related(session, attendee.id).filter(Tracking.data.like('%Written later%')).count() == 1
+
+
+def test_async_rolled_back_savepoint(monkeypatch, session, attendee):
+    monkeypatch.setattr(c, 'TRACKING_ASYNC', True)
+    with session.begin_nested():
+        attendee.admin_notes = 'Kept'
+    try:
+        with session.begin_nested():
+            attendee.first_name = 'Discarded'
+            session.flush()
+            raise ValueError()
+    except ValueError:
+        pass
+    session.commit()
+    tracking_writer.flush()
+    assert {t.data.split('->')[-1].strip(" '") for t in Tracking.related(session, attendee.id).filter_by(action=c.UPDATED)} == {'Kept'}
+
+
+def test_async_released_savepoint_rolled_back(monkeypatch, session, attendee):
+    monkeypatch.setattr(c, 'TRACKING_ASYNC', True)
+    with session.begin_nested():
+        attendee.admin_notes = 'Never saved'
+    session.rollback()
+    tracking_writer.flush()
+    assert Tracking.related(session, attendee.id).filter(Tracking.data.like('%Never saved%')).count() == 0
@@ -40,6 +40,14 @@ def comma_and(xs):
     return (', ' if len(xs) > 2 else ' ').join(xs)
 
 
+def boolean_param(value):
+    """
+    Returns whether a query string parameter like ?live=true is turned on,
+    since any non-empty string (including "0" and "false") would be truthy.
+    """
+    return str(value).strip().lower() in ['1', 'true', 'yes', 'on']
+
+
 def check_csrf(csrf_token):
     """
     Accepts a csrf token (and checks the request headers if None is provided)
@@ -142,6 +150,23 @@ def hour_day_format(dt):
     return dt.astimezone(c.EVENT_TIMEZONE).strftime('%I%p ').strip('0').lower() + dt.astimezone(c.EVENT_TIMEZONE).strftime('%a')
 
 
+def hour_index(dt):
+    """
+    Returns the number of hours between c.HOUR_MASK_ORIGIN and the given time,
+    which is the bit we use to represent that hour in an hour_mask().
+    """
+    return int((dt - c.HOUR_MASK_ORIGIN).total_seconds() // 3600)
+
+
+def hour_mask(start_time, duration):
+    """
+    Returns an integer with one bit set for each hour from start_time through
+    start_time + duration hours, so that we can check whether shifts overlap
+    with bitwise math instead of comparing sets of datetimes.
+    """
+    return ((1 << duration) - 1) << hour_index(start_time)
+
+
 def send_email(source, dest, subject, body, format='text', cc=(), bcc=(), model=None):
     subject = subject.format(EVENT_NAME=c.EVENT_NAME)
     to, cc, bcc = map(listify, [dest, cc, bcc])
@@ -150,23 +175,14 @@ def send_email(source, dest, subject, body, format='text', cc=(), bcc=(), model=
             xs[:] = [email for email in xs if email.endswith('mailinator.com') or c.DEVELOPER_EMAIL in email]
 
     if c.SEND_EMAILS and to:
-        message = EmailMessage(subject=subject, **{'bodyText' if format == 'text' else 'bodyHtml': body})
-        AmazonSES(c.AWS_ACCESS_KEY, c.AWS_SECRET_KEY).sendEmail(
-            source=source,
-            toAddresses=to,
-            ccAddresses=cc,
-            bccAddresses=bcc,
-            message=message
-        )
-        sleep(0.1)  # avoid hitting rate limit
+        sa.OutgoingEmail.enqueue(source, to, cc, bcc, subject, body, format, dest=dest, model=model)
     else:
         log.error('email sending turned off, so unable to send {}', locals())
-
-    if model and dest:
-        body = body.decode('utf-8') if isinstance(body, bytes) else body
-        fk = {'model': 'n/a'} if model == 'n/a' else {'fk_id': model.id, 'model': model.__class__.__name__}
-        with sa.Session() as session:
-            session.add(sa.Email(subject=subject, dest=','.join(listify(dest)), body=body, **fk))
+        if model and dest:
+            body = body.decode('utf-8') if isinstance(body, bytes) else body
+            fk = {'model': 'n/a'} if model == 'n/a' else {'fk_id': model.id, 'model': model.__class__.__name__}
+            with sa.Session() as session:
+                session.add(sa.Email(subject=subject, dest=','.join(listify(dest)), body=body, **fk))
 
 
 class Charge:
@@ -271,6 +287,7 @@ def template_overrides(dirname):
     its own by calling this method and passing its templates directory.
     """
     django.conf.settings.TEMPLATE_DIRS.insert(0, dirname)
+    uber.decorators.template_cache.clear()
 
 
 def static_overrides(dirname):